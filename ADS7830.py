@@ -1,16 +1,9 @@
-try:
-        import smbus as smb    #type: ignore[import-not-found]
-except ImportError:
-        try:
-                import smbus2 as smb
-        except ImportError:
-                pass
-        
+from i2c_bus import open_bus
 import time
 class ADS7830:
 	def __init__(self):
 		# Get I2C bus
-		self.bus = smb.SMBus(1)    #type: ignore[assiognment]
+		self.bus = open_bus(1, 'battery')
 		# I2C address of the device
 		self.ADS7830_DEFAULT_ADDRESS			= 0x48
 		# ADS7830 Command Set
@@ -0,0 +1,125 @@
+#coding:utf-8
+
+from __future__ import annotations
+import numpy as np
+from i2c_bus import open_bus
+
+#
+# MPU6050 - native driver for the IMU, in place of the mpu6050 package.
+#
+# The package reads each axis as a separate two-byte register read, and
+# the range register again for every call, which is 14 bus transactions
+# for one accelerometer and gyro reading. Here a reading is one 14-byte
+# block read of accel, temperature and gyro, decoded as big-endian int16
+# by NumPy and scaled to the package's units: m/s^2, degrees C and
+# degrees/sec.
+#
+# At higher sample rates the chip can queue samples (accel and gyro, 12
+# bytes each) in its 1024-byte FIFO, and read_fifo drains them all in a
+# few block reads, one row per sample. If the FIFO fills up, which takes
+# 85 samples, it is reset and the samples in it are lost.
+#
+# The driver is the 'imu' client of a managed bus.
+#
+
+GRAVITY = 9.80665
+
+class MPU6050:
+
+    SMPLRT_DIV = 0x19
+    CONFIG = 0x1A
+    GYRO_CONFIG = 0x1B
+    ACCEL_CONFIG = 0x1C
+    FIFO_EN = 0x23
+    ACCEL_XOUT_H = 0x3B
+    USER_CTRL = 0x6A
+    PWR_MGMT_1 = 0x6B
+    FIFO_COUNTH = 0x72
+    FIFO_R_W = 0x74
+    WHO_AM_I = 0x75
+
+    CLOCK_PLL_XGYRO = 0x01
+    DLPF_188HZ = 0x01             # gyro output rate 1 kHz, the same as the accelerometer
+    FIFO_EN_ACCEL_GYRO = 0x78     # XG, YG, ZG and ACCEL
+    USER_CTRL_FIFO_EN = 0x40
+    USER_CTRL_FIFO_RESET = 0x04
+
+    ACCEL_RANGES = { 2 : 0x00, 4 : 0x08, 8 : 0x10, 16 : 0x18 }             # g
+    GYRO_RANGES = { 250 : 0x00, 500 : 0x08, 1000 : 0x10, 2000 : 0x18 }     # degrees/sec
+
+    DATA_LENGTH = 14
+    FIFO_SAMPLE_LENGTH = 12
+    FIFO_SIZE = 1024
+    BLOCK_LENGTH = 32             # SMBus block transfer limit
+    BASE_RATE = 1000.0
+
+    def __init__(self, address: int=0x68, bus_number: int=1, accel_range: int=2, gyro_range: int=250):
+        self.bus = open_bus(bus_number, 'imu')
+        self.address = address
+        self.fifo_enabled = False
+        self.sample_rate = self.BASE_RATE
+        self.fifo_overflows = 0
+        self.bus.write_byte_data(address, self.PWR_MGMT_1, self.CLOCK_PLL_XGYRO)
+        self.bus.write_byte_data(address, self.CONFIG, self.DLPF_188HZ)
+        self.set_ranges(accel_range, gyro_range)
+
+    def set_ranges(self, accel_range: int, gyro_range: int) -> None:
+        if accel_range not in self.ACCEL_RANGES or gyro_range not in self.GYRO_RANGES:
+            raise ValueError(f'unsupported MPU6050 range {accel_range}g {gyro_range} degrees/sec')
+        self.bus.write_byte_data(self.address, self.ACCEL_CONFIG, self.ACCEL_RANGES[accel_range])
+        self.bus.write_byte_data(self.address, self.GYRO_CONFIG, self.GYRO_RANGES[gyro_range])
+        accel_scale = accel_range * GRAVITY / 32768
+        gyro_scale = gyro_range / 32768
+        self.scale = np.array([ accel_scale ] * 3 + [ 1 / 340 ] + [ gyro_scale ] * 3)
+        self.offset = np.array([ 0, 0, 0, 36.53, 0, 0, 0 ])
+        self.fifo_scale = np.array([ accel_scale ] * 3 + [ gyro_scale ] * 3)
+
+    #
+    # read - the current accel (x, y, z), temperature and gyro (x, y, z)
+    #
+
+    def read(self) -> np.ndarray:
+        data = self.bus.read_i2c_block_data(self.address, self.ACCEL_XOUT_H, self.DATA_LENGTH)
+        return np.frombuffer(bytes(data), dtype='>i2') * self.scale + self.offset
+
+    #
+    # enable_fifo - start queueing samples at rate (Hz), which the chip
+    # rounds to 1000/n
+    #
+
+    def enable_fifo(self, rate: float) -> None:
+        divider = min(max(round(self.BASE_RATE / rate) - 1, 0), 255)
+        self.sample_rate = self.BASE_RATE / (divider + 1)
+        self.bus.write_byte_data(self.address, self.SMPLRT_DIV, divider)
+        self.bus.write_byte_data(self.address, self.FIFO_EN, self.FIFO_EN_ACCEL_GYRO)
+        self.reset_fifo()
+        self.fifo_enabled = True
+
+    def disable_fifo(self) -> None:
+        self.bus.write_byte_data(self.address, self.FIFO_EN, 0)
+        self.bus.write_byte_data(self.address, self.USER_CTRL, 0)
+        self.fifo_enabled = False
+
+    def reset_fifo(self) -> None:
+        self.bus.write_byte_data(self.address, self.USER_CTRL, self.USER_CTRL_FIFO_RESET)
+        self.bus.write_byte_data(self.address, self.USER_CTRL, self.USER_CTRL_FIFO_EN)
+
+    #
+    # read_fifo - all the complete samples in the FIFO, one row per sample
+    # of accel (x, y, z) and gyro (x, y, z), oldest first
+    #
+
+    def read_fifo(self) -> np.ndarray:
+        high, low = self.bus.read_i2c_block_data(self.address, self.FIFO_COUNTH, 2)
+        count = (high << 8) | low
+        if count > self.FIFO_SIZE - self.FIFO_SAMPLE_LENGTH:    # full, and losing the oldest samples
+            self.fifo_overflows += 1
+            self.reset_fifo()
+            return np.empty((0, 6))
+        remaining = count // self.FIFO_SAMPLE_LENGTH * self.FIFO_SAMPLE_LENGTH
+        data = bytearray()
+        while remaining:
+            length = min(remaining, self.BLOCK_LENGTH)
+            data += bytes(self.bus.read_i2c_block_data(self.address, self.FIFO_R_W, length))
+            remaining -= length
+        return np.frombuffer(bytes(data), dtype='>i2').reshape(-1, 6) * self.fifo_scale
@@ -2,7 +2,7 @@
 
 import time
 import math
-import smbus2
+from i2c_bus import open_bus
 
 # ============================================================================
 # Raspi PCA9685 16-Channel PWM Servo Driver
@@ -25,19 +25,41 @@ class PCA9685:
   __ALLLED_OFF_L       = 0xFC
   __ALLLED_OFF_H       = 0xFD
 
-  def __init__(self, address=0x40, debug=False):
+  # MODE1 bits
+  __RESTART            = 0x80
+  __AI                 = 0x20    # register auto-increment
+  __SLEEP              = 0x10
+
+  # SMBus block transfers are limited to 32 bytes, i.e. 8 channels
+  __BLOCK_CHANNELS     = 8
+  __CHANNELS           = 16
+
+  def __init__(self, address=0x40, debug=False, bus_number=1):
     try:
-      self.bus = smbus2.SMBus(1)
-    except PermissionError:
+      self.bus = open_bus(bus_number, 'servo')
+    except OSError:    # no I2C bus, e.g. not running on a Pi
       self.bus = None    #type: ignore[assignment]
     self.address = address
     self.debug = debug
-    self.write(self.__MODE1, 0x00)
+    self.writesIssued = 0        # channel updates sent to the chip
+    self.writesSuppressed = 0    # channel updates skipped because nothing changed
+    self.resetShadow()
+    self.write(self.__MODE1, self.__AI)
+
+  def resetShadow(self):
+    "Forgets the last-written channel registers, so the next write to each channel always goes out"
+    self.shadow = bytearray(4*self.__CHANNELS)
+    self.shadowValid = [False] * self.__CHANNELS
     
   def write(self, reg, value):
     "Writes an 8-bit value to the specified register/address"
     if self.bus:
       self.bus.write_byte_data(self.address, reg, value)
+
+  def writeBlock(self, reg, data):
+    "Writes consecutive registers, starting at reg, in a single transaction (needs auto-increment)"
+    if self.bus:
+      self.bus.write_i2c_block_data(self.address, reg, data)
       
   def read(self, reg):
     "Read an unsigned byte from the I2C device"
@@ -55,20 +77,53 @@ class PCA9685:
     prescale = math.floor(prescaleval + 0.5)
 
 
-    oldmode = self.read(self.__MODE1);
-    newmode = (oldmode & 0x7F) | 0x10        # sleep
+    oldmode = (self.read(self.__MODE1) & 0x7F) | self.__AI
+    newmode = oldmode | self.__SLEEP         # sleep
     self.write(self.__MODE1, newmode)        # go to sleep
     self.write(self.__PRESCALE, int(math.floor(prescale)))
     self.write(self.__MODE1, oldmode)
     time.sleep(0.005)
-    self.write(self.__MODE1, oldmode | 0x80)
+    self.write(self.__MODE1, oldmode | self.__RESTART)
+    self.resetShadow()
 
   def setPWM(self, channel, on, off):
     "Sets a single PWM channel"
-    self.write(self.__LED0_ON_L+4*channel, on & 0xFF)
-    self.write(self.__LED0_ON_H+4*channel, on >> 8)
-    self.write(self.__LED0_OFF_L+4*channel, off & 0xFF)
-    self.write(self.__LED0_OFF_H+4*channel, off >> 8)
+    self.setPWMBlock(channel, bytes((on & 0xFF, on >> 8, off & 0xFF, off >> 8)))
+
+  def setPWMMulti(self, channel, values):
+    "Sets a run of consecutive channels starting at channel, from a list of (on, off) pairs"
+    data = bytearray()
+    for on, off in values:
+      data += bytes((on & 0xFF, on >> 8, off & 0xFF, off >> 8))
+    self.setPWMBlock(channel, data)
+
+  def setPWMBlock(self, channel, data):
+    "Sets consecutive channels from raw register contents, 4 bytes (ON_L ON_H OFF_L OFF_H) per channel"
+    # channels whose registers already hold these values are skipped, which
+    # splits the block into runs of channels that did change
+    first = None
+    for i in range(len(data)//4 + 1):
+      ch = channel + i
+      changed = i < len(data)//4 and \
+        (not self.shadowValid[ch] or self.shadow[4*ch:4*ch+4] != data[4*i:4*i+4])
+      if changed:
+        self.shadow[4*ch:4*ch+4] = data[4*i:4*i+4]
+        self.shadowValid[ch] = True
+        self.writesIssued += 1
+        if first is None:
+          first = i
+      else:
+        if i < len(data)//4:
+          self.writesSuppressed += 1
+        if first is not None:
+          self.writeChannels(channel+first, data[4*first:4*i])
+          first = None
+
+  def writeChannels(self, channel, data):
+    "Writes raw register contents for consecutive channels, in as few block transfers as possible"
+    step = 4*self.__BLOCK_CHANNELS
+    for start in range(0, len(data), step):
+      self.writeBlock(self.__LED0_ON_L+4*channel+start, list(data[start:start+step]))
   def setMotorPwm(self,channel,duty):
     self.setPWM(channel,0,duty)
   def setServoPulse(self, channel, pulse):
@@ -0,0 +1,265 @@
+#!/usr/bin/python
+#coding:utf-8
+
+from __future__ import annotations
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from typing import Callable
+from geometry import *
+
+#
+# Micro-benchmarks for the geometry, kinematics and body code.
+#
+# Each benchmark reports operations per second and the peak memory
+# allocated while running a single operation. Results can be saved as a
+# JSON baseline, and later runs are compared with it: any benchmark that is
+# slower, or allocates more, by more than the threshold is flagged as a
+# regression, and the exit status is 1.
+#
+#   python benchmark.py                     run everything, compare with baseline
+#   python benchmark.py --save              ... and save the results as the new baseline
+#   python benchmark.py point transform     run only the named groups
+#
+# Body benchmarks use a servo-less quad body, so they run on any machine.
+# Bus benchmarks send servo frames to the PCA9685 on a simulated I2C bus,
+# without its realtime delays.
+#
+
+DEFAULT_BASELINE = 'benchmark_baseline.json'
+DEFAULT_THRESHOLD = 0.1
+
+#
+# ops_per_sec - best of several rounds, to keep scheduling noise out of
+# the comparison with the baseline
+#
+
+def ops_per_sec(fn: Callable[[], object], min_time: float=0.5, rounds: int=3) -> float:
+    best = 0.0
+    for r in range(rounds):
+        count = 0
+        batch = 1
+        start = time.perf_counter()
+        while True:
+            for i in range(batch):
+                fn()
+            count += batch
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_time / rounds:
+                break
+            batch *= 2
+        best = max(best, count / elapsed)
+    return best
+
+def alloc_per_op(fn: Callable[[], object], repeat: int=5) -> float:
+    fn()
+    tracemalloc.start()
+    total = 0
+    for i in range(repeat):
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        fn()
+        total += tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    return total / repeat
+
+#
+# Benchmark groups. Each returns a list of (name, function) pairs.
+#
+
+def bench_point() -> list[tuple[str, Callable[[], object]]]:
+    p, q = Point(1.5, -2.0, 3.25), Point(0.5, 0.25, -1.0)
+    tf = Transform(x=1, y=2, zrot=30)
+    return [ ('Point add/sub/mul', lambda: (p + q) * 2.0 - q),
+             ('Point replace_z/reflect_y', lambda: p.replace_z(4.0).reflect_y()),
+             ('Point dist', lambda: p.dist(q)),
+             ('Point @ Transform', lambda: p @ tf) ]
+
+def bench_transform() -> list[tuple[str, Callable[[], object]]]:
+    a = Transform(x=1.5, y=-0.7, z=0.3, xrot=5, zrot=25)
+    b = Transform(x=3, yrot=10)
+    return [ ('Transform @ Transform', lambda: a @ b),
+             ('Transform inverse', lambda: -(a.copy())),
+             ('Transform inverse (cached)', lambda: -a),
+             ('Transform.from_string', lambda: Transform.from_string('1 2 3 10 20 30')),
+             ('Transform.from_string keywords', lambda: Transform.from_string('x=1 z=3 zrot=30')) ]
+
+def bench_screw() -> list[tuple[str, Callable[[], object]]]:
+    tf = Transform(x=1.5, y=-0.7, z=0.3, xrot=5, zrot=25)
+    result: list[tuple[str, Callable[[], object]]] = \
+        [ ('Transform.sqrt (screw)', lambda: tf.sqrt()),
+          ('Transform.power 0.3 (screw)', lambda: tf.power(0.3)) ]
+    try:
+        import scipy.linalg    #type: ignore[import-untyped,import]
+    except ImportError:
+        return result
+    sqrtm, expm, logm = scipy.linalg.sqrtm, scipy.linalg.expm, scipy.linalg.logm
+    sqrt_diff, power_diff = screw_difference(tf, sqrtm, expm, logm)
+    print(f'screw vs scipy: max difference sqrt {sqrt_diff:.2e} power 0.3 {power_diff:.2e}')
+    return result + [ ('scipy sqrtm', lambda: sqrtm(tf.m)),
+                      ('scipy expm(logm * 0.3)', lambda: expm(logm(tf.m) * 0.3)) ]
+
+#
+# screw_difference - the largest element difference between the screw
+# based sqrt and power and scipy's general matrix functions, for the
+# transform given and a few with larger rotations
+#
+
+def screw_difference(tf: Transform, sqrtm: Callable, expm: Callable, logm: Callable) -> tuple[float, float]:
+    transforms = [ tf, Transform(x=-2, y=4, z=1, xrot=60, yrot=-45, zrot=120),
+                   Transform(y=3, zrot=170), Transform(z=-1, xrot=-90, yrot=30) ]
+    sqrt_diff = max(float(np.abs(t.sqrt().m - np.real(sqrtm(t.m))).max()) for t in transforms)
+    power_diff = max(float(np.abs(t.power(0.3).m - np.real(expm(logm(t.m) * 0.3))).max())
+                     for t in transforms)
+    return sqrt_diff, power_diff
+
+def bench_leg() -> list[tuple[str, Callable[[], object]]]:
+    body = make_body()
+    leg = body.legs['fl']
+    target = Point(2.0, -1.0, -7.0)
+    angles = leg.get_angles(target)
+    return [ ('QuadLeg.get_angles', lambda: leg.get_angles(target)),
+             ('QuadLeg.get_toe_pos', lambda: leg.get_toe_pos(angles)) ]
+
+def bench_body() -> list[tuple[str, Callable[[], object]]]:
+    body = make_body()
+    def walk() -> None:
+        body.walk(6, 0, 0)
+    def attitude() -> None:
+        body.set_attitude('pitch', 5)
+        body.set_attitude('pitch', 0)
+    return [ ('Body.walk 6 (servo-less)', walk),
+             ('Body.set_attitude pitch x2', attitude) ]
+
+def bench_bus() -> list[tuple[str, Callable[[], object]]]:
+    from i2c_bus import use_simulated_bus
+    from servo import Servo, PWMServo, get_pwm
+    from servo_action import ServoActionList
+    body = make_body()
+    use_simulated_bus(True, realtime=False)
+    servos = list(Servo.get_servos().values())
+    pwm_servos = [ PWMServo(s.name, s.channel, s.reverse) for s in servos ]
+    get_pwm()
+    angle = [ 80.0 ]
+    def frame() -> None:
+        angle[0] = 180.0 - angle[0]
+        with ServoActionList() as actions:
+            for s in pwm_servos:
+                actions.append(s.channel, angle[0])
+    def set_angle() -> None:
+        angle[0] = 180.0 - angle[0]
+        pwm_servos[0].set_angle(angle[0])
+    return [ ('ServoActionList 13 channels (sim bus)', frame),
+             ('PWMServo.set_angle (sim bus)', set_angle) ]
+
+groups: dict[str, Callable[[], list[tuple[str, Callable[[], object]]]]] = {
+    'point' : bench_point,
+    'transform' : bench_transform,
+    'screw' : bench_screw,
+    'leg' : bench_leg,
+    'body' : bench_body,
+    'bus' : bench_bus,
+    }
+
+#
+# make_body - create a quad body with no servo hardware, using default
+# parameters and scratch files in a temporary directory
+#
+
+the_body = None
+
+def make_body():
+    global the_body
+    if the_body is None:
+        from robot import parameter_defaults
+        from params import Params
+        from globals import Globals
+        from logger import Logger
+        from servo import Servo
+        from body import Body
+        from command import CommandInterpreter
+        tmpdir = tempfile.mkdtemp(prefix='robot-bench-')
+        Params.load(os.path.join(tmpdir, 'parameters.txt'), parameter_defaults)
+        Globals.init()
+        Globals.set('speed', 0.0)
+        Logger.init(os.path.join(tmpdir, 'log.txt'))
+        Servo.set_servo_type('none')
+        the_body = Body.make_body('quad')
+        CommandInterpreter(the_body)
+        the_body.set_named_posture('stand')
+    return the_body
+
+#
+# Running, saving and comparing
+#
+
+def run(names: list[str], min_time: float) -> dict[str, dict[str, float]]:
+    results: dict[str, dict[str, float]] = {}
+    for g in names:
+        for name, fn in groups[g]():
+            results[name] = { 'ops_per_sec' : ops_per_sec(fn, min_time),
+                              'alloc_bytes' : alloc_per_op(fn) }
+            print(f"{name:36} {results[name]['ops_per_sec']:12.1f} ops/sec "
+                  f"{results[name]['alloc_bytes']:10.0f} bytes/op")
+    return results
+
+def machine_info() -> dict[str, str]:
+    return { 'machine' : platform.machine(),
+             'python' : platform.python_version(),
+             'numpy' : np.__version__ }
+
+def save(filename: str, results: dict[str, dict[str, float]]) -> None:
+    with open(filename, 'w') as f:
+        f.write(json.dumps({ 'info' : machine_info(), 'results' : results }, indent=4))
+        f.write('\n')
+
+def compare(filename: str, results: dict[str, dict[str, float]], threshold: float) -> bool:
+    try:
+        with open(filename) as f:
+            baseline = json.loads(f.read())
+    except FileNotFoundError:
+        print(f"no baseline '{filename}', use --save to create one")
+        return True
+    if baseline.get('info') != machine_info():
+        print(f"warning: baseline was recorded on {baseline.get('info')}")
+    ok = True
+    for name, r in results.items():
+        b = baseline['results'].get(name)
+        if b is None:
+            continue
+        speed = r['ops_per_sec'] / b['ops_per_sec'] - 1
+        alloc = (r['alloc_bytes'] - b['alloc_bytes']) / max(b['alloc_bytes'], 1.0)
+        if speed < -threshold or alloc > threshold:
+            ok = False
+            print(f'REGRESSION {name:25} speed {speed:+.1%} allocation {alloc:+.1%}')
+        elif speed > threshold:
+            print(f'improved   {name:25} speed {speed:+.1%} allocation {alloc:+.1%}')
+    return ok
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='geometry and kinematics benchmarks')
+    parser.add_argument('groups', nargs='*',
+                        help=f"groups to run, from: {', '.join(groups.keys())} (default all)")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='baseline file')
+    parser.add_argument('--save', action='store_true', help='save results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='fractional change counted as a regression')
+    parser.add_argument('--time', type=float, default=0.5, help='minimum seconds per benchmark')
+    args = parser.parse_args()
+    for g in args.groups:
+        if g not in groups:
+            parser.error(f"unknown group '{g}'")
+    results = run(args.groups or list(groups.keys()), args.time)
+    if args.save:
+        save(args.baseline, results)
+        return 0
+    return 0 if compare(args.baseline, results, args.threshold) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
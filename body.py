@@ -15,6 +15,7 @@ from head import *
 from posture import Posture
 from gait import Gait
 import itertools
+import dataclasses
 from logger import Logger
 from robot_keyword import *
 from collections import OrderedDict
@@ -116,15 +117,27 @@ class Body:
             case 'n':
                 self.attitude = Transform()
             case 'p':
-                self.attitude = self.attitude @ Transform(yrot=value - self.attitude.yrot())
+                self.attitude = self.rotate_attitude(pitch=value)
             case 'r':
                 if key.name=='right': 
                     self.attitude = self.attitude.replace_y(value)
                 else:
-                    self.attitude = self.attitude @ Transform(xrot=value - self.attitude.xrot())
+                    self.attitude = self.rotate_attitude(roll=value)
             case 'y':
-                self.attitude = self.attitude @ Transform(zrot=value - self.attitude.zrot())
+                self.attitude = self.rotate_attitude(yaw=value)
         self.reposition_body()
+
+    def get_attitude_angles(self) -> Angles:
+        return Quaternion.from_transform(self.attitude).to_angles()
+
+#
+# rotate_attitude - replace one or more of the attitude angles, leaving the
+# others and the translation unchanged
+#
+
+    def rotate_attitude(self, **kwargs: float) -> Transform:
+        angles = dataclasses.replace(self.get_attitude_angles(), **kwargs)
+        return Quaternion.from_angles(angles).to_transform().xlate(self.attitude.get_xlate())
             
     def get_servos(self, name: str) -> list[int]:
         if name=='h':
@@ -154,6 +167,20 @@ class Body:
         self.spread = s
         self.reposition_feet()
 
+#
+# solve_ik - inverse kinematics for every leg at once. targets is L x N x 3,
+# i.e. N toe positions for each of the L legs in the order of self.legs.
+# Returns L x N x 3 angles and an L x N reachability mask.
+#
+
+    def solve_ik(self, targets: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        legs = list(self.legs.values())
+        count = targets.shape[1]
+        femur = np.repeat([ ll.femur for ll in legs ], count)
+        tibia = np.repeat([ ll.tibia for ll in legs ], count)
+        angles, reachable = type(legs[0]).solve_ik(targets.reshape(-1, targets.shape[2]), femur, tibia)
+        return angles.reshape(len(legs), count, 3), reachable.reshape(len(legs), count)
+
     def get_leg(self, name: str) -> Leg:
         try:
             return self.legs[name]
@@ -170,19 +197,25 @@ class Body:
         from command import CommandInterpreter
         if self.auto_balance:
             self.balance(lift_legs[0])
-        with ServoActionList() as actions:
-            for ll in lift_legs:
-                ll.start_step(step, -self.height + self.step_height)
+        for ll in lift_legs:
+            ll.start_step(step, -self.height + self.step_height)
+        self.check_targets([ (ll, ll.step_target(phase)) for ll in lift_legs for phase in StepPhase ]
+                           + [ (ll, ll.position + ll.from_global_position(unstride) * n)
+                               for ll in other_legs for n in (1, 2) ])
+        # clear, lift and drop blend into each other, unless single stepping;
+        # pose puts the foot down and stops exactly
+        blend = not CommandInterpreter.the_command.pause_mode
+        with ServoActionList(blend=blend) as actions:
             for ll in lift_legs:
                 ll.step(StepPhase.clear, actions)
         CommandInterpreter.the_command.pause()
-        with ServoActionList() as actions:
+        with ServoActionList(blend=blend) as actions:
             for ll in lift_legs:
                 ll.step(StepPhase.lift, actions)
             for ll in other_legs:
                 ll.move_by(ll.from_global_position(unstride), actions)
         CommandInterpreter.the_command.pause()
-        with ServoActionList() as actions:
+        with ServoActionList(blend=blend) as actions:
             for ll in lift_legs:
                 ll.step(StepPhase.drop, actions)
             for ll in other_legs:
@@ -217,7 +250,7 @@ class Body:
         ll0 = lift_legs[0]
         total_unstride = ll.from_global_position(ll0.position - ll0.rest_position)
         one_unstride = total_unstride / len(other_legs)
-        remaining_unstride = total_unstride
+        remaining_unstride = total_unstride.copy()
         for ll in sorted(other_legs, key=Leg.get_dist_from_rest, reverse=True):
             remaining_unstride -= one_unstride
             target = ll.get_global_rest_position() + remaining_unstride
@@ -233,15 +266,35 @@ class Body:
             self.auto_balance = b
         Logger.info(f'body.walk final position {self.position} legs:\n{self.show_legs()}')
 
+#
+# check_targets - make sure every leg can reach its target(s) before any
+# of them start to move. Targets which can only be reached with a servo
+# clamped at its limit are allowed, as they always have been, but logged.
+#
+
+    def check_targets(self, targets: Iterable[tuple[Leg, Point]]) -> None:
+        for ll, target in targets:
+            match ll.classify_target(target):
+                case LegWorkspace.UNREACHABLE:
+                    Logger.error(f"leg '{ll.which}' cannot reach {target}")
+                    raise ValueError(f"leg '{ll.which}' cannot reach {target}")
+                case LegWorkspace.CLAMPED:
+                    Logger.info(f"leg '{ll.which}' target {target} is beyond servo limits")
+
+    def build_workspaces(self) -> None:
+        for ll in self.legs.values():
+            ll.get_workspace()
+
     def reposition_body(self) -> None:
+        legs = list(self.legs.values())
+        locations = PointArray([ ll.location for ll in legs ])
+        loc_adjust = (locations @ -self.attitude) - (locations @ -self.prev_attitude)
+        reverse = np.array([ ll.reverse for ll in legs ], dtype=bool)
+        new_pos = loc_adjust.reflect_y(reverse) + PointArray([ ll.position for ll in legs ])
         with ServoActionList() as actions:
-            for ll in self.legs.values():
-                new_loc = ll.location @ -self.attitude
-                old_loc = ll.location @ -self.prev_attitude
-                loc_adjust =  new_loc - old_loc 
-                new_pos = ll.from_global_position(loc_adjust) + ll.position
-                #print(f'{ll.which} {old_loc} {new_loc} {ll.position} {loc_adjust} {new_pos}')
-                ll.goto(new_pos, actions)
+            for ll, pos in zip(legs, new_pos):
+                #print(f'{ll.which} {ll.position} {pos}')
+                ll.goto(pos, actions)
 
     def reposition_feet(self) -> None:
         for ll in self.legs.values():
@@ -286,14 +339,17 @@ class Body:
         else:
             ystr = 'left'
             yval = -self.attitude.y()
-        angles = self.attitude.xlate(Point(0, 0, 0))
+        angles = self.get_attitude_angles()
         return (f"Base posture: '{self.posture.name}' stretch {self.stretch:.2f} spread {self.spread:.2f}" +
                 f"\nAttitude: {xstr} {xval:.1f} {ystr} {yval:.1f} height {self.attitude.z():.1f}" +
-                f" yaw {angles.zrot():.1f} pitch {angles.yrot():.1f} roll {angles.xrot():.1f}")
+                f" yaw {angles.yaw:.1f} pitch {angles.pitch:.1f} roll {angles.roll:.1f}")
 
     def show_legs(self) -> str:
         return '\n'.join([ ll.show_position() for ll in self.legs.values() ])
 
+    def show_ik_cache(self) -> str:
+        return '\n'.join([ ll.show_ik_cache() for ll in self.legs.values() ])
+
     @staticmethod
     def make_body(_type: str) -> Body:
         try:
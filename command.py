@@ -11,6 +11,8 @@ from collections.abc import Callable
 from logger import Logger
 from servo import Servo
 from servo_action import *
+from servo_scheduler import ServoScheduler
+from i2c_bus import get_simulated_buses, get_bus_managers
 from params import Params
 from globals import Globals
 from robot_platform import RobotPlatform
@@ -52,6 +54,8 @@ class CommandInterpreter:
     show_commands = KeywordTable(
         ('attitude', 'att', 'show body attitude'),
         ('battery', 'bat', 'show battery level'),
+        ('bus', 'bu', 'show I2C bus usage'),
+        ('ik', 'ik', 'show inverse kinematics cache statistics'),
         ('legs', 'le', 'show leg and body positions'),
         ('parameters', 'par', 'show parameter values or just one selected parameter'),
         ('platform', 'pla', 'show hardware platform info'),
@@ -320,6 +324,19 @@ class CommandInterpreter:
     def show_battery(self) -> None:
         self.output(f"Battery level: {RobotPlatform.get_battery_level():.2f} V")
 
+    def show_bus(self) -> None:
+        self.check_args(1)
+        for manager in get_bus_managers().values():
+            self.output(manager.show())
+        for bus in get_simulated_buses().values():
+            self.output(bus.show())
+        if not get_bus_managers() and not get_simulated_buses():
+            self.output('no I2C bus statistics, the bus is not managed or simulated')
+
+    def show_ik(self) -> None:
+        self.check_args(1)
+        self.output(self.body.show_ik_cache())
+
     def show_legs(self) -> None:
         self.check_args(1)
         self.show_position()
@@ -327,6 +344,8 @@ class CommandInterpreter:
 
     def show_platform(self) -> None:
         self.output(RobotPlatform.get_platform_info())
+        for bus in get_simulated_buses().values():
+            self.output(bus.show())
 
     def show_parameters(self) -> None:
         self.check_args(1, 2)
@@ -342,5 +361,8 @@ class CommandInterpreter:
     def show_servos(self) -> None:
         self.check_args(1)
         self.output(Servo.show_servos())
+        scheduler = ServoScheduler.get()
+        if scheduler:
+            self.output(scheduler.show())
 
         
@@ -2,11 +2,11 @@
 
 from __future__ import annotations
 import numpy as np
-import scipy    #type: ignore[import-untyped,import]
 from numpy import linalg
 from dtrig import *
 from math import *
 from dataclasses import dataclass
+from typing import Iterable, Iterator
 from logger import Logger
 
 SMALL = 1e-9
@@ -51,188 +51,328 @@ def equal(x1: float, x2: float) -> bool:
     return diff < SMALL or diff / (max(abs(x1), abs(x2)) or 1.0) < SMALL
 
 #
-# Point2D - represents a 2D point
+# Rotation helpers. These work on 3x3 rotation matrices (lists of rows) in
+# the usual column-vector convention, and on rotation vectors (axis scaled
+# by angle in radians). Plain floats are used throughout since for such small
+# sizes numpy call overhead dominates.
+#
+
+Vector3 = tuple[float, float, float]
+
+def cross(a: Vector3, b: Vector3) -> Vector3:
+    return (a[1]*b[2] - a[2]*b[1], a[2]*b[0] - a[0]*b[2], a[0]*b[1] - a[1]*b[0])
+
+def rotation_exp(u: Vector3) -> list[list[float]]:
+    theta = sqrt(u[0]*u[0] + u[1]*u[1] + u[2]*u[2])
+    if theta < 1e-6:
+        a, b = 1.0, 0.5
+    else:
+        a, b = sin(theta) / theta, (1 - cos(theta)) / (theta * theta)
+    x, y, z = u
+    return [[1 - b*(y*y + z*z), b*x*y - a*z, b*x*z + a*y],
+            [b*x*y + a*z, 1 - b*(x*x + z*z), b*y*z - a*x],
+            [b*x*z - a*y, b*y*z + a*x, 1 - b*(x*x + y*y)]]
+
+def rotation_log(r: list[list[float]]) -> Vector3:
+    theta = acos(min(max((r[0][0] + r[1][1] + r[2][2] - 1) / 2, -1.0), 1.0))
+    anti = (r[2][1] - r[1][2], r[0][2] - r[2][0], r[1][0] - r[0][1])
+    if theta < 1e-6:
+        return (anti[0] / 2, anti[1] / 2, anti[2] / 2)
+    elif pi - theta < 1e-3:
+        # close to a half turn the antisymmetric part vanishes, so take the
+        # axis from the symmetric part, using the antisymmetric part only
+        # for its sign
+        c = cos(theta)
+        k = max(range(3), key=lambda i: r[i][i])
+        w = [ ((r[k][j] + r[j][k]) / 2 - (c if j==k else 0.0)) / (1 - c) for j in range(3) ]
+        scale = theta / sqrt(w[k])
+        if w[0]*anti[0] + w[1]*anti[1] + w[2]*anti[2] < 0:
+            scale = -scale
+        return (w[0] * scale, w[1] * scale, w[2] * scale)
+    else:
+        scale = theta / (2 * sin(theta))
+        return (anti[0] * scale, anti[1] * scale, anti[2] * scale)
+
+#
+# se3_jacobian, se3_jacobian_inv - map between the translation part of a
+# screw motion and the actual translation of the resulting transform
+#
+
+def se3_jacobian(u: Vector3, v: Vector3) -> Vector3:
+    theta = sqrt(u[0]*u[0] + u[1]*u[1] + u[2]*u[2])
+    if theta < 1e-6:
+        a, b = 0.5, 1.0 / 6
+    else:
+        a, b = (1 - cos(theta)) / (theta * theta), (theta - sin(theta)) / (theta ** 3)
+    uv = cross(u, v)
+    uuv = cross(u, uv)
+    return (v[0] + a*uv[0] + b*uuv[0], v[1] + a*uv[1] + b*uuv[1], v[2] + a*uv[2] + b*uuv[2])
+
+def se3_jacobian_inv(u: Vector3, t: Vector3) -> Vector3:
+    theta = sqrt(u[0]*u[0] + u[1]*u[1] + u[2]*u[2])
+    if theta < 1e-6:
+        b = 1.0 / 12
+    else:
+        b = 1 / (theta * theta) - 1 / (2 * theta * tan(theta / 2))
+    ut = cross(u, t)
+    uut = cross(u, ut)
+    return (t[0] - ut[0]/2 + b*uut[0], t[1] - ut[1]/2 + b*uut[1], t[2] - ut[2]/2 + b*uut[2])
+
+#
+# Point2D - represents a 2D point. Coordinates are held as plain floats, since
+# for such small vectors building a numpy array costs far more than the
+# arithmetic itself.
 #
 
 class Point2D:
 
+    __slots__ = ('_x', '_y')
+
     def __init__(self, x: float | np.ndarray=0.0, y: float=0.0):
         if isinstance(x, np.ndarray):
-            self.p = x
+            self._x, self._y = float(x[0]), float(x[1])
         else:
-            self.p = np.array([float(x), float(y)], dtype=np.float64)
+            self._x, self._y = float(x), float(y)
+
+    @property
+    def p(self) -> np.ndarray:
+        return np.array([self._x, self._y], dtype=np.float64)
+
+    def copy(self) -> Point2D:
+        return Point2D(self._x, self._y)
 
     def clean(self) -> Point2D:
-        return Point2D(np.round(self.p, 3))
+        return Point2D(round(self._x, 3), round(self._y, 3))
         
     def __str__(self) -> str:
         c = self.clean()
         return f'(x={c.x():.3f} y={c.y():.3f})'
 
-    def __add__(self, other) -> Point2D:
+    def __add__(self, other: Point2D | np.ndarray) -> Point2D:
         if isinstance(other, Point2D):
-            return Point2D(np.add(self.p, other.p))
+            return Point2D(self._x + other._x, self._y + other._y)
         else:
             return Point2D(np.add(self.p, other))
 
-    def __sub__(self, other) -> Point2D:
+    def __sub__(self, other: Point2D | np.ndarray) -> Point2D:
         if isinstance(other, Point2D):
-            return Point2D(np.subtract(self.p, other.p))
+            return Point2D(self._x - other._x, self._y - other._y)
         else:
             return Point2D(np.subtract(self.p, other))
 
     def __mul__(self, x: float) -> Point2D:
-        return Point2D(np.multiply(self.p, x))
+        return Point2D(self._x * x, self._y * x)
 
     def __truediv__(self, x: float) -> Point2D:
-        return Point2D(np.divide(self.p, x))
+        return Point2D(self._x / x, self._y / x)
+
+#
+# in-place variants - these really do modify the point
+#
+
+    def __iadd__(self, other: Point2D | np.ndarray) -> Point2D:
+        if isinstance(other, Point2D):
+            self._x += other._x
+            self._y += other._y
+        else:
+            self._x, self._y = np.add(self.p, other).tolist()[:2]
+        return self
+
+    def __isub__(self, other: Point2D | np.ndarray) -> Point2D:
+        if isinstance(other, Point2D):
+            self._x -= other._x
+            self._y -= other._y
+        else:
+            self._x, self._y = np.subtract(self.p, other).tolist()[:2]
+        return self
+
+    def __imul__(self, x: float) -> Point2D:
+        self._x *= x
+        self._y *= x
+        return self
+
+    def __itruediv__(self, x: float) -> Point2D:
+        self._x /= x
+        self._y /= x
+        return self
 
     def __eq__(self, other: Point2D) -> bool:    #type: ignore
-        return equal(self.x(), other.x()) and equal(self.y(), other.y())
+        return equal(self._x, other._x) and equal(self._y, other._y)
 
     def __ne__(self, other: Point2D) -> bool:    #type: ignore
         return not (self==other)
 
     def x(self) -> float:
-        return self.p[0]
+        return self._x
 
     def y(self) -> float:
-        return self.p[1]
+        return self._y
 
     def length(self) -> float:
-        return hypot(self.x(), self.y())
+        return hypot(self._x, self._y)
 
     def angle(self) -> float:
-        return datan2(self.x(), self.y())
+        return datan2(self._x, self._y)
 
     def reflect_x(self) -> Point2D:
-        return Point2D(self.x(), -self.y())
+        return Point2D(self._x, -self._y)
 
     def reflect_y(self) -> Point2D:
-        return Point2D(-self.x(), self.y())
+        return Point2D(-self._x, self._y)
 
     def dist(self, other: Point2D) -> float:
         return sqrt(self.dist2(other))
 
     def dist2(self, other: Point2D) -> float:
-        return np.sum(np.square((self - other).p))
+        return dist2(self._x, self._y, other._x, other._y)
 
     @staticmethod
     def from_polar(r: float, theta: float) -> Point2D:
-        return Point2D(dsin(theta), dcos(theta)) * r 
+        return Point2D(r * dsin(theta), r * dcos(theta))
 
 #
-# Point class - represents a 3D point, with a fourth value, always 1, to
-# facilitate computing transforms
+# Point class - represents a 3D point. The coordinates are held as plain
+# floats; the p property provides the traditional 4-element form, with a
+# fourth value always 1, for use with transforms.
 #
 
 class Point:
 
+    __slots__ = ('_x', '_y', '_z')
+
     def __init__(self, x: float | np.ndarray=0.0, y: float=0.0, z: float=0.0):
         if isinstance(x, np.ndarray):
-            self.p = x
-            self.p[3] = 1
+            self._x, self._y, self._z = float(x[0]), float(x[1]), float(x[2])
         else:
-            self.p = np.array([float(x), float(y), float(z), 1.0], dtype=np.float64)
+            self._x, self._y, self._z = float(x), float(y), float(z)
+
+    @property
+    def p(self) -> np.ndarray:
+        return np.array([self._x, self._y, self._z, 1.0], dtype=np.float64)
 
     def copy(self) -> Point:
-        return Point(self.p.copy())
+        return Point(self._x, self._y, self._z)
 
     def clean(self) -> Point:
-        return Point(np.round(self.p, 3))
+        return Point(round(self._x, 3), round(self._y, 3), round(self._z, 3))
         
     def __str__(self) -> str:
         c = self.clean()
         return f'(x={c.x():.3f} y={c.y():.3f} z={c.z():.3f})'
 
     def __neg__(self) -> Point:
-        return Point((-self.p))
+        return Point(-self._x, -self._y, -self._z)
 
-    def __add__(self, other) -> Point:
+    def __add__(self, other: Point | np.ndarray) -> Point:
         if isinstance(other, Point):
-            return Point(np.add(self.p, other.p))
+            return Point(self._x + other._x, self._y + other._y, self._z + other._z)
         else:
             return Point(np.add(self.p, other))
         
-    def __sub__(self, other) -> Point:
+    def __sub__(self, other: Point | np.ndarray) -> Point:
         if isinstance(other, Point):
-            return Point(np.subtract(self.p, other.p))
+            return Point(self._x - other._x, self._y - other._y, self._z - other._z)
         else:
             return Point(np.subtract(self.p, other))
 
     def __eq__(self, other: Point) -> bool:    #type: ignore
-        return (equal(self.x(), other.x())
-                and equal(self.y(), other.y())
-                and equal(self.z(), other.z()))
+        return (equal(self._x, other._x)
+                and equal(self._y, other._y)
+                and equal(self._z, other._z))
 
     def __ne__(self, other: Point) -> bool:    #type: ignore
         return not (self==other)
     
     def __mul__(self, other: float) -> Point:
-        return Point(np.multiply(self.p, other))
+        return Point(self._x * other, self._y * other, self._z * other)
     
     def __truediv__(self, other: float) -> Point:
-        return Point(np.divide(self.p, other))
+        return Point(self._x / other, self._y / other, self._z / other)
 
     def __matmul__(self, tf: Transform) -> Point:
         return Point(self.p @ tf.m)
 
+#
+# in-place variants - these really do modify the point, so beware of aliases
+#
+
+    def __iadd__(self, other: Point | np.ndarray) -> Point:
+        if isinstance(other, Point):
+            self._x += other._x
+            self._y += other._y
+            self._z += other._z
+        else:
+            self._x, self._y, self._z = np.add(self.p, other).tolist()[:3]
+        return self
+
+    def __isub__(self, other: Point | np.ndarray) -> Point:
+        if isinstance(other, Point):
+            self._x -= other._x
+            self._y -= other._y
+            self._z -= other._z
+        else:
+            self._x, self._y, self._z = np.subtract(self.p, other).tolist()[:3]
+        return self
+
+    def __imul__(self, other: float) -> Point:
+        self._x *= other
+        self._y *= other
+        self._z *= other
+        return self
+
+    def __itruediv__(self, other: float) -> Point:
+        self._x /= other
+        self._y /= other
+        self._z /= other
+        return self
+
     def length(self) -> float:
-        return self.dist(Point())
+        return sqrt(self._x*self._x + self._y*self._y + self._z*self._z)
 
     def dist(self, other: Point) -> float:
         return sqrt(self.dist2(other))
 
     def dist2(self, other: Point) -> float:
-        return np.sum(np.square(np.delete((self - other).p, [3])))
+        dx = self._x - other._x
+        dy = self._y - other._y
+        dz = self._z - other._z
+        return dx*dx + dy*dy + dz*dz
 
     def x(self) -> float:
-        return self.p[0]
+        return self._x
 
     def y(self) -> float:
-        return self.p[1]
+        return self._y
 
     def z(self) -> float:
-        return self.p[2]
+        return self._z
 
     def xrot(self) -> float:
-        return datan2(-self.z(), self.y())
+        return datan2(-self._z, self._y)
 
     def yrot(self) -> float:
-        return datan2(self.z(), self.x())
+        return datan2(self._z, self._x)
 
     def zrot(self) -> float:
-        return datan2(-self.y(), self.x())
+        return datan2(-self._y, self._x)
 
     def replace_x(self, xx: float) -> Point:
-        result = self.copy()
-        result.p[0] = xx
-        return result
+        return Point(xx, self._y, self._z)
 
     def replace_y(self, yy: float) -> Point:
-        result = self.copy()
-        result.p[1] = yy
-        return result
+        return Point(self._x, yy, self._z)
 
     def replace_z(self, zz: float) -> Point:
-        result = self.copy()
-        result.p[2] = zz
-        return result
+        return Point(self._x, self._y, zz)
 
     def reflect_x(self) -> Point:
-        result = self.copy()
-        result.p[0] = -result.p[0]
-        return result
+        return Point(-self._x, self._y, self._z)
 
     def reflect_y(self) -> Point:
-        result = self.copy()
-        result.p[1] = -result.p[1]
-        return result
+        return Point(self._x, -self._y, self._z)
 
     def reflect_z(self) -> Point:
-        result = self.copy()
-        result.p[2] = -result.p[1]
-        return result
+        return Point(self._x, self._y, -self._z)
 
 #
 # Angles: represent the three roll/pitch/yaw angles
@@ -275,21 +415,31 @@ class Angles:
 #
 # Transform class - a matrix representing a 3D transformation consisting of
 # a 3D rotation followed by a translation
+#
+# A transform is rigid if it is known to be exactly that, i.e. an orthonormal
+# rotation plus a translation. Anything built from points, rotations and
+# translations is rigid, and so is a product of rigid transforms. Rigid
+# transforms are inverted in closed form, by transposing the rotation. The
+# inverse is cached, since attitude transforms are inverted repeatedly.
 #   
 
 class Transform:
 
-    def __init__(self, other: None|Point|np.ndarray=None, **kwargs: float):
+    def __init__(self, other: None|Point|np.ndarray=None, rigid: bool|None=None, **kwargs: float):
         self.m: np.ndarray
+        self._inverse: Transform|None = None
         if other is None:
             self.m = np.identity(4)
+            self.rigid = True
         elif isinstance(other, Point):
             self.m = np.array([[1, 0, 0, 0],
                                [0, 1, 0, 0],
                                [0, 0, 1, 0],
-                               [other.x(), other.y(), other.z(), 1]])
+                               [other.x(), other.y(), other.z(), 1]], dtype=np.float64)
+            self.rigid = True
         elif isinstance(other, np.ndarray):
             self.m = other
+            self.rigid = bool(rigid)
         else:
             raise TypeError(f'incorrect type {type(other)} in Transform.init')
         if kwargs:
@@ -315,15 +465,19 @@ class Transform:
 
 
     def copy(self) -> Transform:
-        return Transform(self.m.copy())
+        return Transform(self.m.copy(), rigid=self.rigid)
 
     def _copy_rotate(self, other: Transform) -> None:
-        for i in range(3):
-            for j in range(3):
-                self.m[i][j] = other.m[i][j]
+        self._invalidate()
+        self.m[:3, :3] = other.m[:3, :3]
+
+    def _invalidate(self) -> None:
+        if self._inverse is not None:
+            self._inverse._inverse = None
+            self._inverse = None
 
     def __matmul__(self, other: Transform) -> Transform:
-        return Transform(self.m @ other.m)
+        return Transform(self.m @ other.m, rigid=self.rigid and other.rigid)
 
     def __str__(self) -> str:
         return str(self.clean().m)
@@ -332,7 +486,17 @@ class Transform:
         return Transform(np.round(self.m, 3))
 
     def __neg__(self) -> Transform:
-        return Transform(linalg.inv(self.m))
+        if self._inverse is None:
+            if self.rigid:
+                rt = self.m[:3, :3].T
+                m = np.identity(4)
+                m[:3, :3] = rt
+                m[3, :3] = -self.m[3, :3] @ rt
+            else:
+                m = linalg.inv(self.m)
+            self._inverse = Transform(m, rigid=self.rigid)
+            self._inverse._inverse = self
+        return self._inverse
 
     def __mul__(self, other: Transform|float) -> Transform:
         return Transform(self.m * other)
@@ -341,11 +505,12 @@ class Transform:
         return Transform(self.m / other)
 
 #
-# between - approximate interpolation (only suitable for small angles)
+# between - interpolate along the screw motion from self (where=0) to
+# other (where=1)
 #
 
     def between(self, other: Transform, where: float) -> Transform:
-        return Transform(self.m * (1-where) + other.m * where)
+        return self @ ((-self) @ other).interpolate(where)
 
 #
 # xlate - add translation (replacing existing translation)
@@ -407,18 +572,51 @@ class Transform:
 # in-situ update of translation
 #
     def update_xlate(self, p: Point) -> Transform:
+        self._invalidate()
         self.m[3][0] = p.x()
         self.m[3][1] = p.y()
         self.m[3][2] = p.z()
         return self
 #
-# square root
+# Screw motion - any rigid transform is a rotation about some axis combined
+# with a translation along it. Scaling the rotation angle and the translation
+# together gives exact fractional powers, without resorting to general matrix
+# functions. Only rigid transforms have a screw, so anything else is a
+# ValueError.
 #
-    def sqrt(self) -> Transform:
-        return Transform(scipy.linalg.sqrtm(self.m))
+# log returns the screw as a rotation vector (radians) and the translation
+# in the same frame; exp is the reverse.
+#
+
+    def log(self) -> tuple[Vector3, Vector3]:
+        if not self.rigid:
+            raise ValueError('Transform.log: transform is not rigid')
+        m = self.m.tolist()
+        w = rotation_log(m)    # the row-vector matrix is the transposed rotation
+        u = (-w[0], -w[1], -w[2])
+        return u, se3_jacobian_inv(u, (m[3][0], m[3][1], m[3][2]))
+
+    @staticmethod
+    def exp(u: Vector3, v: Vector3) -> Transform:
+        r = rotation_exp((-u[0], -u[1], -u[2]))
+        t = se3_jacobian(u, v)
+        return Transform(np.array([r[0] + [0.0], r[1] + [0.0], r[2] + [0.0],
+                                   [t[0], t[1], t[2], 1.0]]), rigid=True)
 
     def power(self, pow: float) -> Transform:
-        return Transform(scipy.linalg.expm(scipy.linalg.logm(self.m) / pow))
+        u, v = self.log()
+        return Transform.exp((u[0]*pow, u[1]*pow, u[2]*pow), (v[0]*pow, v[1]*pow, v[2]*pow))
+
+    def sqrt(self) -> Transform:
+        return self.power(0.5)
+
+#
+# interpolate - fraction of the way along the screw from identity (where=0)
+# to this transform (where=1)
+#
+
+    def interpolate(self, where: float) -> Transform:
+        return self.power(where)
 #
 # get whole translation
 #
@@ -457,19 +655,19 @@ class Transform:
     def make_xrot(angle: float) -> Transform:
         c = dcos(angle)
         s = dsin(angle)
-        return Transform(np.array([[1, 0, 0, 0], [0 , c, -s, 0], [0, s, c, 0], [0, 0, 0, 1]]))
+        return Transform(np.array([[1, 0, 0, 0], [0 , c, -s, 0], [0, s, c, 0], [0, 0, 0, 1]]), rigid=True)
 
     @staticmethod
     def make_yrot(angle: float) -> Transform:
         c = dcos(angle)
         s = dsin(angle)
-        return Transform(np.array([[c, 0, s, 0], [0 , 1, 0, 0], [-s, 0, c, 0], [0, 0, 0, 1]]))
+        return Transform(np.array([[c, 0, s, 0], [0 , 1, 0, 0], [-s, 0, c, 0], [0, 0, 0, 1]]), rigid=True)
         
     @staticmethod
     def make_zrot(angle: float) -> Transform:
         c = dcos(angle)
         s = dsin(angle)
-        return Transform(np.array([[c, -s, 0, 0], [s , c, 0, 0], [0, 0, 1, 0], [0, 0, 0, 1]]))
+        return Transform(np.array([[c, -s, 0, 0], [s , c, 0, 0], [0, 0, 1, 0], [0, 0, 0, 1]]), rigid=True)
 #
 # create from a string in the order x y z xrot yrot zrot
 #
@@ -495,7 +693,415 @@ class Transform:
                              xrot=data[3], yrot=data[4], zrot=data[5])
         else:
             raise ValueError(f"invalid transform specification '{config}'")
-            
+
+#
+# PointArray class - an N x 4 array of points, so that a whole set of points
+# (e.g. one per leg) can be transformed or moved in a single numpy operation.
+# Operators mirror those of Point, but work on every row at once. An array
+# passed in is copied, so the caller's array is never changed or shared.
+#
+
+class PointArray:
+
+    def __init__(self, points: Iterable[Point] | np.ndarray = ()):
+        if isinstance(points, np.ndarray):
+            self.p = np.array(points, dtype=np.float64)
+            self.p[:, 3] = 1
+        else:
+            self.p = np.array([ [pt.x(), pt.y(), pt.z(), 1.0] for pt in points ],
+                              dtype=np.float64).reshape(-1, 4)
+
+    def copy(self) -> PointArray:
+        return PointArray(self.p)
+
+    def clean(self) -> PointArray:
+        return PointArray(np.round(self.p, 3))
+
+    def __str__(self) -> str:
+        return '[' + ', '.join([ str(pt) for pt in self ]) + ']'
+
+    def __len__(self) -> int:
+        return self.p.shape[0]
+
+    def __getitem__(self, i: int) -> Point:
+        return Point(*self.p[i][:3])
+
+    def __iter__(self) -> Iterator[Point]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def to_points(self) -> list[Point]:
+        return [ pt for pt in self ]
+
+    def __neg__(self) -> PointArray:
+        return PointArray(-self.p)
+
+    def __add__(self, other: PointArray|Point|np.ndarray) -> PointArray:
+        return PointArray(np.add(self.p, PointArray._operand(other)))
+
+    def __sub__(self, other: PointArray|Point|np.ndarray) -> PointArray:
+        return PointArray(np.subtract(self.p, PointArray._operand(other)))
+
+    def __mul__(self, other: float|np.ndarray) -> PointArray:
+        return PointArray(np.multiply(self.p, PointArray._scalar(other)))
+
+    def __truediv__(self, other: float|np.ndarray) -> PointArray:
+        return PointArray(np.divide(self.p, PointArray._scalar(other)))
+
+    def __matmul__(self, tf: Transform|TransformArray) -> PointArray:
+        if isinstance(tf, TransformArray):
+            return PointArray(np.einsum('ni,nij->nj', self.p, tf.m))
+        else:
+            return PointArray(self.p @ tf.m)
+
+    def x(self) -> np.ndarray:
+        return self.p[:, 0]
+
+    def y(self) -> np.ndarray:
+        return self.p[:, 1]
+
+    def z(self) -> np.ndarray:
+        return self.p[:, 2]
+
+    def length(self) -> np.ndarray:
+        return np.sqrt(np.sum(np.square(self.p[:, :3]), axis=1))
+
+    def dist(self, other: PointArray|Point) -> np.ndarray:
+        return np.sqrt(self.dist2(other))
+
+    def dist2(self, other: PointArray|Point) -> np.ndarray:
+        return np.sum(np.square((self - other).p[:, :3]), axis=1)
+
+#
+# replace_... - replace a single dimension, with a scalar or one value per row
+#
+
+    def replace_x(self, xx: float|np.ndarray) -> PointArray:
+        return self._replace(0, xx)
+
+    def replace_y(self, yy: float|np.ndarray) -> PointArray:
+        return self._replace(1, yy)
+
+    def replace_z(self, zz: float|np.ndarray) -> PointArray:
+        return self._replace(2, zz)
+
+#
+# reflect_... - reflect every row, or only those selected by a boolean mask
+#
+
+    def reflect_x(self, where: np.ndarray|None = None) -> PointArray:
+        return self._reflect(0, where)
+
+    def reflect_y(self, where: np.ndarray|None = None) -> PointArray:
+        return self._reflect(1, where)
+
+    def reflect_z(self, where: np.ndarray|None = None) -> PointArray:
+        return self._reflect(2, where)
+
+    def _replace(self, col: int, value: float|np.ndarray) -> PointArray:
+        result = self.copy()
+        result.p[:, col] = value
+        return result
+
+    def _reflect(self, col: int, where: np.ndarray|None) -> PointArray:
+        result = self.copy()
+        if where is None:
+            result.p[:, col] = -result.p[:, col]
+        else:
+            result.p[where, col] = -result.p[where, col]
+        return result
+
+    @staticmethod
+    def _operand(other: PointArray|Point|np.ndarray) -> np.ndarray:
+        if isinstance(other, PointArray):
+            return other.p
+        elif isinstance(other, Point):
+            return other.p
+        else:
+            return other
+
+    @staticmethod
+    def _scalar(other: float|np.ndarray) -> float|np.ndarray:
+        if isinstance(other, np.ndarray) and other.ndim == 1:
+            return other[:, np.newaxis]
+        else:
+            return other
+
+#
+# TransformArray class - a stack of N 4x4 transforms, applied row by row to a
+# PointArray or composed element-wise with another TransformArray
+#
+
+class TransformArray:
+
+    def __init__(self, transforms: Iterable[Transform] | np.ndarray = (), rigid: bool|None=None):
+        if isinstance(transforms, np.ndarray):
+            self.m = transforms
+            self.rigid = bool(rigid)
+        else:
+            tfs = list(transforms)
+            self.m = np.array([ tf.m for tf in tfs ], dtype=np.float64).reshape(-1, 4, 4)
+            self.rigid = all([ tf.rigid for tf in tfs ])
+
+    def copy(self) -> TransformArray:
+        return TransformArray(self.m.copy(), rigid=self.rigid)
+
+    def __len__(self) -> int:
+        return self.m.shape[0]
+
+    def __getitem__(self, i: int) -> Transform:
+        return Transform(self.m[i].copy(), rigid=self.rigid)
+
+    def __iter__(self) -> Iterator[Transform]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def __str__(self) -> str:
+        return str(np.round(self.m, 3))
+
+    def __matmul__(self, other: Transform|TransformArray) -> TransformArray:
+        return TransformArray(np.matmul(self.m, other.m), rigid=self.rigid and other.rigid)
+
+    def __neg__(self) -> TransformArray:
+        if self.rigid:
+            rt = np.swapaxes(self.m[:, :3, :3], 1, 2)
+            m = np.tile(np.identity(4), (len(self), 1, 1))
+            m[:, :3, :3] = rt
+            m[:, 3, :3] = -np.einsum('ni,nij->nj', self.m[:, 3, :3], rt)
+            return TransformArray(m, rigid=True)
+        else:
+            return TransformArray(linalg.inv(self.m))
+
+    def get_xlate(self) -> PointArray:
+        return PointArray(self.m[:, 3, :])
+
+    def xlate(self, p: PointArray) -> TransformArray:
+        result = self.copy()
+        result.m[:, 3, :3] = p.p[:, :3]
+        return result
+
+    def replace_x(self, xx: float|np.ndarray) -> TransformArray:
+        result = self.copy()
+        result.m[:, 3, 0] = xx
+        return result
+
+    def replace_y(self, yy: float|np.ndarray) -> TransformArray:
+        result = self.copy()
+        result.m[:, 3, 1] = yy
+        return result
+
+    def replace_z(self, zz: float|np.ndarray) -> TransformArray:
+        result = self.copy()
+        result.m[:, 3, 2] = zz
+        return result
+
+    def reflect_y(self, where: np.ndarray|None = None) -> TransformArray:
+        result = self.copy()
+        if where is None:
+            result.m[:, 3, 1] = -result.m[:, 3, 1]
+        else:
+            result.m[where, 3, 1] = -result.m[where, 3, 1]
+        return result
+
+#
+# from_points - create pure translations, one per point
+#
+
+    @staticmethod
+    def from_points(points: PointArray) -> TransformArray:
+        result = np.tile(np.identity(4), (len(points), 1, 1))
+        result[:, 3, :3] = points.p[:, :3]
+        return TransformArray(result, rigid=True)
+
+
+#
+# Quaternion class - a unit quaternion representing an attitude, i.e. a pure
+# rotation. It uses the same conventions as Transform: q1 @ q2 applies q1
+# then q2, -q is the inverse, and the Angles conversions match
+# Transform(xrot=roll, yrot=pitch, zrot=yaw). Internally (w, x, y, z) is
+# the usual quaternion rotating a column vector.
+#
+# The ..._array static functions convert whole N x 4 arrays of (w, x, y, z)
+# at once.
+#
+
+class Quaternion:
+
+    __slots__ = ('w', 'x', 'y', 'z')
+
+    def __init__(self, w: float=1.0, x: float=0.0, y: float=0.0, z: float=0.0):
+        self.w, self.x, self.y, self.z = float(w), float(x), float(y), float(z)
+
+    def copy(self) -> Quaternion:
+        return Quaternion(self.w, self.x, self.y, self.z)
+
+    def __str__(self) -> str:
+        return f'(w={self.w:.4f} x={self.x:.4f} y={self.y:.4f} z={self.z:.4f})'
+
+    def __matmul__(self, other: Quaternion) -> Quaternion:
+        return Quaternion._product(other, self)
+
+    def __neg__(self) -> Quaternion:
+        return Quaternion(self.w, -self.x, -self.y, -self.z)
+
+    def __eq__(self, other: Quaternion) -> bool:    #type: ignore
+        return equal(abs(self.dot(other)), 1.0)
+
+    def __ne__(self, other: Quaternion) -> bool:    #type: ignore
+        return not (self==other)
+
+    def dot(self, other: Quaternion) -> float:
+        return self.w*other.w + self.x*other.x + self.y*other.y + self.z*other.z
+
+    def norm(self) -> float:
+        return sqrt(self.dot(self))
+
+    def normalize(self) -> Quaternion:
+        n = self.norm()
+        return Quaternion(self.w / n, self.x / n, self.y / n, self.z / n)
+
+    def to_array(self) -> np.ndarray:
+        return np.array([self.w, self.x, self.y, self.z])
+
+    def angle(self) -> float:
+        return 2 * r2d * acos(min(abs(self.w), 1.0))
+
+#
+# slerp - spherical interpolation from self (where=0) to other (where=1),
+# always taking the shorter way round
+#
+
+    def slerp(self, other: Quaternion, where: float) -> Quaternion:
+        d = self.dot(other)
+        o = other
+        if d < 0:
+            d = -d
+            o = Quaternion(-other.w, -other.x, -other.y, -other.z)
+        if d > 1 - 1e-9:
+            a, b = 1 - where, where
+        else:
+            theta = acos(d)
+            a = sin((1 - where) * theta) / sin(theta)
+            b = sin(where * theta) / sin(theta)
+        return Quaternion(a*self.w + b*o.w, a*self.x + b*o.x,
+                          a*self.y + b*o.y, a*self.z + b*o.z).normalize()
+
+    def rotate(self, p: Point) -> Point:
+        return p @ self.to_transform()
+
+#
+# Conversions to and from Transform and Angles
+#
+
+    def to_transform(self) -> Transform:
+        return Transform(Quaternion.to_transform_array(self.to_array()[np.newaxis])[0].m, rigid=True)
+
+    @staticmethod
+    def from_transform(tf: Transform) -> Quaternion:
+        return Quaternion(*Quaternion.from_transform_array(TransformArray(tf.m[np.newaxis]))[0])
+
+    def to_angles(self) -> Angles:
+        pitch, roll, yaw = Quaternion.to_angles_array(self.to_array()[np.newaxis])[0]
+        return Angles(pitch=pitch, roll=roll, yaw=yaw)
+
+    @staticmethod
+    def from_angles(a: Angles) -> Quaternion:
+        return Quaternion(*Quaternion.from_angles_array(np.array([[a.pitch, a.roll, a.yaw]]))[0])
+
+#
+# from_axis_angle - rotate by angle (degrees) about axis in the usual right
+# handed sense, so that for example z by 90 takes x onto y
+#
+
+    @staticmethod
+    def from_axis_angle(axis: Point, angle: float) -> Quaternion:
+        s = dsin(angle / 2) / axis.length()
+        return Quaternion(dcos(angle / 2), axis.x() * s, axis.y() * s, axis.z() * s)
+
+    @staticmethod
+    def _product(a: Quaternion, b: Quaternion) -> Quaternion:
+        return Quaternion(a.w*b.w - a.x*b.x - a.y*b.y - a.z*b.z,
+                          a.w*b.x + a.x*b.w + a.y*b.z - a.z*b.y,
+                          a.w*b.y - a.x*b.z + a.y*b.w + a.z*b.x,
+                          a.w*b.z + a.x*b.y - a.y*b.x + a.z*b.w)
+
+#
+# Batch conversions. Quaternion arrays are N x 4 (w, x, y, z), angle arrays
+# are N x 3 (pitch, roll, yaw) in degrees.
+#
+
+    @staticmethod
+    def to_transform_array(q: np.ndarray) -> TransformArray:
+        w, x, y, z = q[:, 0], q[:, 1], q[:, 2], q[:, 3]
+        m = np.zeros((q.shape[0], 4, 4))
+        # m holds the transposed rotation, since points are row vectors
+        m[:, 0, 0] = 1 - 2*(y*y + z*z)
+        m[:, 1, 0] = 2*(x*y - w*z)
+        m[:, 2, 0] = 2*(x*z + w*y)
+        m[:, 0, 1] = 2*(x*y + w*z)
+        m[:, 1, 1] = 1 - 2*(x*x + z*z)
+        m[:, 2, 1] = 2*(y*z - w*x)
+        m[:, 0, 2] = 2*(x*z - w*y)
+        m[:, 1, 2] = 2*(y*z + w*x)
+        m[:, 2, 2] = 1 - 2*(x*x + y*y)
+        m[:, 3, 3] = 1
+        return TransformArray(m, rigid=True)
+
+    @staticmethod
+    def from_transform_array(tfs: TransformArray) -> np.ndarray:
+        r = np.swapaxes(tfs.m[:, :3, :3], 1, 2)
+        trace = r[:, 0, 0] + r[:, 1, 1] + r[:, 2, 2]
+        # Shepperd's method: pivot on whichever of w, x, y, z is largest
+        # to keep the square root well away from zero
+        pivot = np.argmax(np.stack([trace, r[:, 0, 0], r[:, 1, 1], r[:, 2, 2]], axis=1), axis=1)
+        q = np.empty((r.shape[0], 4))
+        s = np.sqrt(np.maximum(1 + trace, SMALL)) * 2
+        sel = pivot==0
+        q[sel] = np.stack([s / 4,
+                           (r[:, 2, 1] - r[:, 1, 2]) / s,
+                           (r[:, 0, 2] - r[:, 2, 0]) / s,
+                           (r[:, 1, 0] - r[:, 0, 1]) / s], axis=1)[sel]
+        s = np.sqrt(np.maximum(1 + r[:, 0, 0] - r[:, 1, 1] - r[:, 2, 2], SMALL)) * 2
+        sel = pivot==1
+        q[sel] = np.stack([(r[:, 2, 1] - r[:, 1, 2]) / s,
+                           s / 4,
+                           (r[:, 0, 1] + r[:, 1, 0]) / s,
+                           (r[:, 0, 2] + r[:, 2, 0]) / s], axis=1)[sel]
+        s = np.sqrt(np.maximum(1 - r[:, 0, 0] + r[:, 1, 1] - r[:, 2, 2], SMALL)) * 2
+        sel = pivot==2
+        q[sel] = np.stack([(r[:, 0, 2] - r[:, 2, 0]) / s,
+                           (r[:, 0, 1] + r[:, 1, 0]) / s,
+                           s / 4,
+                           (r[:, 1, 2] + r[:, 2, 1]) / s], axis=1)[sel]
+        s = np.sqrt(np.maximum(1 - r[:, 0, 0] - r[:, 1, 1] + r[:, 2, 2], SMALL)) * 2
+        sel = pivot==3
+        q[sel] = np.stack([(r[:, 1, 0] - r[:, 0, 1]) / s,
+                           (r[:, 0, 2] + r[:, 2, 0]) / s,
+                           (r[:, 1, 2] + r[:, 2, 1]) / s,
+                           s / 4], axis=1)[sel]
+        q[q[:, 0] < 0] *= -1
+        return q
+
+    @staticmethod
+    def to_angles_array(q: np.ndarray) -> np.ndarray:
+        w, x, y, z = q[:, 0], q[:, 1], q[:, 2], q[:, 3]
+        # Transform composes x, y then z rotations on row vectors, which is
+        # the usual z-y-x sequence with all the angles negated
+        pitch = -r2d * np.arcsin(np.clip(2*(w*y - x*z), -1.0, 1.0))
+        roll = -r2d * np.arctan2(2*(y*z + w*x), 1 - 2*(x*x + y*y))
+        yaw = -r2d * np.arctan2(2*(x*y + w*z), 1 - 2*(y*y + z*z))
+        return np.stack([pitch, roll, yaw], axis=1)
+
+    @staticmethod
+    def from_angles_array(angles: np.ndarray) -> np.ndarray:
+        half = -angles * (d2r / 2)
+        cp, sp = np.cos(half[:, 0]), np.sin(half[:, 0])
+        cr, sr = np.cos(half[:, 1]), np.sin(half[:, 1])
+        cy, sy = np.cos(half[:, 2]), np.sin(half[:, 2])
+        return np.stack([cr*cp*cy + sr*sp*sy,
+                         sr*cp*cy - cr*sp*sy,
+                         cr*sp*cy + sr*cp*sy,
+                         cr*cp*sy - sr*sp*cy], axis=1)
 
 class Line:
     def __init__(self, p0: Point, p1: Point):
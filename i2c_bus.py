@@ -0,0 +1,276 @@
+#coding:utf-8
+
+from __future__ import annotations
+import heapq
+import itertools
+import smbus2
+import time
+from contextlib import contextmanager, nullcontext
+from threading import Thread, Condition, Event, Lock, local
+from typing import Any, Iterator
+from i2c_sim import SimulatedBus, SimPCA9685
+
+#
+# open_bus - the I2C bus used by the device drivers. Normally this is the
+# real bus, through smbus2, but use_simulated_bus switches every driver
+# over to a simulated bus with software stand-ins for the robot's
+# devices (see i2c_sim.py), so servo output can be run, measured and
+# profiled on any machine. One simulated bus is shared by all the drivers
+# that open the same bus number, as on real hardware.
+#
+# With use_bus_manager, each bus (real or simulated) is owned by an
+# I2CBusManager, and drivers get a ManagedBus for their client name
+# instead (see below).
+#
+
+simulated = False
+sim_clock = 400000.0
+sim_overhead = 50e-6
+sim_realtime = True
+sim_buses: dict[int, SimulatedBus] = {}
+
+managed = False
+managers: dict[int, I2CBusManager] = {}
+
+open_lock = Lock()    # drivers on different threads may open the same bus at once
+
+def use_simulated_bus(yesno: bool, clock: float=400000.0, overhead: float=50e-6,
+                      realtime: bool=True) -> None:
+    global simulated, sim_clock, sim_overhead, sim_realtime
+    simulated = yesno
+    sim_clock, sim_overhead, sim_realtime = clock, overhead, realtime
+    stop_bus_managers()
+    sim_buses.clear()
+
+def use_bus_manager(yesno: bool) -> None:
+    global managed
+    managed = yesno
+    stop_bus_managers()
+
+# stop_bus_managers - finish what is queued on every managed bus and stop
+# its thread, so that the buses can be replaced
+def stop_bus_managers() -> None:
+    with open_lock:
+        stopping = list(managers.values())
+        managers.clear()
+    for manager in stopping:
+        manager.stop()
+
+def open_raw_bus(number: int) -> smbus2.SMBus|SimulatedBus:
+    if simulated:
+        with open_lock:
+            if number not in sim_buses:
+                sim_buses[number] = SimulatedBus(number, sim_clock, sim_overhead, sim_realtime)
+            return sim_buses[number]
+    else:
+        return smbus2.SMBus(number)
+
+def open_bus(number: int=1, client: str='') -> smbus2.SMBus|SimulatedBus|ManagedBus:
+    if managed:
+        if number not in managers:
+            bus = open_raw_bus(number)
+            with open_lock:
+                if number not in managers:
+                    managers[number] = I2CBusManager(bus, number)
+        return managers[number].client(client)
+    else:
+        return open_raw_bus(number)
+
+def get_simulated_buses() -> dict[int, SimulatedBus]:
+    return sim_buses
+
+def get_bus_managers() -> dict[int, I2CBusManager]:
+    return managers
+
+# add a simulated PCA9685 at address, unless there is a device there already
+def simulate_pca9685(number: int, address: int) -> None:
+    bus = open_raw_bus(number)
+    if isinstance(bus, SimulatedBus) and address not in bus.devices:
+        bus.add_device(SimPCA9685(address))
+
+# write operations on bus inside the block go out together, when it is managed
+def bus_batch(bus: Any):
+    return bus.batch() if isinstance(bus, ManagedBus) else nullcontext()
+
+#
+# I2CBusManager - the only user of one bus. Drivers submit requests, each
+# one or more operations (SMBus method calls), and a thread carries them
+# out one at a time in priority order: servo frames first, then the IMU,
+# then the battery, and anything else with the IMU. Each time it wakes up
+# it takes all the queued requests at the highest waiting priority, so
+# requests that pile up behind a transaction go out back to back. A
+# request is never interrupted, so a servo frame submitted as one batch
+# reaches the servos without sensor reads in the middle of it.
+#
+# For each client the manager keeps the number of requests and operations,
+# the time the bus spent on them, and how long they waited in the queue.
+#
+# stop carries out whatever is already queued and then ends the thread;
+# after that, requests fail with OSError, as on a closed bus.
+#
+
+CLIENT_PRIORITIES = { 'servo' : 0, 'imu' : 1, 'battery' : 2 }
+DEFAULT_PRIORITY = 1
+
+class BusRequest:
+
+    def __init__(self, client: str, ops: list[tuple[str, tuple]]):
+        self.client = client
+        self.ops = ops
+        self.submitted = time.perf_counter()
+        self.done = Event()
+        self.result: Any = None
+        self.error: Exception|None = None
+
+class ClientStats:
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self.operations = 0
+        self.busy = 0.0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def show(self, elapsed: float) -> str:
+        return (f'requests {self.requests} operations {self.operations}'
+                f' utilization {100 * self.busy / max(elapsed, 1e-9):.1f}%'
+                f' wait mean {1000 * self.total_wait / max(self.requests, 1):.2f} mS'
+                f' max {1000 * self.max_wait:.2f} mS')
+
+class I2CBusManager:
+
+    def __init__(self, bus: smbus2.SMBus|SimulatedBus, number: int):
+        self.bus = bus
+        self.number = number
+        self.queue: list[tuple[int, int, BusRequest]] = []
+        self.sequence = itertools.count()
+        self.condition = Condition()
+        self.stats: dict[str, ClientStats] = {}
+        self.started = time.perf_counter()
+        self.stopping = False
+        self.my_thread = Thread(target=lambda: self.run(), daemon=True, name=f'i2c-{number}')
+        self.my_thread.start()
+
+    def client(self, name: str) -> ManagedBus:
+        return ManagedBus(self, name)
+
+    #
+    # submit - queue a request and wait for it, returning the result of
+    # its last operation
+    #
+
+    def submit(self, client: str, ops: list[tuple[str, tuple]]) -> Any:
+        request = BusRequest(client, ops)
+        with self.condition:
+            if self.stopping:
+                raise OSError(f'I2C bus {self.number} manager has stopped')
+            heapq.heappush(self.queue, (CLIENT_PRIORITIES.get(client, DEFAULT_PRIORITY),
+                                        next(self.sequence), request))
+            self.condition.notify()
+        request.done.wait()
+        if request.error:
+            raise request.error
+        return request.result
+
+    def run(self) -> None:
+        while True:
+            with self.condition:
+                while not self.queue and not self.stopping:
+                    self.condition.wait()
+                if not self.queue:
+                    return
+                priority = self.queue[0][0]
+                batch = []
+                while self.queue and self.queue[0][0] == priority:
+                    batch.append(heapq.heappop(self.queue)[2])
+            for request in batch:
+                self.execute(request)
+
+    def stop(self) -> None:
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+        self.my_thread.join()
+
+    def execute(self, request: BusRequest) -> None:
+        start = time.perf_counter()
+        try:
+            for name, args in request.ops:
+                request.result = getattr(self.bus, name)(*args)
+        except Exception as exc:
+            request.error = exc
+        end = time.perf_counter()
+        stats = self.stats.setdefault(request.client, ClientStats())
+        stats.requests += 1
+        stats.operations += len(request.ops)
+        stats.busy += end - start
+        wait = start - request.submitted
+        stats.total_wait += wait
+        stats.max_wait = max(stats.max_wait, wait)
+        request.done.set()
+
+    def show(self) -> str:
+        elapsed = time.perf_counter() - self.started
+        return '\n'.join([ f'bus {self.number}' ] +
+                         [ f'  {client:8} {s.show(elapsed)}'
+                           for client, s in sorted(self.stats.items(),
+                                                   key=lambda cs: CLIENT_PRIORITIES.get(cs[0], DEFAULT_PRIORITY)) ])
+
+#
+# ManagedBus - one client's view of a managed bus, with the SMBus methods.
+# Inside a batch, writes are held back and submitted together, as one
+# request, at the end of the batch or before the next read. Batches are
+# per thread, so another thread using the same driver isn't caught up in
+# one.
+#
+
+class ManagedBus:
+
+    def __init__(self, manager: I2CBusManager, client: str):
+        self.manager = manager
+        self.client = client
+        self.pending = local()
+
+    def call(self, name: str, *args) -> Any:
+        ops = getattr(self.pending, 'ops', None)
+        if ops is not None:
+            ops.append((name, args))
+            if name.startswith('write'):
+                return None
+            self.pending.ops = []
+            return self.manager.submit(self.client, ops)
+        return self.manager.submit(self.client, [ (name, args) ])
+
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        self.pending.ops = []
+        try:
+            yield
+        finally:
+            ops, self.pending.ops = self.pending.ops, None
+            if ops:
+                self.manager.submit(self.client, ops)
+
+    def write_byte(self, address: int, value: int, force=None) -> None:
+        self.call('write_byte', address, value)
+
+    def read_byte(self, address: int, force=None) -> int:
+        return self.call('read_byte', address)
+
+    def write_byte_data(self, address: int, reg: int, value: int, force=None) -> None:
+        self.call('write_byte_data', address, reg, value)
+
+    def read_byte_data(self, address: int, reg: int, force=None) -> int:
+        return self.call('read_byte_data', address, reg)
+
+    def read_word_data(self, address: int, reg: int, force=None) -> int:
+        return self.call('read_word_data', address, reg)
+
+    def write_i2c_block_data(self, address: int, reg: int, data, force=None) -> None:
+        self.call('write_i2c_block_data', address, reg, list(data))
+
+    def read_i2c_block_data(self, address: int, reg: int, length: int, force=None) -> list[int]:
+        return self.call('read_i2c_block_data', address, reg, length)
+
+    def close(self) -> None:
+        pass
@@ -0,0 +1,231 @@
+#coding:utf-8
+
+from __future__ import annotations
+import errno
+import time
+from threading import Lock
+
+#
+# Simulated I2C bus, with software stand-ins for the devices on the robot:
+# the PCA9685 servo controller, the MPU6050 IMU and the ADS7830 ADC. It has
+# the same methods as smbus2.SMBus, so drivers can't tell the difference.
+#
+# Every transaction is counted, along with the bytes that would be on the
+# wire (address, register and data bytes, each 9 bits with its ack). The
+# time a transaction would take on a real bus is a fixed overhead (the
+# kernel driver, start and stop) plus the bits at the bus clock rate; the
+# total is kept as busy_time, and if realtime is set the transaction
+# also takes (at least) that long, so timing measured on any machine is
+# close to a Pi. The delay is a sleep, which lets transactions on other
+# buses go ahead at the same time, as they would on real hardware.
+#
+
+STANDARD_MODE = 100000
+FAST_MODE = 400000
+
+class SimDevice:
+
+    def __init__(self, address: int):
+        self.address = address
+        self.regs = bytearray(256)
+        self.pointer = 0
+
+    def write(self, reg: int, data: bytes) -> None:
+        for i, b in enumerate(data):
+            self.regs[(reg + i) & 0xFF] = b
+
+    def read(self, reg: int, length: int) -> bytes:
+        return bytes(self.regs[(reg + i) & 0xFF] for i in range(length))
+
+    def write_byte(self, value: int) -> None:      # a command or register pointer with no data
+        self.pointer = value
+
+    def read_byte(self) -> int:
+        return self.regs[self.pointer]
+
+class SimPCA9685(SimDevice):
+
+    MODE1 = 0x00
+    AI = 0x20
+    LED0_ON_L = 0x06
+
+    # without auto-increment, every byte of a block write lands in the same register
+    def write(self, reg: int, data: bytes) -> None:
+        if self.regs[self.MODE1] & self.AI:
+            super().write(reg, data)
+        elif data:
+            self.regs[reg] = data[-1]
+
+    def get_counts(self) -> list[int]:
+        return [ self.regs[self.LED0_ON_L + 4*ch + 2] | ((self.regs[self.LED0_ON_L + 4*ch + 3] & 0x0F) << 8)
+                 for ch in range(16) ]
+
+class SimMPU6050(SimDevice):
+
+    SMPLRT_DIV = 0x19
+    FIFO_EN = 0x23
+    ACCEL_XOUT_H = 0x3B
+    GYRO_XOUT_H = 0x43
+    USER_CTRL = 0x6A
+    FIFO_COUNTH = 0x72
+    FIFO_R_W = 0x74
+    WHO_AM_I = 0x75
+    USER_CTRL_FIFO_EN = 0x40
+    USER_CTRL_FIFO_RESET = 0x04
+    FIFO_SIZE = 1024
+
+    # at rest and level: 1g on Z, at the 2g range
+    def __init__(self, address: int):
+        super().__init__(address)
+        self.regs[self.WHO_AM_I] = 0x68
+        self.fifo = bytearray()
+        self.fifo_time = time.monotonic()
+        self.set_reading((0, 0, 16384), 0, (0, 0, 0))
+
+    def set_reading(self, accel: tuple[int, int, int], temp: int, gyro: tuple[int, int, int]) -> None:
+        data = bytearray()
+        for v in accel + (temp,) + gyro:
+            data += (v & 0xFFFF).to_bytes(2, 'big')
+        self.regs[self.ACCEL_XOUT_H:self.ACCEL_XOUT_H+14] = data
+
+    #
+    # fill_fifo - queue the samples (the current accel and gyro reading)
+    # taken since the last time, at the rate set by SMPLRT_DIV. Once the
+    # FIFO is full the oldest samples are dropped, keeping as many whole
+    # samples as fit, so reads always start on a sample.
+    #
+
+    def fill_fifo(self) -> None:
+        now = time.monotonic()
+        period = (self.regs[self.SMPLRT_DIV] + 1) / 1000.0
+        samples = int((now - self.fifo_time) / period)
+        self.fifo_time += samples * period
+        if self.regs[self.USER_CTRL] & self.USER_CTRL_FIFO_EN and self.regs[self.FIFO_EN]:
+            sample = (self.regs[self.ACCEL_XOUT_H:self.ACCEL_XOUT_H+6]
+                      + self.regs[self.GYRO_XOUT_H:self.GYRO_XOUT_H+6])
+            capacity = self.FIFO_SIZE // len(sample)
+            self.fifo += sample * min(samples, capacity)
+            del self.fifo[:-capacity * len(sample)]
+
+    def write(self, reg: int, data: bytes) -> None:
+        super().write(reg, data)
+        if reg == self.USER_CTRL and self.regs[reg] & self.USER_CTRL_FIFO_RESET:
+            self.fifo.clear()
+            self.fifo_time = time.monotonic()
+            self.regs[reg] &= ~self.USER_CTRL_FIFO_RESET
+
+    def read(self, reg: int, length: int) -> bytes:
+        if reg == self.FIFO_COUNTH:
+            self.fill_fifo()
+            return len(self.fifo).to_bytes(2, 'big')[:length]
+        elif reg == self.FIFO_R_W:
+            data = bytes(self.fifo[:length]).ljust(length, b'\xff')
+            del self.fifo[:length]
+            return data
+        return super().read(reg, length)
+
+class SimADS7830(SimDevice):
+
+    # 8 single-ended inputs; the default reads as a 7.4V battery through the 1:2 divider
+    def __init__(self, address: int):
+        super().__init__(address)
+        self.inputs = [ 0 ] * 8
+        self.inputs[0] = round(7.4 / 10.0 * 255)
+
+    def read_byte(self) -> int:
+        bits = (self.pointer >> 4) & 0x07
+        channel = ((bits & 0x03) << 1) | (bits >> 2)    # undo the command's bit order
+        return self.inputs[channel]
+
+class SimulatedBus:
+
+    def __init__(self, number: int=1, clock: float=FAST_MODE, overhead: float=50e-6,
+                 realtime: bool=True):
+        self.number = number
+        self.clock = clock
+        self.overhead = overhead
+        self.realtime = realtime
+        self.lock = Lock()
+        self.devices: dict[int, SimDevice] = {}
+        self.transactions = 0
+        self.bytes = 0
+        self.busy_time = 0.0
+        for d in (SimPCA9685(0x40), SimMPU6050(0x68), SimADS7830(0x48)):
+            self.add_device(d)
+
+    def add_device(self, device: SimDevice) -> None:
+        self.devices[device.address] = device
+
+    def get_device(self, address: int) -> SimDevice:
+        try:
+            return self.devices[address]
+        except KeyError:
+            raise OSError(errno.EREMOTEIO, f'no device at address {address:#04x}')
+
+    #
+    # transfer - account for one transaction of wire_bytes, including the
+    # address byte (twice for a read from a register, after the repeated start)
+    #
+
+    def transfer(self, wire_bytes: int) -> None:
+        duration = self.overhead + (9 * wire_bytes + 2) / self.clock
+        self.transactions += 1
+        self.bytes += wire_bytes
+        self.busy_time += duration
+        if self.realtime:
+            time.sleep(duration)
+
+    def write_byte(self, address: int, value: int, force=None) -> None:
+        with self.lock:
+            self.get_device(address).write_byte(value)
+            self.transfer(2)
+
+    def read_byte(self, address: int, force=None) -> int:
+        with self.lock:
+            result = self.get_device(address).read_byte()
+            self.transfer(2)
+        return result
+
+    def write_byte_data(self, address: int, reg: int, value: int, force=None) -> None:
+        with self.lock:
+            self.get_device(address).write(reg, bytes((value,)))
+            self.transfer(3)
+
+    def read_byte_data(self, address: int, reg: int, force=None) -> int:
+        with self.lock:
+            result = self.get_device(address).read(reg, 1)[0]
+            self.transfer(4)
+        return result
+
+    def read_word_data(self, address: int, reg: int, force=None) -> int:
+        with self.lock:
+            data = self.get_device(address).read(reg, 2)
+            self.transfer(5)
+        return data[0] | (data[1] << 8)
+
+    def write_i2c_block_data(self, address: int, reg: int, data, force=None) -> None:
+        if len(data) > 32:
+            raise ValueError('Data length cannot exceed 32 bytes')
+        with self.lock:
+            self.get_device(address).write(reg, bytes(data))
+            self.transfer(2 + len(data))
+
+    def read_i2c_block_data(self, address: int, reg: int, length: int, force=None) -> list[int]:
+        if length > 32:
+            raise ValueError('Desired block length over 32 bytes')
+        with self.lock:
+            result = list(self.get_device(address).read(reg, length))
+            self.transfer(3 + length)
+        return result
+
+    def close(self) -> None:
+        pass
+
+    def reset_counts(self) -> None:
+        self.transactions = 0
+        self.bytes = 0
+        self.busy_time = 0.0
+
+    def show(self) -> str:
+        return (f'simulated bus {self.number} at {self.clock / 1000:.0f} kHz: {self.transactions} transactions'
+                f' {self.bytes} bytes busy {self.busy_time:.3f} S')
@@ -0,0 +1,60 @@
+#coding:utf-8
+
+from __future__ import annotations
+import json
+import time
+import numpy as np
+
+#
+# ImuCalibration - the IMU biases, saved so that the next start doesn't
+# need to measure them again. The bias of each axis of accel (m/s^2) and
+# gyro (degrees/sec) is its reading at rest, less gravity with the robot
+# level. Biases, the gyro's especially, change with temperature and drift
+# as the chip ages, so the chip temperature and the time are saved with
+# them, and they are only reused while the temperature is within a
+# tolerance of that, and for a limited number of days.
+#
+# The file is JSON, like the servo calibration:
+#
+#   { "accel_bias" : [ x, y, z ], "gyro_bias" : [ x, y, z ],
+#     "temperature" : degrees C, "timestamp" : seconds since the epoch }
+#
+
+DEFAULT_TEMPERATURE_TOLERANCE = 5.0
+DEFAULT_MAX_AGE = 30.0        # days
+
+class ImuCalibration:
+
+    def __init__(self, bias: np.ndarray, temperature: float, timestamp: float|None=None):
+        self.bias = bias
+        self.temperature = temperature
+        self.timestamp = time.time() if timestamp is None else timestamp
+
+    def get_age(self) -> float:
+        return (time.time() - self.timestamp) / 86400
+
+    def matches(self, temperature: float, tolerance: float=DEFAULT_TEMPERATURE_TOLERANCE,
+                max_age: float=DEFAULT_MAX_AGE) -> bool:
+        return abs(temperature - self.temperature) <= tolerance and 0 <= self.get_age() <= max_age
+
+    def save(self, filename: str) -> None:
+        data = { 'accel_bias' : self.bias[:3].tolist(),
+                 'gyro_bias' : self.bias[3:].tolist(),
+                 'temperature' : round(self.temperature, 2),
+                 'timestamp' : round(self.timestamp, 1) }
+        with open(filename, 'w') as f:
+            f.write(json.dumps(data, indent=4))
+            f.write('\n')
+
+    # load - the saved calibration, or None if there isn't a valid one
+    @staticmethod
+    def load(filename: str) -> ImuCalibration|None:
+        try:
+            with open(filename) as f:
+                data = json.loads(f.read())
+            bias = np.array(data['accel_bias'] + data['gyro_bias'], dtype=float)
+            if bias.shape != (6,):
+                return None
+            return ImuCalibration(bias, float(data['temperature']), float(data['timestamp']))
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
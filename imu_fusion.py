@@ -0,0 +1,218 @@
+#coding:utf-8
+
+from __future__ import annotations
+import math
+import numpy as np
+from abc import ABC, abstractmethod
+
+#
+# IMU sensor fusion: an attitude filter that combines the gyro rates with
+# the direction of gravity from the accelerometer, so the attitude doesn't
+# drift as it does when the gyro alone is integrated.
+#
+# Samples are rows of accel (x, y, z, m/s^2) and gyro (x, y, z,
+# degrees/sec). The attitude is a quaternion (w, x, y, z) rotating the
+# sensor frame into the world frame. Angles here are the usual z-y-x
+# Euler angles, in degrees, with roll about x, pitch about y and yaw about
+# z; Quaternion.to_angles in geometry.py gives the same angles with the
+# opposite sign, as used by Transform. Yaw has no accelerometer
+# reference, so it still drifts.
+#
+#   mahony          a Mahony filter: the cross product of measured and
+#                   expected gravity is fed back into the gyro rates, with
+#                   proportional gain kp and integral gain ki, the latter
+#                   learning the gyro bias
+#   complementary   the gyro is integrated, then roll and pitch are pulled
+#                   towards those of gravity with time constant tau
+#
+
+FILTER_TYPES = ('mahony', 'complementary')
+
+#
+# KalmanArray - a scalar Kalman filter on each of a number of channels at
+# once, as Kalman_filter in Kalman.py (including its blend towards a
+# reading that jumps by jump or more). filter takes one row per sample.
+#
+# The error covariance p doesn't depend on the readings, so it and the
+# gain g are the same for every channel, and the gains for a batch are
+# known in advance (and once p has settled, constant). Without jumps each channel is then the linear
+# recurrence x[i] = (1 - g[i]) x[i-1] + g[i] z[i], which with
+# D[i] = (1 - g[1]) ... (1 - g[i]) is
+#
+#   x[i] = D[i] (x[0] + sum over j <= i of g[j] z[j] / D[j])
+#
+# so the whole batch is filtered with a cumulative product and sum. The
+# batch is taken in chunks of CHUNK samples to keep D well away from zero.
+# The first sample with a jump ends a chunk, and is filtered on its own.
+#
+
+class KalmanArray:
+
+    CHUNK = 32
+
+    def __init__(self, channels: int, q: float, r: float, jump: float=60.0):
+        self.q = q
+        self.r = r
+        self.jump = jump
+        self.p = 1.0
+        self.x = np.zeros(channels)
+
+    # gains - the gains for the next n samples, and p after each of them.
+    # p soon settles, after which they are all the same.
+    def gains(self, n: int) -> tuple[np.ndarray, np.ndarray]:
+        p = self.p + self.q
+        gain = p / (p + self.r)
+        if (1 - gain) * p == self.p:
+            return np.full(n, gain), np.full(n, self.p)
+        gains = np.empty(n)
+        ps = np.empty(n)
+        p = self.p
+        for i in range(n):
+            p += self.q
+            gains[i] = p / (p + self.r)
+            ps[i] = p = (1 - gains[i]) * p
+        return gains, ps
+
+    def filter(self, samples: np.ndarray) -> np.ndarray:
+        result = np.empty_like(samples)
+        i = 0
+        while i < len(samples):
+            z = samples[i:i+self.CHUNK]
+            gains, ps = self.gains(len(z))
+            decay = np.cumprod(1 - gains)[:, np.newaxis]
+            x = decay * (self.x + np.cumsum(gains[:, np.newaxis] * z / decay, axis=0))
+            previous = np.concatenate((self.x[np.newaxis], x[:-1]))
+            jumps = np.flatnonzero((np.abs(z - previous) >= self.jump).any(axis=1))
+            n = jumps[0] if len(jumps) else len(z)
+            result[i:i+n] = x[:n]
+            if n < len(z):
+                d = z[n] - previous[n]
+                x[n] = previous[n] + d * (gains[n] + 0.4 * (np.abs(d) >= self.jump))
+                result[i+n] = x[n]
+                n += 1
+            self.x = x[n-1].copy()
+            self.p = float(ps[n-1])
+            i += n
+        return result
+
+#
+# Quaternion helpers on (w, x, y, z) arrays
+#
+
+def quaternion_product(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return np.array([a[0]*b[0] - a[1]*b[1] - a[2]*b[2] - a[3]*b[3],
+                     a[0]*b[1] + a[1]*b[0] + a[2]*b[3] - a[3]*b[2],
+                     a[0]*b[2] - a[1]*b[3] + a[2]*b[0] + a[3]*b[1],
+                     a[0]*b[3] + a[1]*b[2] - a[2]*b[1] + a[3]*b[0]])
+
+# quaternion_to_angles - pitch, roll and yaw (degrees)
+def quaternion_to_angles(q: np.ndarray) -> np.ndarray:
+    w, x, y, z = q
+    return np.degrees([ math.asin(min(max(2*(w*y - x*z), -1.0), 1.0)),
+                        math.atan2(2*(w*x + y*z), 1 - 2*(x*x + y*y)),
+                        math.atan2(2*(w*z + x*y), 1 - 2*(y*y + z*z)) ])
+
+def angles_to_quaternion(pitch: float, roll: float, yaw: float) -> np.ndarray:
+    cp, sp = math.cos(math.radians(pitch) / 2), math.sin(math.radians(pitch) / 2)
+    cr, sr = math.cos(math.radians(roll) / 2), math.sin(math.radians(roll) / 2)
+    cy, sy = math.cos(math.radians(yaw) / 2), math.sin(math.radians(yaw) / 2)
+    return np.array([cr*cp*cy + sr*sp*sy,
+                     sr*cp*cy - cr*sp*sy,
+                     cr*sp*cy + sr*cp*sy,
+                     cr*cp*sy - sr*sp*cy])
+
+class AttitudeFilter(ABC):
+
+    def __init__(self) -> None:
+        self.q = np.array([ 1.0, 0.0, 0.0, 0.0 ])
+
+    # rotate by rates (radians/sec) for dt
+    def integrate(self, rates: np.ndarray, dt: float) -> None:
+        q = self.q + quaternion_product(self.q, np.concatenate(([ 0.0 ], rates))) * (dt / 2)
+        self.q = q / np.linalg.norm(q)
+
+    # step - update the attitude with one accel and gyro reading, dt after the last
+    @abstractmethod
+    def step(self, accel: np.ndarray, gyro: np.ndarray, dt: float) -> None:
+        pass
+
+class MahonyFilter(AttitudeFilter):
+
+    def __init__(self, kp: float, ki: float):
+        super().__init__()
+        self.kp = kp
+        self.ki = ki
+        self.integral = np.zeros(3)
+
+    def step(self, accel: np.ndarray, gyro: np.ndarray, dt: float) -> None:
+        rates = np.radians(gyro)
+        norm = np.linalg.norm(accel)
+        if norm > 0:
+            ax, ay, az = (accel / norm).tolist()
+            w, x, y, z = self.q.tolist()
+            vx, vy, vz = 2*(x*z - w*y), 2*(w*x + y*z), w*w - x*x - y*y + z*z
+            error = np.array([ ay*vz - az*vy, az*vx - ax*vz, ax*vy - ay*vx ])
+            self.integral += self.ki * error * dt
+            rates += self.kp * error + self.integral
+        self.integrate(rates, dt)
+
+class ComplementaryFilter(AttitudeFilter):
+
+    def __init__(self, tau: float):
+        super().__init__()
+        self.tau = tau
+
+    def step(self, accel: np.ndarray, gyro: np.ndarray, dt: float) -> None:
+        self.integrate(np.radians(gyro), dt)
+        if np.linalg.norm(accel) > 0:
+            pitch, roll, yaw = quaternion_to_angles(self.q)
+            alpha = self.tau / (self.tau + dt)
+            accel_pitch = math.degrees(math.atan2(-accel[0], math.hypot(accel[1], accel[2])))
+            accel_roll = math.degrees(math.atan2(accel[1], accel[2]))
+            self.q = angles_to_quaternion(alpha * pitch + (1 - alpha) * accel_pitch,
+                                          alpha * roll + (1 - alpha) * accel_roll, yaw)
+
+#
+# FusionEngine - the Kalman prefilter and an attitude filter, stepped at
+# rate (Hz). Samples arrive in batches, dt apart; each step uses the mean
+# of the prefiltered samples since the last one. update returns the
+# attitude in effect at each sample, one quaternion per row.
+#
+
+class FusionEngine:
+
+    def __init__(self, filter_type: str, rate: float, kp: float=1.0, ki: float=0.01, tau: float=0.5,
+                 kalman_q: float=0.001, kalman_r: float=0.1):
+        if filter_type not in FILTER_TYPES:
+            raise ValueError(f"unknown IMU filter '{filter_type}'")
+        self.filter: AttitudeFilter = MahonyFilter(kp, ki) if filter_type=='mahony' else ComplementaryFilter(tau)
+        self.period = 1 / rate
+        self.prefilter = KalmanArray(6, kalman_q, kalman_r)
+        self.pending = np.zeros(6)
+        self.pending_count = 0
+        self.pending_time = 0.0
+        self.steps = 0
+
+    @property
+    def quaternion(self) -> np.ndarray:
+        return self.filter.q
+
+    def update(self, samples: np.ndarray, dt: float) -> np.ndarray:
+        filtered = self.prefilter.filter(samples)
+        attitudes = np.empty((len(samples), 4))
+        i = 0
+        while i < len(samples):
+            take = min(len(samples) - i, max(math.ceil((self.period - self.pending_time) / max(dt, 1e-9) - 1e-6), 1))
+            self.pending += filtered[i:i+take].sum(axis=0)
+            self.pending_count += take
+            self.pending_time += take * dt
+            if self.pending_time >= self.period - 1e-9:
+                mean = self.pending / self.pending_count
+                self.filter.step(mean[:3], mean[3:], self.pending_time)
+                self.steps += 1
+                self.pending[:] = 0.0
+                self.pending_count = 0
+                self.pending_time = 0.0
+            attitudes[i:i+take] = self.filter.q
+            i += take
+        return attitudes
@@ -3,13 +3,15 @@
 from __future__ import annotations
 from geometry import *
 import numpy as np
-from typing import Self, Iterator
+from typing import Self, Iterator, Callable
 from dtrig import *
 from math import *
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
+from collections import OrderedDict
 from enum import Enum
 from params import Params
 from servo_action import *
+from servo import the_table
 from logger import Logger
 
 #
@@ -66,6 +68,11 @@ class Leg:
     def __init__(self, _number: int, _which: str, _location: Point, _femur: float, _tibia: float,
                  _servo_ids: ServoIds, _rest_position: Point = Point()):
         self.number, self.location, self.which = _number, _location, _which
+        self.ik_cache: IKCache|None = None
+        if Params.get_or('ik_cache_size', 0) > 0:
+            self.ik_cache = IKCache(int(Params.get('ik_cache_size')), Params.get('ik_cache_quantum'))
+        self.workspace: LegWorkspace|None = None
+        self.workspace_generation = -1
         self.femur, self.tibia = _femur, _tibia
         self.servo_ids = _servo_ids
         self.reverse = (self.which[1]=='r')
@@ -81,6 +88,34 @@ class Leg:
     def __str__(self) -> str:
         return f'{self.which} {self.position}'
 
+#
+# femur and tibia lengths - changing either invalidates everything derived
+# from them
+#
+
+    @property
+    def femur(self) -> float:
+        return self._femur
+
+    @femur.setter
+    def femur(self, f: float) -> None:
+        self._femur = f
+        self._invalidate()
+
+    @property
+    def tibia(self) -> float:
+        return self._tibia
+
+    @tibia.setter
+    def tibia(self, t: float) -> None:
+        self._tibia = t
+        self._invalidate()
+
+    def _invalidate(self) -> None:
+        self.workspace = None
+        if self.ik_cache:
+            self.ik_cache.clear()
+
     def set_rest_position(self, pos: Point) -> None:
         self.rest_position = pos
 
@@ -104,7 +139,7 @@ class Leg:
 
     def goto(self, target: Point, actions: ServoActionList) -> None:
         try:
-            self.angles = self.get_angles(target)
+            self.angles = self.get_cached_angles(target)
         except ValueError as exc:
             Logger.error(f"leg '{self.which}' target{target} ({exc})")
             raise exc
@@ -122,17 +157,19 @@ class Leg:
         Logger.info(f'leg.start_step \'{self.which}\' start {self.start} step {step} dest {self.dest}')
 
     def step(self, phase: StepPhase, actions: ServoActionList) -> None:
+        self.goto(self.step_target(phase), actions)
+
+    def step_target(self, phase: StepPhase) -> Point:
         match phase:
             case StepPhase.clear:
-                self.goto(self.start.replace_z(self.start.z() + self.clear_height), actions)
+                return self.start.replace_z(self.start.z() + self.clear_height)
             case StepPhase.lift:
-                p1 = (self.start + self.this_step / 2).replace_z(self.step_height)
-                #Logger.info(f'lift leg {self.which} p1 {p1} start {self.start} dest {self.dest}')
-                self.goto(p1, actions)
+                #Logger.info(f'lift leg {self.which} start {self.start} dest {self.dest}')
+                return (self.start + self.this_step / 2).replace_z(self.step_height)
             case StepPhase.drop:
-                self.goto((self.dest).replace_z(self.dest.z() + self.clear_height), actions)
+                return (self.dest).replace_z(self.dest.z() + self.clear_height)
             case StepPhase.pose:
-                self.goto(self.dest, actions)
+                return self.dest
 
     def end_step(self) -> Point:
         self.position = self.get_toe_pos(self.angles)
@@ -145,6 +182,69 @@ class Leg:
     def get_angles(self, toe_pos: Point) -> LegAngles:    # always overridden
         return LegAngles()
 
+    def get_cached_angles(self, toe_pos: Point) -> LegAngles:
+        if self.ik_cache:
+            return self.ik_cache.lookup(toe_pos, self.get_angles)
+        else:
+            return self.get_angles(toe_pos)
+
+    def show_ik_cache(self) -> str:
+        return f"Leg '{self.which}' IK cache {self.ik_cache.show() if self.ik_cache else 'disabled'}"
+
+#
+# Workspace - which targets can be reached within the servo limits. The
+# workspace is built on first use, and rebuilt if any servo calibration
+# has changed since, which the servo table counts in its generation.
+#
+
+    def get_servo_limits(self) -> np.ndarray:
+        return the_table.get_limits(np.array([ ch for name, ch in self.servo_ids ]))
+
+    def get_workspace(self) -> LegWorkspace|None:
+        if self.workspace is None or self.workspace_generation != the_table.generation:
+            self.workspace = self.make_workspace(self.get_servo_limits())
+            self.workspace_generation = the_table.generation
+        return self.workspace
+
+    def make_workspace(self, limits: np.ndarray) -> LegWorkspace|None:    # overridden where supported
+        return None
+
+    def is_reachable(self, target: Point) -> bool:
+        ws = self.get_workspace()
+        return ws is None or ws.contains(target)
+
+    def classify_target(self, target: Point) -> int:
+        ws = self.get_workspace()
+        return LegWorkspace.REACHABLE if ws is None else ws.classify(target)
+
+    def reachable_array(self, targets: np.ndarray|PointArray) -> np.ndarray:
+        if isinstance(targets, PointArray):
+            targets = targets.p
+        ws = self.get_workspace()
+        return np.ones(targets.shape[0], dtype=bool) if ws is None else ws.contains_array(targets)
+
+#
+# get_angles_array - inverse kinematics for many toe positions at once, see
+# solve_ik
+#
+
+    def get_angles_array(self, targets: np.ndarray|PointArray) -> tuple[np.ndarray, np.ndarray]:
+        if isinstance(targets, PointArray):
+            targets = targets.p
+        return type(self).solve_ik(targets, self.femur, self.tibia)
+
+#
+# solve_ik - targets is N x 3 (or N x 4) toe positions, femur and tibia
+# are either single lengths or one per row, so that rows for different legs
+# can be mixed. Returns an N x 3 array of cox, femur, tibia angles and a
+# boolean mask of which rows are reachable. Unreachable rows are nan.
+#
+
+    @staticmethod
+    def solve_ik(targets: np.ndarray, femur: float|np.ndarray, tibia: float|np.ndarray) \
+        -> tuple[np.ndarray, np.ndarray]:    # always overridden
+        return np.zeros((targets.shape[0], 3)), np.ones(targets.shape[0], dtype=bool)
+
     def get_toe_pos(self, angles: LegAngles) -> Point:    # always overridden
         return Point()
 
@@ -209,3 +309,171 @@ class QuadLeg(Leg):
         h = t1.y()
         return Point(t1.x(), -h * dsin(angles.cox - 90), h * dcos(angles.cox - 90)) 
 
+    def make_workspace(self, limits: np.ndarray) -> LegWorkspace|None:
+        return LegWorkspace(self, limits, Params.get('workspace_resolution'))
+
+#
+# solve_ik - vectorized equivalent of get_angles. Unlike get_femur_tibia,
+# a target too close to the hip to reach is also reported as unreachable.
+#
+
+    @staticmethod
+    def solve_ik(targets: np.ndarray, femur: float|np.ndarray, tibia: float|np.ndarray) \
+        -> tuple[np.ndarray, np.ndarray]:
+        x, y, z = targets[:, 0], targets[:, 1], targets[:, 2]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cox = vdatan2(y, -z)
+            r = -z / vdcos(cox)
+            h = np.sqrt(x*x + r*r)
+            alpha = vdatan2(x, r)
+            beta = vdacos((h*h + femur*femur - tibia*tibia) / (2*h*femur))
+            result = np.stack([cox + 90,
+                               90 - (beta - alpha),
+                               vdacos((tibia*tibia + femur*femur - h*h) / (2*tibia*femur))], axis=1)
+        reachable = ~np.isnan(result).any(axis=1) & (h <= femur + tibia)
+        result[~reachable] = np.nan
+        return result, reachable
+
+
+#
+# IKCache - memoizes inverse kinematics, keyed on the target quantized to a
+# multiple of quantum. The angles returned are those for the quantized
+# target, so they are the same however the target was arrived at. When the
+# cache is full the least recently used entry is evicted.
+#
+
+class IKCache:
+
+    def __init__(self, size: int, quantum: float):
+        self.size = size
+        self.quantum = quantum
+        self.entries: OrderedDict[tuple[int, int, int], LegAngles] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, target: Point, solve: Callable[[Point], LegAngles]) -> LegAngles:
+        q = self.quantum
+        key = (round(target.x() / q), round(target.y() / q), round(target.z() / q))
+        result = self.entries.get(key)
+        if result is None:
+            self.misses += 1
+            result = solve(Point(key[0] * q, key[1] * q, key[2] * q))
+            self.entries[key] = result
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return replace(result)
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+    def show(self) -> str:
+        total = self.hits + self.misses
+        return (f'entries {len(self.entries)}/{self.size} hits {self.hits} misses {self.misses}'
+                f' hit rate {(100 * self.hits / total) if total else 0:.1f}%')
+
+#
+# LegWorkspace - precomputed index of the toe positions a QuadLeg can reach,
+# taking into account both the leg geometry and the servo limits. Each
+# position is classified as:
+#
+#   UNREACHABLE - geometrically impossible
+#   CLAMPED     - possible, but some servo would be clamped to its limits
+#   REACHABLE   - possible within the servo limits
+#
+# The femur and tibia angles depend only on x and on the distance r of the
+# toe from the x axis, while the cox angle depends only on the direction in
+# the y-z plane. So the index is a 2D grid over (x, r), plus an analytic
+# check on the cox angle. A position is looked up in the grid cell around
+# it: if all four corners agree, that is the answer. Otherwise the cell
+# straddles a boundary, and the position is classified exactly with the
+# leg's inverse kinematics, so positions near a boundary are never
+# misclassified, and lookups away from one are O(1).
+#
+
+class LegWorkspace:
+
+    UNREACHABLE = 0
+    CLAMPED = 1
+    REACHABLE = 2
+
+    def __init__(self, leg: Leg, limits: np.ndarray, resolution: float):
+        self.limits = limits
+        self.resolution = resolution
+        self.solve = leg.get_angles_array
+        self.reach = leg.femur + leg.tibia
+        xx = np.arange(-self.reach, self.reach + resolution, resolution)
+        rr = np.arange(0, self.reach + resolution, resolution)
+        x, r = np.meshgrid(xx, rr, indexing='ij')
+        targets = np.stack([x.ravel(), np.zeros(x.size), -r.ravel()], axis=1)
+        self.grid = self.classify_exact(targets).reshape(x.shape)
+
+    #
+    # classify_exact - classify targets from their inverse kinematics,
+    # leaving out the cox angle
+    #
+
+    def classify_exact(self, targets: np.ndarray) -> np.ndarray:
+        angles, reachable = self.solve(targets)
+        limits = self.limits
+        with np.errstate(invalid='ignore'):
+            within = ((angles[:,1] >= limits[1][0]) & (angles[:,1] <= limits[1][1])
+                      & (angles[:,2] >= limits[2][0]) & (angles[:,2] <= limits[2][1]))
+        return np.where(reachable,
+                        np.where(within, LegWorkspace.REACHABLE, LegWorkspace.CLAMPED),
+                        LegWorkspace.UNREACHABLE).astype(np.int8)
+
+    #
+    # Targets outside the grid, or not finite, are classified exactly too
+    # (which makes them UNREACHABLE, or nan ones), in classify and
+    # classify_array alike.
+    #
+
+    def classify(self, p: Point) -> int:
+        r = hypot(p.y(), p.z())
+        result = -1
+        if isfinite(p.x()) and isfinite(r):
+            i = floor((p.x() + self.reach) / self.resolution)
+            j = floor(r / self.resolution)
+        else:
+            i = j = -1
+        if i >= 0 and i + 1 < self.grid.shape[0] and j + 1 < self.grid.shape[1]:
+            grid = self.grid
+            corners = { int(grid[i][j]), int(grid[i+1][j]), int(grid[i][j+1]), int(grid[i+1][j+1]) }
+            if len(corners)==1:
+                result = corners.pop()
+        if result < 0:
+            result = int(self.classify_exact(np.array([ [ p.x(), 0.0, -r ] ]))[0])
+        cox = datan2(p.y(), -p.z()) + 90
+        if result==LegWorkspace.REACHABLE and (cox < self.limits[0][0] or cox > self.limits[0][1]):
+            result = LegWorkspace.CLAMPED
+        return result
+
+    def classify_array(self, targets: np.ndarray) -> np.ndarray:
+        x, y, z = targets[:, 0], targets[:, 1], targets[:, 2]
+        r = np.sqrt(y*y + z*z)
+        finite = np.isfinite(x) & np.isfinite(r)
+        i = np.floor((np.where(finite, x, -2 * self.reach) + self.reach) / self.resolution).astype(int)
+        j = np.floor(np.where(finite, r, 0.0) / self.resolution).astype(int)
+        inside = (i >= 0) & (i + 1 < self.grid.shape[0]) & (j + 1 < self.grid.shape[1])
+        result = np.full(targets.shape[0], LegWorkspace.UNREACHABLE, dtype=np.int8)
+        i, j = i[inside], j[inside]
+        corners = np.stack([ self.grid[i, j], self.grid[i+1, j], self.grid[i, j+1], self.grid[i+1, j+1] ])
+        lowest = corners.min(axis=0)
+        result[inside] = lowest
+        exact = ~inside
+        exact[inside] = lowest != corners.max(axis=0)
+        if exact.any():
+            result[exact] = self.classify_exact(np.stack([ x[exact], np.zeros(exact.sum()), -r[exact] ], axis=1))
+        cox = vdatan2(y, -z) + 90
+        clamped = (result==LegWorkspace.REACHABLE) & ((cox < self.limits[0][0]) | (cox > self.limits[0][1]))
+        result[clamped] = LegWorkspace.CLAMPED
+        return result
+
+    def contains(self, p: Point) -> bool:
+        return self.classify(p)==LegWorkspace.REACHABLE
+
+    def contains_array(self, targets: np.ndarray) -> np.ndarray:
+        return self.classify_array(targets)==LegWorkspace.REACHABLE
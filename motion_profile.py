@@ -0,0 +1,143 @@
+#coding:utf-8
+
+from __future__ import annotations
+import math
+import numpy as np
+from params import Params
+from servo import ServoGroup
+
+#
+# Velocity and acceleration limited motion profiles.
+#
+# Each channel accelerates to a peak velocity, cruises, and decelerates to
+# a stop. With the trapezoid shape acceleration is constant during the
+# ramps. With the S-curve shape velocity follows a sin^2 ramp, so
+# acceleration itself rises and falls smoothly; the ramp covers the same
+# distance as a trapezoid ramp, with its peak acceleration pi/2 times
+# higher, so it is a trapezoid with acceleration 2a/pi.
+#
+# All channels of a move finish together: the duration is that of the
+# slowest channel, and every other channel gets the lower peak velocity
+# that makes its move take exactly as long. Profiles are sampled for all
+# channels and frame times at once, as the fraction of each channel's move
+# done at each time.
+#
+# Limits come from servo_max_velocity (degrees/sec) and
+# servo_max_acceleration (degrees/sec^2), which can be overridden for one
+# servo with e.g. servo_max_velocity_12.
+#
+
+PROFILE_SHAPES = ('trapezoid', 'scurve')
+
+class MotionProfile:
+
+    def __init__(self, distances: np.ndarray, max_velocity: np.ndarray, max_acceleration: np.ndarray,
+                 shape: str='trapezoid'):
+        if shape not in PROFILE_SHAPES:
+            raise ValueError(f"unknown motion profile '{shape}'")
+        self.shape = shape
+        self.max_velocity = max_velocity
+        self.max_acceleration = max_acceleration
+        d = np.abs(distances)
+        v = max_velocity
+        a = max_acceleration if shape=='trapezoid' else max_acceleration * (2 / math.pi)
+        t_min = np.where(d >= v * v / a, d / v + v / a, 2 * np.sqrt(d / a))
+        self.duration = float(np.max(t_min)) if len(d) else 0.0
+        self.cruise_duration = float(np.max(d / v)) if len(d) else 0.0    # with no ramps
+        T = self.duration
+        self.distances = d
+        self.peak = (a * T - np.sqrt(np.maximum((a * T) ** 2 - 4 * a * d, 0.0))) / 2
+        self.ramp = self.peak / a
+
+    def ramp_distance(self, t: np.ndarray) -> np.ndarray:
+        ramp = np.where(self.ramp > 0, self.ramp, 1.0)
+        if self.shape=='trapezoid':
+            return self.peak * t * t / (2 * ramp)
+        else:
+            return self.peak / 2 * (t - ramp / math.pi * np.sin(math.pi * t / ramp))
+
+    #
+    # sample - the fraction of each channel's move done at each time,
+    # as an array with one row per time and one column per channel
+    #
+
+    def sample(self, times: np.ndarray) -> np.ndarray:
+        T = self.duration
+        t = np.clip(times, 0.0, T)[:, np.newaxis]
+        cruise = self.peak * self.ramp / 2 + self.peak * (t - self.ramp)
+        s = np.where(t < self.ramp, self.ramp_distance(t),
+                     np.where(t > T - self.ramp, self.distances - self.ramp_distance(T - t), cruise))
+        return np.divide(s, self.distances, out=np.ones_like(s), where=self.distances > 0)
+
+    #
+    # for_group - the profile for moving a group of servos by deltas. speed
+    # scales time, so speed equal to default_speed (or more) uses the full
+    # limits, and lower speeds are proportionally slower.
+    #
+
+    @staticmethod
+    def for_group(group: ServoGroup, deltas: np.ndarray, speed: float, shape: str) -> MotionProfile:
+        scale = min(speed / Params.get('default_speed'), 1.0)
+        v, a = MotionProfile.get_limits(group.channels)
+        return MotionProfile(deltas, v * scale, a * scale * scale, shape)
+
+    #
+    # get_limits - the velocity and acceleration limits of the channels
+    #
+
+    @staticmethod
+    def get_limits(channels: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        v_dflt = Params.get('servo_max_velocity')
+        a_dflt = Params.get('servo_max_acceleration')
+        v = np.array([ Params.get_or(f'servo_max_velocity_{ch}', v_dflt) for ch in channels.tolist() ])
+        a = np.array([ Params.get_or(f'servo_max_acceleration_{ch}', a_dflt) for ch in channels.tolist() ])
+        return v, a
+
+#
+# blend_waypoints - a cubic Hermite spline through waypoints (one row per
+# waypoint, one column per channel) reached at the knot times, sampled at
+# the given times. Interior tangents are Catmull-Rom, limited as in
+# Fritsch-Carlson so that the curve doesn't overshoot: a channel that
+# holds still between two waypoints, or turns around at one, stops there
+# exactly. The end tangents are zero, so the curve starts and ends at rest.
+#
+
+def get_tangents(points: np.ndarray, knots: np.ndarray) -> np.ndarray:
+    slopes = np.diff(points, axis=0) / np.diff(knots)[:, np.newaxis]
+    tangents = np.zeros_like(points)
+    if len(points) > 2:
+        interior = (points[2:] - points[:-2]) / (knots[2:] - knots[:-2])[:, np.newaxis]
+        limit = 3 * np.minimum(np.abs(slopes[:-1]), np.abs(slopes[1:]))
+        tangents[1:-1] = np.where(slopes[:-1] * slopes[1:] > 0,
+                                  np.sign(interior) * np.minimum(np.abs(interior), limit), 0.0)
+    return tangents
+
+def blend_waypoints(points: np.ndarray, knots: np.ndarray, times: np.ndarray) -> np.ndarray:
+    tangents = get_tangents(points, knots)
+    k = np.clip(np.searchsorted(knots, times, side='right') - 1, 0, len(points) - 2)
+    h = (knots[k+1] - knots[k])[:, np.newaxis]
+    u = np.clip((times - knots[k])[:, np.newaxis] / h, 0.0, 1.0)
+    u2, u3 = u * u, u * u * u
+    return ((2*u3 - 3*u2 + 1) * points[k] + (u3 - 2*u2 + u) * h * tangents[k]
+            + (3*u2 - 2*u3) * points[k+1] + (u3 - u2) * h * tangents[k+1])
+
+#
+# blend_peaks - the peak speed and acceleration of each channel along the
+# spline of blend_waypoints. On each segment, in terms of u, velocity is
+# the quadratic A u^2 + B u + C and acceleration the line 2A u + B, so the
+# peaks are at the ends of the segment or the vertex of the quadratic.
+# Stretching all the knot times by s divides them by s and s^2.
+#
+
+def blend_peaks(points: np.ndarray, knots: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    tangents = get_tangents(points, knots)
+    h = np.diff(knots)[:, np.newaxis]
+    p0, p1 = points[:-1], points[1:]
+    m0, m1 = h * tangents[:-1], h * tangents[1:]
+    A = 6 * (p0 - p1) + 3 * (m0 + m1)
+    B = 6 * (p1 - p0) - 4 * m0 - 2 * m1
+    u = np.clip(np.divide(-B, 2 * A, out=np.zeros_like(A), where=A != 0), 0.0, 1.0)
+    vertex = (A * u + B) * u + m0
+    velocity = np.maximum(np.maximum(np.abs(m0), np.abs(m1)), np.abs(vertex)) / h
+    acceleration = np.maximum(np.abs(B), np.abs(2 * A + B)) / (h * h)
+    return np.max(velocity, axis=0), np.max(acceleration, axis=0)
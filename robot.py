@@ -6,8 +6,12 @@ from body import *
 from params import *
 from leg import *
 from logger import Logger
+from dtrig import use_trig_tables
+from i2c_bus import use_simulated_bus, use_bus_manager, simulate_pca9685
+import servo
 from servo import Servo
 from servo_action import *
+from servo_scheduler import ServoScheduler
 from command import CommandInterpreter
 from robot_platform import RobotPlatform
 from styled_text import StyledText as ST
@@ -20,15 +24,46 @@ parameter_defaults = {
     "body_type" : "quad",
     "head_type" : "simple",
     "servo_type" : "pwm",
+    "servo_boards" : "1:0x40",
     "clear_height" : "0.5",
     "default_step_height" : "3",
     "default_height" : "7",
     "default_speed" : "10.0",
     "max_servo_iteration" : "5",
+    "servo_iteration_time" : "0.15",
+    "servo_scheduler" : "1",
+    "servo_frame_multiple" : "1",
+    "servo_blend_timeout" : "0.5",
+    "motion_profile" : "scurve",
+    "servo_max_velocity" : "600",
+    "servo_max_acceleration" : "12000",
+    "trig_tables" : "0",
+    "i2c_bus" : "hardware",
+    "i2c_manager" : "0",
+    "i2c_sim_clock" : "400000",
+    "i2c_sim_overhead" : "0.00005",
+    "i2c_sim_realtime" : "1",
+    "imu_fifo" : "1",
+    "imu_sample_rate" : "500",
+    "imu_history" : "2.0",
+    "imu_filter" : "mahony",
+    "imu_fusion_rate" : "100",
+    "imu_mahony_kp" : "1.0",
+    "imu_mahony_ki" : "0.01",
+    "imu_complementary_tau" : "0.5",
+    "imu_calibration_filename" : "imu_calib.txt",
+    "imu_calibration_temperature" : "5",
+    "imu_calibration_max_age" : "30",
+    "imu_stationary_time" : "1.0",
+    "imu_stationary_gyro" : "0.5",
+    "imu_stationary_accel" : "0.2",
     "femur_length" : "5.3",
     "tibia_length" : "6.0",
     "default_step_size" : "3",
     "small_step_size" : "0.8",
+    "workspace_resolution" : "0.05",
+    "ik_cache_size" : "256",
+    "ik_cache_quantum" : "0.01",
     "leg_fl_servo_cox" : "4",
     "leg_fl_servo_femur" : "3",
     "leg_fl_servo_tibia" : "2",
@@ -86,16 +121,28 @@ def run(body: Body) -> None:
                 pass
         else:
             print('')
+    ServoScheduler.stop()
     RobotPlatform.stop()        
 
 def init() -> Body:
     Params.load('parameters.txt', parameter_defaults)
     Globals.init()
     Logger.init('log.txt')
+    use_trig_tables(Params.get('trig_tables') > 0)
+    use_simulated_bus(Params.get_str('i2c_bus') == 'sim', Params.get('i2c_sim_clock'),
+                      Params.get('i2c_sim_overhead'), Params.get('i2c_sim_realtime') > 0)
+    use_bus_manager(Params.get('i2c_manager') > 0)
     RobotPlatform.init()
     Servo.set_servo_type(Params.get_str('servo_type'))
+    servo.set_boards(Params.get_str('servo_boards'))
+    if Params.get_str('i2c_bus') == 'sim':
+        for bus, address in servo.get_boards():
+            simulate_pca9685(bus, address)
     body = Body.make_body(Params.get_str('body_type'))
     Servo.load_calibration(Params.get_str('calibration_filename'))   # must come AFTER body creation
+    if Params.get('servo_scheduler') > 0:
+        ServoScheduler.init(int(Params.get('servo_frame_multiple')), Params.get('servo_blend_timeout'))
+    body.build_workspaces()
     body.set_named_posture('relax')
     with ServoActionList() as actions:
         body.head.goto_named('default', actions)
@@ -1,14 +1,60 @@
 #coding:utf-8
 
 from __future__ import annotations
-from IMU import IMU
-from threading import Thread
+from threading import Thread, Lock
 from geometry import *
+from params import Params
+from MPU6050 import MPU6050, GRAVITY
+from sample_buffer import SampleBuffer
+from imu_fusion import FusionEngine
+from imu_calibration import ImuCalibration
 import time
-try:
-    from mpu6050 import mpu6050    #type: ignore[import-untyped]
-except ImportError:
-    mpu6050 = None
+import numpy as np
+
+#
+# Imu - a thread that samples the MPU6050 and integrates its readings.
+#
+# With imu_fifo set, the chip queues samples at imu_sample_rate (Hz) and
+# each cycle drains all of them at once, integrating them together at the
+# chip's own sample interval. Otherwise each cycle takes one burst reading,
+# integrated over the time since the last one.
+#
+# Each batch also goes through the fusion engine (see imu_fusion.py),
+# stepped at imu_fusion_rate with the imu_filter attitude filter, which
+# gives the attitude as a quaternion and the angles published through
+# RobotPlatform. The filter sees the readings less their bias, keeping
+# gravity, while velocity and position are integrated from the readings
+# less their value at rest.
+#
+# The biases are saved in imu_calibration_filename (see
+# imu_calibration.py), and at startup they are reused if the chip is
+# within imu_calibration_temperature degrees of the temperature they were
+# saved at, and they are no more than imu_calibration_max_age days old, so
+# the sampler is ready at once. Otherwise a second of samples
+# is averaged, with the robot at rest and level, and saved. After that,
+# whenever the last imu_stationary_time seconds of gyro and accel readings
+# show the robot standing still, the gyro bias is moved towards their
+# mean; the refined biases are saved when the Imu stops. The accel bias
+# is left alone, since at rest the accelerometer can't tell its bias from
+# a tilt.
+#
+# The last imu_history seconds of samples are kept in two ring buffers:
+# the raw readings, and the calibrated readings along with the velocity,
+# position and angles up to each of them, in the columns below. The
+# integration is done with NumPy over each batch of new samples, so the
+# sampler allocates no Points or Angles; those are only made when asked
+# for. mean, value_at and rate give the history over a time window.
+#
+
+ACCEL = slice(0, 3)
+GYRO = slice(3, 6)
+VELOCITY = slice(6, 9)
+POSITION = slice(9, 12)
+ANGLES = slice(12, 15)
+SAMPLE_WIDTH = 15
+
+AT_REST = np.array([ 0, 0, GRAVITY, 0, 0, 0 ])    # level and still
+BIAS_SMOOTHING = 0.2                               # fraction of a new gyro bias estimate taken
 
 class Imu:
 
@@ -17,53 +63,170 @@ class Imu:
     def __init__(self, interval=0.01):
         Imu.the_imu = self
         self.interval = interval
-        self.angles = Angles()
-        self.velocity = Point()
-        self.position = Point()
-        self.a_calib = Point()
-        self.g_calib = Angles()
-        self.a_total = Point()
-        self.g_total = Angles()
+        self.calib = np.zeros(6)
+        self.bias = np.zeros(6)
+        self.state = np.zeros(SAMPLE_WIDTH - 6)    # velocity, position and angles
+        self.attitude = np.array([ 1.0, 0.0, 0.0, 0.0 ])
+        self.fusion = FusionEngine(Params.get_str('imu_filter'), Params.get('imu_fusion_rate'),
+                                   kp=Params.get('imu_mahony_kp'), ki=Params.get('imu_mahony_ki'),
+                                   tau=Params.get('imu_complementary_tau'))
         self.count = 0
-        self.sensor: mpu6050 = mpu6050(address=0x68) if mpu6050 else None #type: ignore[assign]
+        self.refinements = 0
+        self.last_refinement = time.monotonic()
+        capacity = max(int(Params.get('imu_history') * Params.get('imu_sample_rate')), 2)
+        self.raw = SampleBuffer(capacity, 6)
+        self.samples = SampleBuffer(capacity, SAMPLE_WIDTH)
+        self.lock = Lock()
+        try:
+            self.sensor = MPU6050(address=0x68)
+        except OSError:    # no I2C bus or no IMU on it
+            self.sensor = None    #type: ignore[assignment]
         self.my_thread = Thread(target=lambda: self.run())
         self.stopping = False
         self.last_time = time.monotonic()
-        self.last_print = time.monotonic()
         self.my_thread.start()
-        
+
     def run(self) -> None:
         if self.sensor:
-            for i in range(1000):
-                self.a_calib += Point(*[ v for v in self.sensor.get_accel_data().values() ]) / 1000.0
-                self.g_calib += Angles(*[ v for v in self.sensor.get_gyro_data().values() ]) / 1000.0
-                time.sleep(0.001)
-            #print(self.a_calib, self.g_calib)
+            if Params.get('imu_fifo') > 0:
+                self.sensor.enable_fifo(Params.get('imu_sample_rate'))
+            calibration = ImuCalibration.load(Params.get_str('imu_calibration_filename'))
+            if calibration and calibration.matches(self.sensor.read()[3], Params.get('imu_calibration_temperature'),
+                                                   Params.get('imu_calibration_max_age')):
+                self.set_bias(calibration.bias)
+            else:
+                self.calibrate(1.0)
+                self.save_calibration()
+            self.last_time = time.monotonic()
         while not self.stopping:
             if self.sensor:
                 now = time.monotonic()
                 delta = now - self.last_time
                 self.last_time = now
-                a = Point(*[ v for v in self.sensor.get_accel_data().values() ])
-                g = Angles(*[ v for v in self.sensor.get_gyro_data().values() ])
-                a -= self.a_calib
-                g -= self.g_calib
-                self.a_total += a
-                self.g_total += g
-                self.count += 1
-                self.velocity = self.velocity + a * delta
-                self.angles = self.angles + g * delta
-                self.position = self.position + self.velocity * delta * 100.0
-                if False and now - self.last_print > 1.0:
-                    print(a, g,
-                          self.velocity, self.position, self.angles)
-                    self.last_print = now
+                samples, dt = self.read_sensor(delta)
+                if len(samples):
+                    self.integrate(samples, now - dt * np.arange(len(samples) - 1, -1, -1), dt)
+                if now - self.last_refinement >= Params.get('imu_stationary_time'):
+                    self.refine_bias(now)
             time.sleep(self.interval)
 
+    #
+    # read_sensor - new samples, one row of accel (x, y, z) and gyro
+    # (x, y, z) each, and the time between them
+    #
+
+    def read_sensor(self, delta: float) -> tuple[np.ndarray, float]:
+        if self.sensor.fifo_enabled:
+            return self.sensor.read_fifo(), 1 / self.sensor.sample_rate
+        else:
+            return np.delete(self.sensor.read(), 3)[np.newaxis], delta
+
+    def calibrate(self, duration: float) -> None:
+        readings = []
+        end = time.monotonic() + duration
+        while time.monotonic() < end:
+            time.sleep(self.interval if self.sensor.fifo_enabled else 0.001)
+            readings.append(self.read_sensor(0.0)[0])
+        samples = np.concatenate(readings)
+        if len(samples):
+            self.set_bias(np.mean(samples, axis=0) - AT_REST)
+
+    def set_bias(self, bias: np.ndarray) -> None:
+        self.bias = bias
+        self.calib = bias + AT_REST
+
+    def save_calibration(self) -> None:
+        ImuCalibration(self.bias, self.sensor.read()[3]).save(Params.get_str('imu_calibration_filename'))
+
+    #
+    # refine_bias - if the robot has been still over the last
+    # imu_stationary_time, move the gyro bias towards the mean gyro reading
+    #
+
+    def refine_bias(self, now: float) -> None:
+        window = Params.get('imu_stationary_time')
+        self.last_refinement = now
+        with self.lock:
+            times, raw = self.raw.window(now - window)
+        expected = window / (1 / self.sensor.sample_rate if self.sensor.fifo_enabled else self.interval)
+        if len(times) < expected / 2:
+            return
+        gyro = raw[:, 3:]
+        if (np.max(np.std(gyro, axis=0)) < Params.get('imu_stationary_gyro')
+            and np.std(np.linalg.norm(raw[:, :3], axis=1)) < Params.get('imu_stationary_accel')):
+            bias = self.bias.copy()
+            bias[3:] += (gyro.mean(axis=0) - bias[3:]) * BIAS_SMOOTHING
+            self.set_bias(bias)
+            self.refinements += 1
+
+    #
+    # integrate - add a batch of raw samples, taken at times dt apart, to
+    # the history, integrating velocity and position through it and
+    # fusing it into the attitude
+    #
+
+    def integrate(self, raw: np.ndarray, times: np.ndarray, dt: float) -> None:
+        attitudes = self.fusion.update(raw - self.bias, dt)
+        block = np.empty((len(raw), SAMPLE_WIDTH))
+        block[:, :6] = raw - self.calib
+        block[:, VELOCITY] = self.state[0:3] + np.cumsum(block[:, ACCEL], axis=0) * dt
+        block[:, POSITION] = self.state[3:6] + np.cumsum(block[:, VELOCITY], axis=0) * dt * 100.0
+        block[:, ANGLES] = Quaternion.to_angles_array(attitudes)
+        with self.lock:
+            self.raw.append(times, raw)
+            self.samples.append(times, block)
+            self.state = block[-1, 6:]
+            self.attitude = attitudes[-1]
+            self.count += len(raw)
+
+    @property
+    def velocity(self) -> Point:
+        return Point(self.state[0:3])
+
+    @property
+    def position(self) -> Point:
+        return Point(self.state[3:6])
+
+    @property
+    def angles(self) -> Angles:
+        pitch, roll, yaw = self.state[6:9].tolist()
+        return Angles(pitch=pitch, roll=roll, yaw=yaw)
+
+    @property
+    def quaternion(self) -> Quaternion:
+        return Quaternion(*self.attitude)
+
+    #
+    # History queries, on the columns above, over the last duration seconds
+    # or at time t (on time.monotonic)
+    #
+
+    @staticmethod
+    def mean(duration: float) -> np.ndarray:
+        imu = Imu.the_imu
+        with imu.lock:
+            return imu.samples.mean(time.monotonic() - duration)
+
+    @staticmethod
+    def value_at(t: float) -> np.ndarray:
+        imu = Imu.the_imu
+        with imu.lock:
+            return imu.samples.value_at(t)
+
+    @staticmethod
+    def rate(duration: float) -> np.ndarray:
+        imu = Imu.the_imu
+        with imu.lock:
+            return imu.samples.rate(time.monotonic() - duration)
+
     @staticmethod
     def get_angles() -> Angles:
         return Imu.the_imu.angles
 
+    @staticmethod
+    def get_quaternion() -> Quaternion:
+        return Imu.the_imu.quaternion
+
     @staticmethod
     def get_position() -> Point:
         return Imu.the_imu.position
@@ -74,7 +237,10 @@ class Imu:
 
     @staticmethod
     def stop() -> None:
-        Imu.the_imu.stopping = True
-        Imu.the_imu.my_thread.join()
+        imu = Imu.the_imu
+        imu.stopping = True
+        imu.my_thread.join()
+        if imu.sensor and imu.refinements:
+            imu.save_calibration()
+
 
-    
@@ -21,6 +21,9 @@ class RobotPlatformBase:
     def get_imu_angles(self) -> Angles:
         return Angles()
 
+    def get_imu_quaternion(self) -> Quaternion:
+        return Quaternion()
+
     def get_imu_position(self) -> Point:
         return Point()
 
@@ -64,6 +67,10 @@ class RobotPlatform:
     def get_imu_angles() -> Angles:
         return RobotPlatform.the_platform.get_imu_angles()
 
+    @staticmethod
+    def get_imu_quaternion() -> Quaternion:
+        return RobotPlatform.the_platform.get_imu_quaternion()
+
     @staticmethod
     def get_imu_position() -> Point:
         return RobotPlatform.the_platform.get_imu_position()
@@ -95,6 +102,9 @@ class RobotPlatformQuad(RobotPlatformRaspberryPi):
     def get_imu_angles(self) -> Angles:
         return Imu.get_angles()
 
+    def get_imu_quaternion(self) -> Quaternion:
+        return Imu.get_quaternion()
+
     def get_imu_position(self) -> Point:
         return Imu.get_position()
 
@@ -0,0 +1,109 @@
+#coding:utf-8
+
+from __future__ import annotations
+import numpy as np
+
+#
+# SampleBuffer - a fixed-capacity ring buffer of timestamped samples, each
+# a row of width values, held in preallocated NumPy arrays. Samples are
+# appended in batches, in time order, and once the buffer is full each
+# batch overwrites the oldest samples.
+#
+# Queries cover the samples in a time window, by default everything held:
+#
+#   mean        the mean of each column over the window
+#   value_at    each column at time t, interpolated between samples
+#   rate        the rate of change of each column over the window, as the
+#               slope of a least-squares line through its samples
+#
+# The samples are in at most two contiguous runs of the arrays, before and
+# after the wrap, so a time is found by bisecting each run, and only the
+# samples in a window are copied out.
+#
+
+class SampleBuffer:
+
+    def __init__(self, capacity: int, width: int):
+        self.capacity = capacity
+        self.times = np.zeros(capacity)
+        self.values = np.zeros((capacity, width))
+        self.head = 0       # where the next sample goes
+        self.count = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def clear(self) -> None:
+        self.head = 0
+        self.count = 0
+
+    def append(self, times: np.ndarray, values: np.ndarray) -> None:
+        times, values = times[-self.capacity:], values[-self.capacity:]
+        n = len(times)
+        first = min(n, self.capacity - self.head)
+        self.times[self.head:self.head+first] = times[:first]
+        self.values[self.head:self.head+first] = values[:first]
+        self.times[:n-first] = times[first:]
+        self.values[:n-first] = values[first:]
+        self.head = (self.head + n) % self.capacity
+        self.count = min(self.count + n, self.capacity)
+
+    #
+    # runs - the (start, end) index ranges holding the samples, oldest first
+    #
+
+    def runs(self) -> list[tuple[int, int]]:
+        start = self.head - self.count
+        if start >= 0:
+            return [ (start, self.head) ]
+        else:
+            return [ (start + self.capacity, self.capacity), (0, self.head) ]
+
+    #
+    # window - the times and values of the samples from start to end
+    # (inclusive), oldest first
+    #
+
+    def window(self, start: float=-np.inf, end: float=np.inf) -> tuple[np.ndarray, np.ndarray]:
+        ranges = []
+        for lo, hi in self.runs():
+            i = lo + int(np.searchsorted(self.times[lo:hi], start, side='left'))
+            j = lo + int(np.searchsorted(self.times[lo:hi], end, side='right'))
+            if i < j:
+                ranges.append(slice(i, j))
+        if len(ranges) == 0:
+            return np.empty(0), np.empty((0, self.values.shape[1]))
+        elif len(ranges) == 1:
+            return self.times[ranges[0]].copy(), self.values[ranges[0]].copy()
+        return (np.concatenate([ self.times[r] for r in ranges ]),
+                np.concatenate([ self.values[r] for r in ranges ]))
+
+    # index - where the k'th oldest sample is
+    def index(self, k: int) -> int:
+        return (self.head - self.count + k) % self.capacity
+
+    def latest(self) -> tuple[float, np.ndarray]:
+        i = self.index(self.count - 1)
+        return float(self.times[i]), self.values[i].copy()
+
+    def mean(self, start: float=-np.inf, end: float=np.inf) -> np.ndarray:
+        times, values = self.window(start, end)
+        return values.mean(axis=0) if len(times) else np.full(self.values.shape[1], np.nan)
+
+    def value_at(self, t: float) -> np.ndarray:
+        if not self.count:
+            return np.full(self.values.shape[1], np.nan)
+        k = sum(int(np.searchsorted(self.times[lo:hi], t)) for lo, hi in self.runs())
+        if k == 0 or k == self.count:
+            return self.values[self.index(min(k, self.count - 1))].copy()
+        i, j = self.index(k - 1), self.index(k)
+        u = (t - self.times[i]) / (self.times[j] - self.times[i])
+        return self.values[i] + (self.values[j] - self.values[i]) * u
+
+    def rate(self, start: float=-np.inf, end: float=np.inf) -> np.ndarray:
+        times, values = self.window(start, end)
+        if len(times) < 2:
+            return np.zeros(self.values.shape[1])
+        dt = times - times.mean()
+        var = np.dot(dt, dt)
+        return np.dot(dt, values - values.mean(axis=0)) / var if var > 0 else np.zeros(self.values.shape[1])
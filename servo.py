@@ -2,14 +2,69 @@
 
 from __future__ import annotations
 from PCA9685 import PCA9685
+from i2c_bus import bus_batch
 import time
 import json
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import Iterator, Callable, ContextManager, Any
 from logger import Logger
 
 the_servos: dict[int, Servo] = {}
 
-the_pwm =  PCA9685(address=0x40, debug=True)
-the_pwm.setPWMFreq(50)
+#
+# Servo boards. Each PCA9685 board is a (bus, address) pair, and servo
+# channel numbers are logical: board * 16 + the channel on the board. The
+# boards come from the servo_boards parameter, e.g. "1:0x40, 1:0x41, 3:0x40",
+# and each is opened on first use, so that the I2C bus (real or simulated)
+# can be chosen once the parameters have been loaded.
+#
+
+the_boards: list[tuple[int, int]] = [ (1, 0x40) ]
+the_pwms: list[PCA9685|None] = [ None ]
+
+def get_pwm(board: int=0) -> PCA9685:
+    pwm = the_pwms[board]
+    if pwm is None:
+        bus, address = the_boards[board]
+        pwm = the_pwms[board] = PCA9685(address=address, debug=True, bus_number=bus)
+        pwm.setPWMFreq(50)
+    return pwm
+
+def set_boards(spec: str) -> None:
+    global the_boards, the_pwms
+    boards = []
+    for b in spec.split(','):
+        try:
+            bus, address = b.split(':')
+            boards.append((int(bus), int(address, 0)))
+        except ValueError:
+            raise ValueError(f"bad servo board '{b.strip()}', should be bus:address")
+    the_boards = boards
+    the_pwms = [ None ] * len(boards)
+    the_frame.resize(len(boards) * PWM_CHANNELS)
+
+def get_boards() -> list[tuple[int, int]]:
+    return the_boards
+
+#
+# Direct output - anything that writes to the servos, or changes how angles
+# become counts, other than through the servo scheduler (set_angle without
+# a frame, calibration, and ServoActionList without the scheduler) does so
+# inside direct_output(). While the scheduler is running this waits until
+# it is idle and holds it off until the write is done, so the two never
+# share the frame or the PCA9685 registers; otherwise it does nothing.
+#
+
+output_guard: Callable[[], ContextManager[Any]] = nullcontext
+
+def direct_output() -> ContextManager[Any]:
+    return output_guard()
+
+def set_output_guard(guard: Callable[[], ContextManager[Any]]|None) -> None:
+    global output_guard
+    output_guard = guard or nullcontext
 
 servo_type = None
 
@@ -18,24 +73,155 @@ MIN_ANGLE = 18.0
 
 LOW_POS = 102.0
 HIGH_POS = 512.0
+
+PWM_CHANNELS = 16
+
+#
+# Angle to PCA9685 count conversion. True angles are rounded to 0.1 degree,
+# so the count for every possible true angle is held in a table indexed by
+# tenths of a degree. Each servo maps a commanded angle to a table index with
+# an affine function that folds in its calibration and reversal, and the
+# clamp to MIN_ANGLE..MAX_ANGLE becomes a clamp on the index.
+#
+
+ANGLE_STEPS = 10
+MIN_INDEX = round(MIN_ANGLE * ANGLE_STEPS)
+MAX_INDEX = round(MAX_ANGLE * ANGLE_STEPS)
+
+def map_angle(value: float, fromLow: float, fromHigh: float, toLow: float, toHigh: float) -> float:
+    return (toHigh-toLow)*(value-fromLow) / (fromHigh-fromLow) + toLow
+
+COUNT_TABLE = np.array([ int(round(map_angle(i / ANGLE_STEPS, 0, 180, LOW_POS, HIGH_POS), 1))
+                         for i in range(180 * ANGLE_STEPS + 1) ], dtype=np.uint16)
+COUNT_LIST: list[int] = COUNT_TABLE.tolist()
     
+#
+# ServoTable - the state of every servo channel, in arrays indexed by
+# channel. Servo objects are views into it, and whole action lists and
+# frames work on it with array operations. Channels that no servo has
+# been enrolled on keep the defaults.
+#
+
+class ServoTable:
+
+    def __init__(self, size: int=PWM_CHANNELS):
+        self.size = 0
+        self.position = np.zeros(0)
+        self.calibration = np.zeros(0)
+        self.reverse = np.zeros(0, dtype=bool)
+        self.uses_pwm = np.zeros(0, dtype=bool)
+        self.scale = np.zeros(0)
+        self.offset = np.zeros(0)
+        self.true_angle = np.zeros(0)
+        self.last_count = np.zeros(0, dtype=np.uint16)
+        self.min_angle = np.zeros(0)
+        self.max_angle = np.zeros(0)
+        self.generation = 0     # counts calibration changes, so derived data can tell when it is stale
+        self.grow(size)
+
+    def grow(self, size: int) -> None:
+        if size <= self.size:
+            return
+        extra = size - self.size
+        self.position = np.concatenate((self.position, np.full(extra, 91.0)))
+        self.calibration = np.concatenate((self.calibration, np.zeros(extra)))
+        self.reverse = np.concatenate((self.reverse, np.zeros(extra, dtype=bool)))
+        self.uses_pwm = np.concatenate((self.uses_pwm, np.zeros(extra, dtype=bool)))
+        self.scale = np.concatenate((self.scale, np.full(extra, float(ANGLE_STEPS))))
+        self.offset = np.concatenate((self.offset, np.zeros(extra)))
+        self.true_angle = np.concatenate((self.true_angle, np.zeros(extra)))
+        self.last_count = np.concatenate((self.last_count, np.zeros(extra, dtype=np.uint16)))
+        self.min_angle = np.concatenate((self.min_angle, np.full(extra, MIN_ANGLE)))
+        self.max_angle = np.concatenate((self.max_angle, np.full(extra, MAX_ANGLE)))
+        self.size = size
+
+    #
+    # set_calibration - also sets the affine map from commanded angle to
+    # count table index, and the limits on the commanded angle. MIN_ANGLE
+    # and MAX_ANGLE are symmetric about 90, so the limits are the same
+    # whether or not the servo is reversed.
+    #
+
+    def set_calibration(self, chan: int, c: float) -> None:
+        self.calibration[chan] = c
+        if self.reverse[chan]:
+            self.scale[chan], self.offset[chan] = -ANGLE_STEPS, (180 - c) * ANGLE_STEPS
+        else:
+            self.scale[chan], self.offset[chan] = ANGLE_STEPS, c * ANGLE_STEPS
+        self.min_angle[chan] = MIN_ANGLE - c
+        self.max_angle[chan] = MAX_ANGLE - c
+        self.generation += 1
+
+    def get_limits(self, channels: np.ndarray) -> np.ndarray:
+        return np.stack((self.min_angle[channels], self.max_angle[channels]), axis=-1)
+
+    def get_indices(self, channels: np.ndarray, angles: np.ndarray) -> np.ndarray:
+        return np.clip(np.rint(self.scale[channels] * angles + self.offset[channels]),
+                       MIN_INDEX, MAX_INDEX).astype(np.intp)
+
+the_table = ServoTable()
+
 class Servo:
 
+    uses_pwm = False
+
     def __init__(self, name: str, chan: int, reverse: bool):
         self.name = name
-        self.position = 91.0
         self.channel = chan
-        self.calibration = 0.0
-        self.reverse = reverse
-        self.true_angle = 0.0
+        the_table.grow(chan + 1)
+        the_table.position[chan] = 91.0
+        the_table.reverse[chan] = reverse
+        the_table.uses_pwm[chan] = self.uses_pwm
+        the_table.true_angle[chan] = 0.0
+        the_table.set_calibration(chan, 0.0)
+
+    @property
+    def position(self) -> float:
+        return float(the_table.position[self.channel])
+
+    @position.setter
+    def position(self, angle: float) -> None:
+        the_table.position[self.channel] = angle
+
+    @property
+    def calibration(self) -> float:
+        return float(the_table.calibration[self.channel])
+
+    @calibration.setter
+    def calibration(self, c: float) -> None:
+        with direct_output():
+            the_table.set_calibration(self.channel, c)
+
+    @property
+    def reverse(self) -> bool:
+        return bool(the_table.reverse[self.channel])
+
+    @property
+    def true_angle(self) -> float:
+        return float(the_table.true_angle[self.channel])
+
+    @property
+    def scale(self) -> float:
+        return float(the_table.scale[self.channel])
+
+    @property
+    def offset(self) -> float:
+        return float(the_table.offset[self.channel])
 #        
 #Convert the input angle to the value of pca9685
 #
     def map(self, value: float, fromLow: float, fromHigh: float, toLow: float, toHigh: float) -> float:
-        return (toHigh-toLow)*(value-fromLow) / (fromHigh-fromLow) + toLow
+        return map_angle(value, fromLow, fromHigh, toLow, toHigh)
 
-    def set_angle(self, angle: float) -> None:
-        self.position = angle
+    def get_index(self, angle: float) -> int:
+        return min(max(round(self.scale * angle + self.offset), MIN_INDEX), MAX_INDEX)
+
+    def set_angle(self, angle: float, frame: ServoFrame|None=None) -> None:
+        if frame is None:
+            with direct_output():
+                self.position = angle
+        else:
+            self.position = angle
 
     def get_position(self) -> float:
         return self.position
@@ -107,30 +293,164 @@ class Servo:
 
     @staticmethod
     def show_servos() -> str:
-        return '\n'.join([ s.show() for s in the_servos.values() ])
+        result = [ s.show() for s in the_servos.values() ]
+        if the_frame.frames:
+            result.append(the_frame.show())
+        return '\n'.join(result)
 
 class PWMServo(Servo):
 
     def __init__(self, name: str, chan: int, reverse: bool):
+        if chan >= len(the_boards) * PWM_CHANNELS:
+            raise ValueError(f"no servo board for channel {chan} of servo '{name}'")
         super(PWMServo, self).__init__(name, chan, reverse)
 
-    def set_angle(self, angle: float) -> None:
-        calib_angle = angle + self.calibration
-        rev_angle = round(180 - calib_angle if self.reverse else calib_angle, 1)
-        self.true_angle = round(min(max(rev_angle, MIN_ANGLE), MAX_ANGLE), 1)
-        self.position = angle
-        command = round(self.map(self.true_angle, 0, 180, LOW_POS, HIGH_POS), 1)
-        the_pwm.setPWM(self.channel, 0, int(command))
+    uses_pwm = True
+
+    def set_angle(self, angle: float, frame: ServoFrame|None=None) -> None:
+        if frame is None:
+            with direct_output():
+                command = self.set_command(angle)
+                get_pwm(self.channel // PWM_CHANNELS).setPWM(self.channel % PWM_CHANNELS, 0, command)
+        else:
+            frame.set(self.channel, self.set_command(angle))
+
+    # set_command - record angle in the servo table, returning its count
+    def set_command(self, angle: float) -> int:
+        chan = self.channel
+        index = self.get_index(angle)
+        command = COUNT_LIST[index]
+        the_table.true_angle[chan] = index / ANGLE_STEPS
+        the_table.position[chan] = angle
+        the_table.last_count[chan] = command
         if False:
-            Logger.info(f'servo.set_angle {self.channel} {self.name.upper()} angle {round(angle, 1)}'
-                        f' {rev_angle=} calib {self.calibration} true angle {self.true_angle=}'
+            Logger.info(f'servo.set_angle {chan} {self.name.upper()} angle {round(angle, 1)}'
+                        f' calib {self.calibration} true angle {self.true_angle=}'
                         f' {command=}')
+        return command
 
 type_map = { 'pwm' : PWMServo,
              'none' : Servo,
              }
 
-       
-        
-        
- 
+#
+# ServoGroup - a set of channels that move together, as an index into the
+# servo table, so that a whole frame of angles becomes counts in a few
+# array operations
+#
+
+class ServoGroup:
+
+    def __init__(self, channels: np.ndarray):
+        self.channels = np.asarray(channels, dtype=np.intp)
+        self.pwm = the_table.uses_pwm[self.channels]
+        self.uses_pwm = bool(self.pwm.any())
+
+    def __len__(self) -> int:
+        return len(self.channels)
+
+    def get_positions(self) -> np.ndarray:
+        return the_table.position[self.channels]
+
+    def get_indices(self, angles: np.ndarray) -> np.ndarray:
+        return the_table.get_indices(self.channels, angles)
+
+    def get_counts(self, angles: np.ndarray) -> np.ndarray:
+        return COUNT_TABLE[self.get_indices(angles)]
+
+    def set_frame(self, angles: np.ndarray, frame: ServoFrame) -> None:
+        if self.uses_pwm:
+            channels = self.channels[self.pwm]
+            counts = COUNT_TABLE[the_table.get_indices(channels, angles[self.pwm])]
+            the_table.last_count[channels] = counts
+            frame.set_counts(channels, counts)
+
+    def set_positions(self, angles: np.ndarray) -> None:
+        the_table.position[self.channels] = angles
+        channels = self.channels[self.pwm]
+        the_table.true_angle[channels] = the_table.get_indices(channels, angles[self.pwm]) / ANGLE_STEPS
+
+#
+# ServoFrame - the PWM counts for every channel in one interpolation step,
+# sent to the PCA9685 boards together. The buffer is laid out like the
+# chip's LEDn registers (ON_L ON_H OFF_L OFF_H per channel), board after
+# board, so each run of contiguous channels on a board that changed goes
+# out as a single block write. Boards on different I2C buses are written
+# concurrently from a thread pool, those on the same bus one after the
+# other. flush also keeps track of the time spent on the bus.
+#
+
+class ServoFrame:
+
+    def __init__(self, size: int=PWM_CHANNELS) -> None:
+        self.frames = 0
+        self.block_writes = 0
+        self.bus_time = 0.0
+        self.max_bus_time = 0.0
+        self.executor: ThreadPoolExecutor|None = None
+        self.resize(size)
+
+    def resize(self, size: int) -> None:
+        self.buffer = bytearray(4 * size)
+        self.words = np.frombuffer(self.buffer, dtype='<u2')    # OFF count of chan is word 2*chan+1
+        self.dirty = np.zeros(size, dtype=bool)
+
+    def set(self, chan: int, count: int) -> None:
+        self.buffer[4*chan+2] = count & 0xFF
+        self.buffer[4*chan+3] = count >> 8
+        self.dirty[chan] = True
+
+    def set_counts(self, channels: np.ndarray, counts: np.ndarray) -> None:
+        self.words[2*channels+1] = counts
+        self.dirty[channels] = True
+
+    def runs(self, board: int) -> Iterator[tuple[int, int]]:
+        first = None
+        base = board * PWM_CHANNELS
+        for chan, d in enumerate(self.dirty[base:base+PWM_CHANNELS].tolist() + [ False ]):
+            if d and first is None:
+                first = chan
+            elif not d and first is not None:
+                yield first, chan
+                first = None
+
+    def flush_boards(self, boards: list[int]) -> int:
+        writes = 0
+        for board in boards:
+            pwm = get_pwm(board)
+            base = board * PWM_CHANNELS
+            with bus_batch(pwm.bus):
+                for first, last in self.runs(board):
+                    pwm.setPWMBlock(first, self.buffer[4*(base+first):4*(base+last)])
+                    writes += 1
+        return writes
+
+    def flush(self) -> None:
+        if not self.dirty.any():
+            return
+        buses: dict[int, list[int]] = {}
+        for board in np.flatnonzero(self.dirty.reshape(-1, PWM_CHANNELS).any(axis=1)).tolist():
+            buses.setdefault(the_boards[board][0], []).append(board)
+        start = time.perf_counter()
+        if len(buses) == 1:
+            self.block_writes += self.flush_boards(next(iter(buses.values())))
+        else:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='servo-bus')
+            for writes in self.executor.map(self.flush_boards, buses.values()):
+                self.block_writes += writes
+        elapsed = time.perf_counter() - start
+        self.dirty[:] = False
+        self.frames += 1
+        self.bus_time += elapsed
+        self.max_bus_time = max(self.max_bus_time, elapsed)
+
+    def show(self) -> str:
+        pwms = [ p for p in the_pwms if p is not None ]
+        return (f'frames {self.frames} block writes {self.block_writes}'
+                f' bus time mean {1000 * self.bus_time / max(self.frames, 1):.2f} mS'
+                f' max {1000 * self.max_bus_time:.2f} mS'
+                f' channel writes {sum(p.writesIssued for p in pwms)}'
+                f' suppressed {sum(p.writesSuppressed for p in pwms)}')
+
+the_frame = ServoFrame()
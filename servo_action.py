@@ -3,12 +3,14 @@
 from __future__ import annotations
 from typing import Self, Type, Iterable
 from dataclasses import dataclass
-from collections import OrderedDict
 from logger import  Logger
-from servo import Servo
+from servo import Servo, ServoGroup, the_frame, the_table, direct_output
+from servo_scheduler import ServoScheduler, PWM_PERIOD
+from motion_profile import MotionProfile
 from params import Params
 from globals import Globals
 import time
+import numpy as np
 
 @dataclass
 class ServoAction:
@@ -17,13 +19,18 @@ class ServoAction:
 
 class ServoActionList:
 
-    def __init__(self, speed = 0.0):
+    def __init__(self, speed = 0.0, blend: bool = False):
         self.max_iter = Params.get('max_servo_iteration')
+        self.iteration_time = Params.get('servo_iteration_time')
+        self.profile_shape = Params.get_str('motion_profile')
+        self.blend = blend
         self.speed = speed or Globals.speed
-        self.actions: dict[int,float] = OrderedDict()    #type: ignore[annotation-unchecked]
+        # target angle for each channel of the servo table, and which ones are set
+        self.targets = np.zeros(the_table.size)
+        self.used = np.zeros(the_table.size, dtype=bool)
 
     def __str__(self) -> str:
-        return ', '.join([ f'{ch}: {round(a,1)}' for ch,a in self.actions.items() ])
+        return ', '.join([ f'{ch}: {round(a,1)}' for ch,a in self.get_actions() ])
 
     def __enter__(self) -> Self:
         return self
@@ -33,29 +40,97 @@ class ServoActionList:
             self.exec()
 
     def __len__(self) -> int:
-        return len(self.actions)
+        return int(np.count_nonzero(self.used))
 
     def append(self, chan: int, angle: float) -> None:
-        self.actions[chan] = angle
+        self.targets[chan] = angle
+        self.used[chan] = True
 
-    def exec(self) -> None:
+    def get_actions(self) -> list[tuple[int, float]]:
+        channels = np.flatnonzero(self.used)
+        return list(zip(channels.tolist(), self.targets[channels].tolist()))
+
+    def clear(self) -> None:
+        self.used[:] = False
+
+    #
+    # exec - move the servos. When the servo scheduler is running (and speed
+    # isn't 0, meaning no delays) the move is handed to it, taking
+    # servo_iteration_time/speed seconds for each max_servo_iteration
+    # degrees of the largest move; by default exec waits for it to finish.
+    # If motion_profile is set (trapezoid or scurve) the move instead
+    # follows a velocity and acceleration limited profile, with or without
+    # the scheduler.
+    #
+    # A list made with blend=True is a via point: with the scheduler running
+    # exec returns at once, and the move blends into the following lists up
+    # to the next one without blend, which stops exactly at its targets.
+    #
+    # Every move starts from where the scheduler will leave the servos. A
+    # move made without it (at speed 0, or with no scheduler) waits for it
+    # to finish first, and holds it off meanwhile (see direct_output).
+    #
+
+    def exec(self, wait: bool=True) -> None:
         #Logger.info(f'ServoAction actions {str(self)}')
-        deltas = { chan:(angle - Servo.get(chan).get_position())
-                   for chan,angle in self.actions.items() }
-        max_delta = max([ abs(d) for d in deltas.values() ])
+        group = ServoGroup(np.flatnonzero(self.used))
+        targets = self.targets[group.channels]
+        running = ServoScheduler.get()
+        scheduler = running if self.speed else None
+        start = running.get_planned_positions(group) if running else group.get_positions()
+        deltas = targets - start
+        max_delta = float(np.max(np.abs(deltas)))
         iterations = int((max_delta + self.max_iter - 1) // self.max_iter)
-        delta_str = ', '.join([ f'{ch}: {round(a,1)}' for ch,a in deltas.items() ])
-        #Logger.info(f'ServoActon deltas:{delta_str} max delta {max_delta:.1f} iterations {iterations}')
+        #Logger.info(f'ServoActon deltas:{deltas.round(1)} max delta {max_delta:.1f} iterations {iterations}')
+        profile = None
+        if self.speed and max_delta > 0 and self.profile_shape != 'none':
+            profile = MotionProfile.for_group(group, deltas, self.speed, self.profile_shape)
+        if scheduler:
+            # even with nothing to move, a stop ends any chain waiting for it
+            duration = profile.duration if profile else \
+                max(iterations, 1) * self.iteration_time / self.speed
+            motion = scheduler.submit(group, targets, duration, profile, self.blend,
+                                      profile.cruise_duration if profile else 0.0)
+            if wait and not self.blend:
+                motion.wait()
+            self.clear()
+            return
+        with direct_output():
+            if profile:
+                self.exec_profile(group, start, targets, profile)
+            else:
+                self.exec_iterations(group, start, targets, iterations)
+
+    #
+    # exec_iterations - all channels of one iteration go out together as a
+    # frame, and the delay that used to follow each channel is taken after
+    # the frame
+    #
+
+    def exec_iterations(self, group: ServoGroup, start: np.ndarray, targets: np.ndarray,
+                        iterations: int) -> None:
+        deltas = targets - start
+        delay = len(group) / (self.speed * 80) if self.speed else 0.0
         for i in range(iterations):
-            for chan,d in deltas.items():
-                s = Servo.get(chan)
-                if i+1 == iterations:
-                    pos = self.actions[chan]
-                else:
-                    pos = s.get_position() + (d / iterations)
-                s.set_angle(pos)
-                if self.speed:
-                    time.sleep(1.0 / (self.speed * 80))
-        self.actions = {}
-
-        
+            if i+1 == iterations:
+                pos = targets
+            else:
+                pos = start + deltas * ((i+1) / iterations)
+            group.set_frame(pos, the_frame)
+            the_frame.flush()
+            if delay:
+                time.sleep(delay)
+        group.set_positions(targets)
+        self.clear()
+
+    def exec_profile(self, group: ServoGroup, start: np.ndarray, targets: np.ndarray,
+                     profile: MotionProfile) -> None:
+        frames = max(int(np.ceil(profile.duration / PWM_PERIOD - 1e-6)), 1)
+        fractions = profile.sample(np.arange(1, frames+1) * PWM_PERIOD)
+        for i in range(frames):
+            pos = targets if i+1 == frames else start + (targets - start) * fractions[i]
+            group.set_frame(pos, the_frame)
+            the_frame.flush()
+            time.sleep(PWM_PERIOD)
+        group.set_positions(targets)
+        self.clear()
@@ -0,0 +1,276 @@
+#coding:utf-8
+
+from __future__ import annotations
+import math
+import time
+import numpy as np
+from collections import deque
+from contextlib import contextmanager
+from threading import Thread, Condition, Event
+from typing import Iterator
+from logger import Logger
+from servo import ServoGroup, the_frame, set_output_guard
+from motion_profile import MotionProfile, blend_waypoints, blend_peaks
+
+#
+# ServoScheduler - a thread that sends servo frames at a fixed rate.
+#
+# Callers submit a motion - a group of servos, their target angles and a
+# duration - and the scheduler interpolates it over a whole number of frame
+# periods, uniformly or following a motion profile. The period is the
+# 20 mS PWM period of the servos, or a multiple of it, so every frame
+# reaches the servos at the same point of their cycle. Frame times are
+# absolute deadlines on time.monotonic, so a late frame doesn't delay the
+# ones after it, and motions queued back to back follow each other without
+# a gap.
+#
+# A motion submitted with blend=True is a via point: instead of stopping
+# there, the scheduler waits for the rest of the chain, up to the next
+# motion without blend (the stop), and plays the whole chain as one spline
+# through all the targets. If no stop arrives within blend_timeout seconds
+# (the servo_blend_timeout parameter) the chain queued so far is played,
+# stopping at its end, and logged, since it means a caller left a chain
+# unfinished.
+#
+# While the scheduler runs, writes to the servos made any other way wait
+# for it in idle (see direct_output in servo.py).
+#
+
+PWM_PERIOD = 0.02
+
+class ServoMotion:
+
+    def __init__(self, group: ServoGroup, targets: np.ndarray, duration: float,
+                 profile: MotionProfile|None=None, blend: bool=False, blend_duration: float=0.0):
+        self.group = group
+        self.targets = targets
+        self.duration = duration
+        self.profile = profile
+        self.blend = blend
+        self.blend_duration = blend_duration or duration    # when passing through without stopping
+        self.done = Event()
+        self.error: BaseException|None = None
+
+    #
+    # get_fractions - how much of the move is done at each of the given
+    # number of frames, one row per frame
+    #
+
+    def get_fractions(self, frames: int, period: float) -> np.ndarray:
+        if self.profile:
+            return self.profile.sample(np.arange(1, frames+1) * period)
+        else:
+            return (np.arange(1, frames+1) / frames)[:, np.newaxis]
+
+    #
+    # wait - wait until the motion has been played, raising the error that
+    # stopped it if it failed
+    #
+
+    def wait(self) -> None:
+        self.done.wait()
+        if self.error:
+            raise self.error
+
+class ServoScheduler:
+
+    the_scheduler: ServoScheduler|None = None
+
+    def __init__(self, multiple: int=1, blend_timeout: float=0.5):
+        self.period = PWM_PERIOD * max(multiple, 1)
+        self.blend_timeout = blend_timeout
+        self.motions: deque[ServoMotion] = deque()
+        self.queued: dict[int, tuple[float, ServoMotion]] = {}
+        self.condition = Condition()
+        self.stopping = False
+        self.frames = 0
+        self.late_frames = 0
+        self.max_late = 0.0
+        self.total_late = 0.0
+        self.my_thread = Thread(target=lambda: self.run(), daemon=True)
+        self.my_thread.start()
+
+    def submit(self, group: ServoGroup, targets: np.ndarray, duration: float,
+               profile: MotionProfile|None=None, blend: bool=False, blend_duration: float=0.0) \
+               -> ServoMotion:
+        motion = ServoMotion(group, targets, duration, profile, blend, blend_duration)
+        with self.condition:
+            for ch, t in zip(group.channels.tolist(), targets.tolist()):
+                self.queued[ch] = (t, motion)
+            self.motions.append(motion)
+            self.condition.notify()
+        return motion
+
+    #
+    # get_planned_positions - where the servos will be once everything
+    # already queued has run, which is where the next motion starts from
+    #
+
+    def get_planned_positions(self, group: ServoGroup) -> np.ndarray:
+        with self.condition:
+            positions = group.get_positions()
+            for i, ch in enumerate(group.channels.tolist()):
+                if ch in self.queued:
+                    positions[i] = self.queued[ch][0]
+            return positions
+
+    def wait_idle(self) -> None:
+        with self.condition:
+            while self.motions:
+                self.condition.wait()
+
+    #
+    # idle - wait until everything queued has run, and keep the scheduler
+    # (and anyone submitting to it) waiting until the block is done
+    #
+
+    @contextmanager
+    def idle(self) -> Iterator[None]:
+        with self.condition:
+            while self.motions:
+                self.condition.wait()
+            yield
+
+    def run(self) -> None:
+        deadline = time.monotonic()
+        while True:
+            with self.condition:
+                while not self.motions and not self.stopping:
+                    self.condition.wait()
+                if not self.motions:
+                    break
+                chain = self.get_chain()
+            try:
+                if len(chain) == 1:
+                    deadline = self.play(chain[0], max(deadline, time.monotonic()))
+                else:
+                    deadline = self.play_chain(chain, max(deadline, time.monotonic()))
+            except Exception as e:
+                for motion in chain:
+                    motion.error = e
+            with self.condition:
+                for motion in chain:
+                    self.motions.popleft()
+                for ch in [ ch for ch, (t, m) in self.queued.items() if m in chain ]:
+                    del self.queued[ch]
+                self.condition.notify_all()
+            for motion in chain:
+                motion.done.set()
+
+    #
+    # get_chain - the motions at the head of the queue up to and including
+    # the first stop, waiting for it if necessary. Called with the condition
+    # held.
+    #
+
+    def get_chain(self) -> list[ServoMotion]:
+        timeout = time.monotonic() + self.blend_timeout
+        while True:
+            for i, m in enumerate(self.motions):
+                if not m.blend:
+                    return list(self.motions)[:i+1]
+            remaining = timeout - time.monotonic()
+            if remaining <= 0 or self.stopping:
+                if remaining <= 0:
+                    Logger.info(f'servo scheduler: no stop after {len(self.motions)} blended motions'
+                                f' in {self.blend_timeout} S, stopping at the last')
+                return list(self.motions)
+            self.condition.wait(remaining)
+
+    #
+    # play - send the frames of one motion, the first at deadline, and
+    # return the deadline for the next frame
+    #
+
+    def play(self, motion: ServoMotion, deadline: float) -> float:
+        group = motion.group
+        start = group.get_positions()
+        deltas = motion.targets - start
+        frames = max(math.ceil(motion.duration / self.period - 1e-6), 1)
+        fractions = motion.get_fractions(frames, self.period)
+        for i in range(frames):
+            self.sleep_until(deadline)
+            pos = motion.targets if i+1 == frames else start + deltas * fractions[i]
+            group.set_frame(pos, the_frame)
+            the_frame.flush()
+            deadline += self.period
+        group.set_positions(motion.targets)
+        return deadline
+
+    #
+    # play_chain - send a chain of motions as one spline through their
+    # targets. Channels that aren't part of a motion hold their position
+    # through it. The first and last motions take their full duration,
+    # starting from and coming to rest, and the ones in between their
+    # (shorter) blend duration. The spline through those knots can be
+    # faster than the motions' profiles allow, so if it is, the whole chain
+    # is slowed down until its peak velocity and acceleration are within
+    # the lowest limits of any profile in it (the parameter limits for
+    # channels moved without one).
+    #
+
+    def play_chain(self, chain: list[ServoMotion], deadline: float) -> float:
+        channels = np.unique(np.concatenate([ m.group.channels for m in chain ]))
+        group = ServoGroup(channels)
+        points = np.empty((len(chain) + 1, len(group)))
+        points[0] = group.get_positions()
+        for k, m in enumerate(chain):
+            points[k+1] = points[k]
+            points[k+1, np.searchsorted(channels, m.group.channels)] = m.targets
+        durations = [ m.duration if k in (0, len(chain) - 1) else m.blend_duration
+                      for k, m in enumerate(chain) ]
+        knots = np.concatenate(([ 0.0 ], np.cumsum(np.maximum(durations, self.period))))
+        v_max, a_max = MotionProfile.get_limits(channels)
+        for m in chain:
+            if m.profile:
+                cols = np.searchsorted(channels, m.group.channels)
+                v_max[cols] = np.minimum(v_max[cols], m.profile.max_velocity)
+                a_max[cols] = np.minimum(a_max[cols], m.profile.max_acceleration)
+        v, a = blend_peaks(points, knots)
+        knots *= max(1.0, float(np.max(v / v_max)), math.sqrt(float(np.max(a / a_max))))
+        frames = max(math.ceil(knots[-1] / self.period - 1e-6), 1)
+        positions = blend_waypoints(points, knots, np.arange(1, frames+1) * self.period)
+        for i in range(frames):
+            self.sleep_until(deadline)
+            group.set_frame(points[-1] if i+1 == frames else positions[i], the_frame)
+            the_frame.flush()
+            deadline += self.period
+        group.set_positions(points[-1])
+        return deadline
+
+    def sleep_until(self, deadline: float) -> None:
+        now = time.monotonic()
+        if deadline > now:
+            time.sleep(deadline - now)
+            now = time.monotonic()
+        late = now - deadline
+        self.frames += 1
+        self.total_late += late
+        self.max_late = max(self.max_late, late)
+        if late > self.period / 2:
+            self.late_frames += 1
+
+    def show(self) -> str:
+        return (f'scheduler period {1000 * self.period:.0f} mS frames {self.frames}'
+                f' late {self.late_frames} lateness mean {1000 * self.total_late / max(self.frames, 1):.2f} mS'
+                f' max {1000 * self.max_late:.2f} mS')
+
+    @staticmethod
+    def init(multiple: int=1, blend_timeout: float=0.5) -> None:
+        scheduler = ServoScheduler.the_scheduler = ServoScheduler(multiple, blend_timeout)
+        set_output_guard(scheduler.idle)
+
+    @staticmethod
+    def get() -> ServoScheduler|None:
+        return ServoScheduler.the_scheduler
+
+    @staticmethod
+    def stop() -> None:
+        s = ServoScheduler.the_scheduler
+        if s:
+            set_output_guard(None)
+            with s.condition:
+                s.stopping = True
+                s.condition.notify_all()
+            s.my_thread.join()
+            ServoScheduler.the_scheduler = None
@@ -0,0 +1,41 @@
+#coding:utf-8
+
+from __future__ import annotations
+import os
+import sys
+import pytest
+
+#
+# Shared fixtures. The modules live at the top of the repository, so it
+# goes on the path. Anything that reads parameters gets the defaults from
+# robot.py, with scratch files in a temporary directory, and anything that
+# talks to hardware gets the simulated I2C bus, without its realtime
+# delays.
+#
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture(scope='session', autouse=True)
+def params(tmp_path_factory):
+    from robot import parameter_defaults
+    from params import Params
+    from globals import Globals
+    from logger import Logger
+    tmpdir = tmp_path_factory.mktemp('robot')
+    Params.load(str(tmpdir / 'parameters.txt'), parameter_defaults)
+    Globals.init()
+    Globals.set('speed', 0.0)
+    Logger.init(str(tmpdir / 'log.txt'))
+    return tmpdir
+
+@pytest.fixture
+def sim_bus():
+    import servo
+    from i2c_bus import use_simulated_bus, use_bus_manager, open_raw_bus
+    use_simulated_bus(True, realtime=False)
+    use_bus_manager(False)
+    servo.set_boards('1:0x40')
+    yield open_raw_bus(1)
+    use_bus_manager(False)
+    use_simulated_bus(False)
+    servo.set_boards('1:0x40')
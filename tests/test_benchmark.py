@@ -0,0 +1,37 @@
+#coding:utf-8
+
+from __future__ import annotations
+import pytest
+import benchmark
+from geometry import Transform
+
+#
+# Benchmark baselines: saving, and what counts as a regression
+#
+
+def result(ops: float, alloc: float) -> dict[str, dict[str, float]]:
+    return { 'bench' : { 'ops_per_sec' : ops, 'alloc_bytes' : alloc } }
+
+def test_compare_against_baseline(tmp_path, capsys):
+    filename = str(tmp_path / 'baseline.json')
+    benchmark.save(filename, result(1000.0, 100.0))
+    assert benchmark.compare(filename, result(950.0, 105.0), 0.1)
+    assert not benchmark.compare(filename, result(800.0, 100.0), 0.1)
+    assert not benchmark.compare(filename, result(1000.0, 150.0), 0.1)
+    assert benchmark.compare(filename, result(1500.0, 100.0), 0.1)
+    assert 'improved' in capsys.readouterr().out
+
+def test_missing_baseline_passes(tmp_path):
+    assert benchmark.compare(str(tmp_path / 'none.json'), result(1.0, 1.0), 0.1)
+
+def test_run_measures_every_benchmark():
+    results = benchmark.run([ 'point' ], 0.01)
+    assert results
+    assert all(r['ops_per_sec'] > 0 for r in results.values())
+
+def test_screw_matches_scipy():
+    scipy_linalg = pytest.importorskip('scipy.linalg')
+    tf = Transform(x=1.5, y=-0.7, z=0.3, xrot=5, zrot=25)
+    sqrt_diff, power_diff = benchmark.screw_difference(tf, scipy_linalg.sqrtm, scipy_linalg.expm,
+                                                       scipy_linalg.logm)
+    assert sqrt_diff < 1e-9 and power_diff < 1e-9
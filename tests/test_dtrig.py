@@ -0,0 +1,48 @@
+#coding:utf-8
+
+from __future__ import annotations
+import numpy as np
+import pytest
+from dtrig import *
+import dtrig
+
+#
+# Vectorized degree trigonometry, with and without the lookup tables
+#
+
+@pytest.fixture(params=[ False, True ], ids=[ 'numpy', 'tables' ])
+def tables(request):
+    use_trig_tables(request.param)
+    yield request.param
+    use_trig_tables(False)
+
+def test_vectorized_matches_scalar(tables):
+    angles = np.linspace(-400, 400, 801)
+    tol = 1e-5 if tables else 1e-12
+    assert np.allclose(vdsin(angles), [ dsin(a) for a in angles ], atol=tol)
+    assert np.allclose(vdcos(angles), [ dcos(a) for a in angles ], atol=tol)
+    cosines = np.linspace(-1, 1, 401)
+    assert np.allclose(vdacos(cosines), [ dacos(c) for c in cosines ], atol=1e-3 if tables else 1e-12)
+    assert np.allclose(vdatan2(angles, angles[::-1]), [ datan2(a, b) for a, b in zip(angles, angles[::-1]) ])
+
+def test_out_of_range_is_nan(tables):
+    result = vdacos(np.array([ 0.5, 1.5, -2.0 ]))
+    assert not np.isnan(result[0])
+    assert np.isnan(result[1:]).all()
+    assert np.isnan(vdasin(1.01))
+
+def test_table_errors_within_bounds():
+    sin_err, acos_err = dtrig.TrigTables().max_error()
+    assert sin_err < 2.5e-6
+    assert acos_err < 2.5e-4
+
+def test_non_finite_is_nan(tables):
+    angles = np.array([ 30.0, np.nan, np.inf, -np.inf ])
+    with np.errstate(invalid='ignore'):
+        s = vdsin(angles)
+        c = vdcos(angles)
+        a = vdacos(np.array([ 0.5, np.nan, np.inf, -np.inf ]))
+    for result in (s, c, a):
+        assert not np.isnan(result[0])
+        assert np.isnan(result[1:]).all()
+    assert np.isclose(s[0], 0.5, atol=1e-5) and np.isclose(a[0], 60.0, atol=1e-3)
@@ -0,0 +1,178 @@
+#coding:utf-8
+
+from __future__ import annotations
+import numpy as np
+import pytest
+from geometry import Point, Point2D, Angles, Transform, PointArray, TransformArray, Quaternion
+
+#
+# PointArray and TransformArray, against Point and Transform one at a time
+#
+
+POINTS = [ Point(1, 2, 3), Point(-4, 0.5, 2), Point(0, -3, -7.5) ]
+TRANSFORMS = [ Transform(x=1.5, y=-0.7, z=0.3, xrot=5, zrot=25),
+               Transform(x=-2, yrot=40),
+               Transform(z=4, xrot=-30, yrot=10, zrot=90) ]
+
+def same_points(pa: PointArray, points: list[Point]) -> bool:
+    return len(pa) == len(points) and all(np.allclose(a.p, b.p) for a, b in zip(pa, points))
+
+def test_point_array_operators():
+    pa = PointArray(POINTS)
+    offset = Point(0.5, -1, 2)
+    assert same_points(pa + offset, [ p + offset for p in POINTS ])
+    assert same_points(pa - pa, [ Point() ] * 3)
+    assert same_points(-pa * 2, [ -p * 2 for p in POINTS ])
+    assert same_points(pa / np.array([ 1.0, 2.0, 4.0 ]), [ POINTS[0], POINTS[1] / 2, POINTS[2] / 4 ])
+    assert np.allclose(pa.dist(offset), [ p.dist(offset) for p in POINTS ])
+    assert same_points(pa.reflect_y(np.array([ True, False, True ])),
+                       [ POINTS[0].reflect_y(), POINTS[1], POINTS[2].reflect_y() ])
+
+def test_point_array_transforms():
+    pa = PointArray(POINTS)
+    tf = TRANSFORMS[0]
+    assert same_points(pa @ tf, [ p @ tf for p in POINTS ])
+    ta = TransformArray(TRANSFORMS)
+    assert same_points(pa @ ta, [ p @ t for p, t in zip(POINTS, TRANSFORMS) ])
+
+def test_transform_array_matches_transforms():
+    ta = TransformArray(TRANSFORMS)
+    assert ta.rigid
+    composed = ta @ TransformArray(TRANSFORMS[::-1])
+    assert all(np.allclose(c.m, (a @ b).m) for c, a, b in zip(composed, TRANSFORMS, TRANSFORMS[::-1]))
+    inverse = -ta
+    assert all(np.allclose(i.m, (-t).m) for i, t in zip(inverse, TRANSFORMS))
+    moves = TransformArray.from_points(PointArray(POINTS))
+    assert same_points(moves.get_xlate(), POINTS)
+    assert same_points(PointArray([ Point() ] * 3) @ moves, POINTS)
+
+def test_point_array_copies_its_input():
+    a = np.array([ [ 1.0, 2.0, 3.0, 7.0 ], [ 4.0, 5.0, 6.0, 7.0 ] ])
+    pa = PointArray(a)
+    assert a[:, 3].tolist() == [ 7.0, 7.0 ]
+    pa.p[0, 0] = 10.0
+    assert a[0, 0] == 1.0
+    ints = PointArray(np.array([ [ 1, 2, 3, 0 ] ]))
+    assert ints.p.dtype == np.float64
+    assert ints.p.tolist() == [ [ 1.0, 2.0, 3.0, 1.0 ] ]
+
+#
+# Point and Point2D hold plain floats
+#
+
+def test_points_hold_floats():
+    p = Point(np.array([ 1, 2, 3, 1 ]))
+    assert all(type(v) is float for v in (p.x(), p.y(), p.z()))
+    assert p.p.tolist() == [ 1.0, 2.0, 3.0, 1.0 ]
+    q = Point(np.float32(0.5), 2, -1)
+    assert type(q.x()) is float
+    assert Point2D(np.array([ 3, 4 ])).length() == 5.0
+    assert (p + q).p.tolist() == [ 1.5, 4.0, 2.0, 1.0 ]
+    assert (p + np.array([ 1, 1, 1, 0 ])) == Point(2, 3, 4)
+
+def test_point_in_place_operators_modify_the_point():
+    p = Point(1, 2, 3)
+    alias = p
+    p += Point(1, 1, 1)
+    p *= 2
+    assert alias is p
+    assert alias == Point(4, 6, 8)
+    v = Point2D(1, 1)
+    v -= Point2D(0.5, 2)
+    assert v == Point2D(0.5, -1)
+    # arrays too, giving the same as the plain operators
+    p -= np.array([ 1, 2, 3, 0 ])
+    assert alias is p and p == Point(3, 4, 5) == Point(4, 6, 8) - np.array([ 1, 2, 3, 0 ])
+    v += np.array([ 0.5, 1 ])
+    assert v == Point2D(1, 0) == Point2D(0.5, -1) + np.array([ 0.5, 1 ])
+
+#
+# Transform inverse: closed form for rigid transforms, cached until changed
+#
+
+def test_rigid_inverse_matches_general_inverse():
+    for tf in TRANSFORMS:
+        assert np.allclose((-tf).m, np.linalg.inv(tf.m))
+        assert np.allclose((tf @ -tf).m, np.identity(4))
+    scaled = Transform(np.diag([ 2.0, 1.0, 0.5, 1.0 ]))
+    assert np.allclose((-scaled).m, np.diag([ 0.5, 1.0, 2.0, 1.0 ]))
+
+def test_inverse_is_cached_and_invalidated():
+    tf = TRANSFORMS[1].copy()
+    inverse = -tf
+    assert -tf is inverse
+    assert -inverse is tf
+    tf.update_xlate(Point(1, 2, 3))
+    assert -tf is not inverse
+    assert np.allclose((-tf).m, np.linalg.inv(tf.m))
+    assert (TRANSFORMS[0] @ TRANSFORMS[1]).rigid
+    assert not (TRANSFORMS[0] @ Transform(np.diag([ 2.0, 2.0, 2.0, 1.0 ]))).rigid
+
+#
+# Screw motion
+#
+
+def test_screw_power_of_rigid_transform():
+    tf = Transform(x=1.5, y=-0.7, z=0.3, xrot=5, zrot=25)
+    half = tf.sqrt()
+    assert np.allclose((half @ half).m, tf.m)
+    third = tf.power(1 / 3)
+    assert np.allclose((third @ third @ third).m, tf.m)
+    assert np.allclose(tf.interpolate(0).m, np.identity(4))
+    assert np.allclose(tf.interpolate(1).m, tf.m)
+
+@pytest.mark.parametrize('method', [ 'log', 'sqrt', 'interpolate' ])
+def test_screw_rejects_non_rigid_transform(method):
+    scaled = Transform(np.diag([ 2.0, 2.0, 2.0, 1.0 ]))
+    assert not scaled.rigid
+    with pytest.raises(ValueError):
+        getattr(scaled, method)(*([ 0.5 ] if method=='interpolate' else []))
+    with pytest.raises(ValueError):
+        scaled.power(0.5)
+
+def test_between_follows_the_screw():
+    a, b = TRANSFORMS[0], TRANSFORMS[2]
+    assert np.allclose(a.between(b, 0).m, a.m)
+    assert np.allclose(a.between(b, 1).m, b.m)
+    mid = a.between(b, 0.5)
+    assert np.allclose((mid @ (-a @ mid)).m, (a @ (-a @ b)).m)
+
+#
+# Quaternion, against the equivalent Transform
+#
+
+ANGLES = [ Angles(pitch=10, roll=-20, yaw=30), Angles(pitch=-45, roll=5, yaw=170), Angles() ]
+
+@pytest.mark.parametrize('a', ANGLES)
+def test_quaternion_matches_transform(a):
+    q = Quaternion.from_angles(a)
+    tf = Transform(xrot=a.roll, yrot=a.pitch, zrot=a.yaw)
+    assert np.allclose(q.to_transform().m, tf.m)
+    assert Quaternion.from_transform(tf) == q
+    back = q.to_angles()
+    assert np.allclose([ back.pitch, back.roll, back.yaw ], [ a.pitch, a.roll, a.yaw ])
+    p = Point(1, -2, 3)
+    assert np.allclose(q.rotate(p).p, (p @ tf).p)
+
+def test_quaternion_product_and_inverse():
+    q1, q2 = [ Quaternion.from_angles(a) for a in ANGLES[:2] ]
+    assert np.allclose((q1 @ q2).to_transform().m, (q1.to_transform() @ q2.to_transform()).m)
+    assert (q1 @ -q1) == Quaternion()
+    z90 = Quaternion.from_axis_angle(Point(0, 0, 2), 90)
+    assert np.allclose(z90.rotate(Point(1, 0, 0)).p, [ 0, 1, 0, 1 ])
+    assert np.isclose(z90.angle(), 90)
+
+def test_slerp():
+    q1 = Quaternion.from_axis_angle(Point(0, 0, 1), 20)
+    q2 = Quaternion.from_axis_angle(Point(0, 0, 1), 100)
+    assert q1.slerp(q2, 0) == q1
+    assert q1.slerp(q2, 1) == q2
+    assert q1.slerp(q2, 0.25) == Quaternion.from_axis_angle(Point(0, 0, 1), 40)
+    far = Quaternion(-q2.w, -q2.x, -q2.y, -q2.z)    # the same attitude, the long way round
+    assert q1.slerp(far, 0.5) == Quaternion.from_axis_angle(Point(0, 0, 1), 60)
+
+def test_quaternion_arrays():
+    angles = np.array([ [ a.pitch, a.roll, a.yaw ] for a in ANGLES ])
+    q = Quaternion.from_angles_array(angles)
+    assert np.allclose(Quaternion.to_angles_array(q), angles)
+    assert np.allclose(Quaternion.from_transform_array(Quaternion.to_transform_array(q)) * np.sign(q[:, :1]), q)
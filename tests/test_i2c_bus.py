@@ -0,0 +1,70 @@
+#coding:utf-8
+
+from __future__ import annotations
+import pytest
+import i2c_bus
+from i2c_bus import use_bus_manager, open_bus, get_bus_managers, ManagedBus
+
+#
+# I2CBusManager on the simulated bus
+#
+
+PCA9685_ADDRESS = 0x40
+MODE1 = 0x00
+
+def test_switching_stops_managers(sim_bus):
+    use_bus_manager(True)
+    bus = open_bus(1, 'servo')
+    assert isinstance(bus, ManagedBus)
+    manager = get_bus_managers()[1]
+    bus.write_byte_data(PCA9685_ADDRESS, MODE1, 0x11)
+    assert bus.read_byte_data(PCA9685_ADDRESS, MODE1) == 0x11
+    use_bus_manager(False)
+    assert not manager.my_thread.is_alive()
+    assert get_bus_managers() == {}
+    with pytest.raises(OSError):
+        bus.read_byte_data(PCA9685_ADDRESS, MODE1)
+    assert open_bus(1) is sim_bus
+
+def test_stop_finishes_queued_requests(sim_bus):
+    manager = i2c_bus.I2CBusManager(sim_bus, 1)
+    with manager.condition:    # hold the thread off while requests queue up
+        requests = [ i2c_bus.BusRequest('imu', [ ('read_byte_data', (PCA9685_ADDRESS, MODE1)) ])
+                     for i in range(3) ]
+        for n, r in enumerate(requests):
+            manager.queue.append((1, n, r))
+        manager.stopping = True
+        manager.condition.notify()
+    manager.my_thread.join(1.0)
+    assert not manager.my_thread.is_alive()
+    assert all(r.done.is_set() and r.error is None for r in requests)
+
+def test_requests_run_in_priority_order(sim_bus):
+    manager = i2c_bus.I2CBusManager(sim_bus, 1)
+    order = []
+    class Recorder:
+        def record(self, name):
+            order.append(name)
+    manager.bus = Recorder()    #type: ignore[assignment]
+    with manager.condition:    # queue everything before the thread looks
+        for n, client in enumerate([ 'battery', 'imu', 'servo', 'other', 'servo' ]):
+            request = i2c_bus.BusRequest(client, [ ('record', (f'{client}{n}',)) ])
+            manager.queue.append((i2c_bus.CLIENT_PRIORITIES.get(client, i2c_bus.DEFAULT_PRIORITY), n, request))
+        i2c_bus.heapq.heapify(manager.queue)
+        manager.condition.notify()
+    manager.stop()
+    assert order == [ 'servo2', 'servo4', 'imu1', 'other3', 'battery0' ]
+    assert manager.stats['servo'].requests == 2
+
+def test_batch_goes_out_as_one_request(sim_bus):
+    use_bus_manager(True)
+    bus = open_bus(1, 'servo')
+    manager = get_bus_managers()[1]
+    sim_bus.write_byte_data(PCA9685_ADDRESS, MODE1, 0x20)    # auto-increment
+    with i2c_bus.bus_batch(bus):
+        for ch in range(4):
+            bus.write_i2c_block_data(PCA9685_ADDRESS, 0x06 + 4 * ch, [ 0, 0, 0x2C, 0x01 ])
+        assert manager.stats.get('servo') is None
+    assert manager.stats['servo'].requests == 1
+    assert manager.stats['servo'].operations == 4
+    assert sim_bus.devices[PCA9685_ADDRESS].get_counts()[:4] == [ 300 ] * 4
@@ -0,0 +1,42 @@
+#coding:utf-8
+
+from __future__ import annotations
+import time
+import pytest
+from i2c_sim import SimulatedBus, SimPCA9685
+
+#
+# SimulatedBus: the devices, the traffic counts and the timing model
+#
+
+def test_traffic_and_timing():
+    bus = SimulatedBus(1, clock=100000, overhead=1e-4, realtime=False)
+    bus.write_byte_data(0x40, 0x00, 0x20)
+    bus.write_i2c_block_data(0x40, 0x06, [ 0, 0, 0x2C, 0x01 ])
+    assert bus.read_byte_data(0x40, 0x00) == 0x20
+    assert bus.transactions == 3
+    assert bus.bytes == 3 + 6 + 4
+    expected = 3 * 1e-4 + (9 * 13 + 6) / 100000
+    assert bus.busy_time == pytest.approx(expected)
+    assert bus.devices[0x40].get_counts()[0] == 300
+    bus.reset_counts()
+    assert (bus.transactions, bus.bytes, bus.busy_time) == (0, 0, 0.0)
+
+def test_realtime_takes_as_long_as_the_bus():
+    bus = SimulatedBus(1, clock=100000, overhead=2e-3, realtime=True)
+    start = time.perf_counter()
+    for i in range(5):
+        bus.read_byte_data(0x68, 0x75)
+    assert time.perf_counter() - start >= bus.busy_time
+
+def test_errors_like_smbus():
+    bus = SimulatedBus(realtime=False)
+    with pytest.raises(OSError):
+        bus.read_byte_data(0x50, 0)
+    with pytest.raises(ValueError):
+        bus.write_i2c_block_data(0x40, 0x06, [ 0 ] * 33)
+
+def test_pca9685_without_auto_increment():
+    device = SimPCA9685(0x41)
+    device.write(0x06, bytes([ 1, 2, 3, 4 ]))
+    assert list(device.regs[0x06:0x0A]) == [ 4, 0, 0, 0 ]
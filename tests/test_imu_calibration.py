@@ -0,0 +1,36 @@
+#coding:utf-8
+
+from __future__ import annotations
+import time
+import numpy as np
+from imu_calibration import ImuCalibration
+
+#
+# ImuCalibration - the saved biases, and when they are reused
+#
+
+def test_save_and_load(tmp_path):
+    filename = str(tmp_path / 'imu_calib.txt')
+    bias = np.array([ 0.1, -0.2, 0.3, 1.5, -0.5, 0.25 ])
+    ImuCalibration(bias, 31.25, 1.7e9).save(filename)
+    calibration = ImuCalibration.load(filename)
+    assert calibration is not None
+    assert calibration.bias.tolist() == bias.tolist()
+    assert calibration.temperature == 31.25
+    assert calibration.timestamp == 1.7e9
+
+def test_load_invalid(tmp_path):
+    filename = tmp_path / 'imu_calib.txt'
+    assert ImuCalibration.load(str(filename)) is None
+    filename.write_text('{ "accel_bias" : [ 1, 2 ], "gyro_bias" : [], "temperature" : 20, "timestamp" : 0 }')
+    assert ImuCalibration.load(str(filename)) is None
+
+def test_matches_temperature_and_age():
+    calibration = ImuCalibration(np.zeros(6), 30.0)
+    assert calibration.matches(34.0, 5.0)
+    assert not calibration.matches(36.0, 5.0)
+    old = ImuCalibration(np.zeros(6), 30.0, time.time() - 10 * 86400)
+    assert old.matches(30.0, 5.0, 30.0)
+    assert not old.matches(30.0, 5.0, 7.0)
+    future = ImuCalibration(np.zeros(6), 30.0, time.time() + 86400)
+    assert not future.matches(30.0, 5.0, 30.0)
@@ -0,0 +1,66 @@
+#coding:utf-8
+
+from __future__ import annotations
+import pytest
+import numpy as np
+from imu_fusion import (AttitudeFilter, KalmanArray, FusionEngine, quaternion_to_angles,
+                        angles_to_quaternion)
+from geometry import Quaternion
+from Kalman import Kalman_filter
+
+#
+# KalmanArray against the scalar filter it replaces, including readings
+# that jump, fed in uneven batches
+#
+
+@pytest.mark.parametrize('scale', [ 1.0, 100.0 ])
+def test_kalman_array_matches_kalman_filter(scale):
+    rng = np.random.default_rng(1)
+    readings = rng.normal(size=(600, 6)) * scale + 9.8
+    kalman = KalmanArray(6, 0.001, 0.1)
+    filtered = np.concatenate([ kalman.filter(readings[i:i+37]) for i in range(0, len(readings), 37) ])
+    scalars = [ Kalman_filter(0.001, 0.1) for i in range(6) ]
+    expected = np.array([ [ f.kalman(v) for f, v in zip(scalars, row) ] for row in readings ])
+    assert np.allclose(filtered, expected, rtol=0, atol=1e-9)
+
+def test_attitude_filter_is_abstract():
+    with pytest.raises(TypeError):
+        AttitudeFilter()    #type: ignore[abstract]
+
+#
+# FusionEngine on synthetic readings
+#
+
+GRAVITY = 9.80665
+
+# the accelerometer reading at rest with the given roll and pitch
+def tilted(roll: float, pitch: float) -> np.ndarray:
+    r, p = np.radians(roll), np.radians(pitch)
+    return GRAVITY * np.array([ -np.sin(p), np.sin(r) * np.cos(p), np.cos(r) * np.cos(p) ])
+
+@pytest.mark.parametrize('filter_type', [ 'mahony', 'complementary' ])
+def test_converges_to_tilt(filter_type):
+    engine = FusionEngine(filter_type, 100.0, kp=2.0, tau=0.2)
+    samples = np.tile(np.concatenate((tilted(-20.0, 10.0), np.zeros(3))), (500 * 5, 1))
+    attitudes = engine.update(samples, 1 / 500)
+    pitch, roll, yaw = quaternion_to_angles(attitudes[-1])
+    assert (pitch, roll) == pytest.approx((10.0, -20.0), abs=0.5)
+    assert engine.steps == 500
+    assert len(attitudes) == len(samples)
+
+def test_integrates_yaw_rate():
+    engine = FusionEngine('mahony', 100.0)
+    samples = np.tile([ 0.0, 0.0, GRAVITY, 0.0, 0.0, 30.0 ], (200, 1))
+    for i in range(0, 200, 20):    # batches of 0.1 S
+        attitudes = engine.update(samples[i:i+20], 0.01)
+    pitch, roll, yaw = quaternion_to_angles(attitudes[-1])
+    assert yaw == pytest.approx(60.0, abs=1.0)
+
+def test_angle_conventions():
+    q = angles_to_quaternion(10.0, -20.0, 30.0)
+    assert np.allclose(quaternion_to_angles(q), [ 10.0, -20.0, 30.0 ])
+    assert np.allclose(Quaternion.to_angles_array(q[np.newaxis])[0], [ -10.0, 20.0, -30.0 ])
+
+def test_unknown_filter():
+    with pytest.raises(ValueError):
+        FusionEngine('kalman', 100.0)
@@ -0,0 +1,134 @@
+#coding:utf-8
+
+from __future__ import annotations
+import numpy as np
+import pytest
+from geometry import Point
+from leg import QuadLeg, ServoIds, LegAngles, LegWorkspace, IKCache
+from servo import the_table
+
+#
+# QuadLeg inverse kinematics and its workspace
+#
+
+FEMUR, TIBIA = 5.3, 6.0
+
+@pytest.fixture
+def leg():
+    return QuadLeg(0, 'fl', Point(5.3, 5.0, 0), FEMUR, TIBIA, ServoIds(4, 3, 2))
+
+# the classification straight from the inverse kinematics, cox included
+def exact_classes(leg: QuadLeg, targets: np.ndarray) -> np.ndarray:
+    angles, reachable = leg.get_angles_array(targets)
+    limits = leg.get_servo_limits()
+    with np.errstate(invalid='ignore'):
+        within = np.all((angles >= limits[:, 0]) & (angles <= limits[:, 1]), axis=1)
+    return np.where(reachable, np.where(within, LegWorkspace.REACHABLE, LegWorkspace.CLAMPED),
+                    LegWorkspace.UNREACHABLE)
+
+def test_solve_ik_matches_get_angles(leg):
+    rng = np.random.default_rng(2)
+    targets = rng.uniform([ -6, -6, -11 ], [ 6, 6, -1 ], size=(200, 3))
+    angles, reachable = leg.get_angles_array(targets)
+    for t, a, ok in zip(targets, angles, reachable):
+        if ok:
+            expected = leg.get_angles(Point(*t))
+            assert np.allclose(a, [ expected.cox, expected.femur, expected.tibia ])
+    assert not reachable[np.linalg.norm(targets[:, [0, 2]], axis=1) > FEMUR + TIBIA + 1].any()
+
+def test_solve_ik_round_trip(leg):
+    rng = np.random.default_rng(4)
+    targets = rng.uniform([ -4, -4, -10 ], [ 4, 4, -4 ], size=(50, 3))
+    angles, reachable = leg.get_angles_array(targets)
+    assert reachable.all()
+    for t, (cox, femur, tibia) in zip(targets, angles):
+        toe = leg.get_toe_pos(LegAngles(cox=cox, femur=femur, tibia=tibia))
+        assert np.allclose(toe.p[:3], t)
+
+def test_solve_ik_per_row_lengths():
+    targets = np.array([ [ 1.0, 0.5, -8.0 ], [ 1.0, 0.5, -8.0 ], [ 0.0, 0.0, -12.0 ] ])
+    femurs, tibias = np.array([ 5.3, 4.0, 5.3 ]), np.array([ 6.0, 5.0, 6.0 ])
+    angles, reachable = QuadLeg.solve_ik(targets, femurs, tibias)
+    assert reachable.tolist() == [ True, True, False ]
+    assert np.isnan(angles[2]).all()
+    for i in range(2):
+        single, ok = QuadLeg.solve_ik(targets[i:i+1], femurs[i], tibias[i])
+        assert np.allclose(single[0], angles[i])
+
+def test_workspace_matches_exact_ik(leg):
+    rng = np.random.default_rng(3)
+    targets = rng.uniform([ -12, -8, -12 ], [ 12, 8, 0 ], size=(4000, 3))
+    expected = exact_classes(leg, targets)
+    ws = leg.get_workspace()
+    assert ws.classify_array(targets).tolist() == expected.tolist()
+    assert [ ws.classify(Point(*t)) for t in targets[:500] ] == expected[:500].tolist()
+
+def test_scalar_and_array_agree_off_the_grid(leg):
+    ws = leg.get_workspace()
+    reach = ws.reach
+    rng = np.random.default_rng(5)
+    targets = rng.uniform([ -reach - 2, -reach - 2, -reach - 2 ], [ reach + 2, reach + 2, 1 ], size=(3000, 3))
+    edges = np.array([ [ reach, 0.0, 0.0 ], [ -reach, 0.0, -0.1 ], [ 0.0, 0.0, -reach ], [ 0.0, 3.0, -reach ],
+                       [ np.nan, 0.0, -5.0 ], [ 0.0, np.inf, -5.0 ], [ -np.inf, 0.0, -5.0 ] ])
+    targets = np.concatenate((targets, edges))
+    with np.errstate(invalid='ignore'):
+        classes = ws.classify_array(targets)
+        assert classes.tolist() == [ ws.classify(Point(*t)) for t in targets ]
+    assert (classes[-3:] == LegWorkspace.UNREACHABLE).all()
+
+def test_targets_just_inside_reach_are_accepted(leg):
+    reach = FEMUR + TIBIA
+    step = leg.get_workspace().resolution
+    for d in (0.2, 0.4, 0.49, 0.51, 0.9):
+        target = Point(0.0, 0.0, -(reach - d * step))
+        assert leg.classify_target(target) != LegWorkspace.UNREACHABLE
+    assert leg.classify_target(Point(0.0, 0.0, -(reach + 0.1 * step))) == LegWorkspace.UNREACHABLE
+
+def test_workspace_rebuilt_on_calibration(leg):
+    ws = leg.get_workspace()
+    assert leg.get_workspace() is ws
+    leg.servos[3].calibration = 20.0
+    rebuilt = leg.get_workspace()
+    assert rebuilt is not ws
+    assert rebuilt.limits.tolist() == leg.get_servo_limits().tolist()
+    assert leg.get_workspace() is rebuilt
+    leg.femur = FEMUR + 0.5
+    assert leg.get_workspace() is not rebuilt
+
+#
+# IKCache
+#
+
+def test_ik_cache_quantizes_and_counts():
+    solved = []
+    def solve(p: Point) -> LegAngles:
+        solved.append(p)
+        return LegAngles(p.x(), p.y(), p.z())
+    cache = IKCache(4, 0.1)
+    a = cache.lookup(Point(1.01, 2.0, -3.04), solve)
+    b = cache.lookup(Point(0.99, 2.02, -2.96), solve)
+    assert len(solved) == 1
+    assert np.allclose(solved[0].p[:3], [ 1.0, 2.0, -3.0 ])
+    assert a == b and a is not b
+    a.cox = 99.0
+    assert cache.lookup(Point(1, 2, -3), solve).cox == 1.0
+    assert (cache.hits, cache.misses) == (2, 1)
+
+def test_ik_cache_evicts_least_recently_used():
+    cache = IKCache(2, 1.0)
+    solve = lambda p: LegAngles(p.x())
+    cache.lookup(Point(1, 0, 0), solve)
+    cache.lookup(Point(2, 0, 0), solve)
+    cache.lookup(Point(1, 0, 0), solve)
+    cache.lookup(Point(3, 0, 0), solve)
+    assert list(cache.entries.keys()) == [ (1, 0, 0), (3, 0, 0) ]
+
+def test_leg_cache_cleared_with_lengths(leg):
+    leg.ik_cache = IKCache(16, 0.01)
+    target = Point(1.0, 0.5, -8.0)
+    before = leg.get_cached_angles(target)
+    leg.tibia = TIBIA + 1
+    assert len(leg.ik_cache.entries) == 0
+    after = leg.get_cached_angles(target)
+    assert after != before
+    assert after == leg.get_angles(target)
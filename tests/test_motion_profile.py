@@ -0,0 +1,74 @@
+#coding:utf-8
+
+from __future__ import annotations
+import numpy as np
+import pytest
+from motion_profile import MotionProfile, blend_waypoints, blend_peaks
+
+#
+# MotionProfile: limits respected, all channels finish together
+#
+
+V_MAX, A_MAX = 600.0, 12000.0
+
+@pytest.mark.parametrize('shape', [ 'trapezoid', 'scurve' ])
+def test_profile_within_limits(shape):
+    distances = np.array([ 90.0, -30.0, 5.0, 0.0 ])
+    profile = MotionProfile(distances, np.full(4, V_MAX), np.full(4, A_MAX), shape)
+    dt = 1e-4
+    times = np.arange(0, profile.duration + dt, dt)
+    s = profile.sample(times) * np.abs(distances)
+    v = np.diff(s, axis=0) / dt
+    a = np.diff(v, axis=0) / dt
+    assert np.allclose(s[-1], np.abs(distances))
+    assert profile.sample(np.array([ 0.0 ])).tolist() == [ [ 0.0, 0.0, 0.0, 1.0 ] ]    # nothing to do is done
+    assert v.max() <= V_MAX * 1.001
+    assert np.abs(a).max() <= A_MAX * 1.01
+    assert (v >= -1e-6).all()
+
+def test_profile_duration():
+    # long move: ramps of v/a either side of a cruise
+    long = MotionProfile(np.array([ 90.0 ]), np.array([ V_MAX ]), np.array([ A_MAX ]))
+    assert np.isclose(long.duration, 90 / V_MAX + V_MAX / A_MAX)
+    # short move: never reaches the velocity limit
+    short = MotionProfile(np.array([ 5.0 ]), np.array([ V_MAX ]), np.array([ A_MAX ]))
+    assert np.isclose(short.duration, 2 * np.sqrt(5 / A_MAX))
+    scurve = MotionProfile(np.array([ 90.0 ]), np.array([ V_MAX ]), np.array([ A_MAX ]), 'scurve')
+    assert scurve.duration > long.duration
+    with pytest.raises(ValueError):
+        MotionProfile(np.array([ 1.0 ]), np.array([ V_MAX ]), np.array([ A_MAX ]), 'linear')
+
+#
+# blend_waypoints
+#
+
+def test_blend_passes_through_waypoints():
+    points = np.array([ [ 0.0, 90.0 ], [ 30.0, 90.0 ], [ 50.0, 60.0 ], [ 20.0, 60.0 ] ])
+    knots = np.array([ 0.0, 0.2, 0.3, 0.6 ])
+    assert np.allclose(blend_waypoints(points, knots, knots), points)
+    times = np.linspace(0, 0.6, 601)
+    curve = blend_waypoints(points, knots, times)
+    # no overshoot: each segment stays between its waypoints
+    for k in range(len(knots) - 1):
+        seg = curve[(times >= knots[k]) & (times <= knots[k+1])]
+        lo, hi = np.minimum(points[k], points[k+1]), np.maximum(points[k], points[k+1])
+        assert (seg >= lo - 1e-9).all() and (seg <= hi + 1e-9).all()
+    # starts and ends at rest, and doesn't stop at a via point it passes through
+    v = np.diff(curve, axis=0) / np.diff(times)[:, np.newaxis]
+    assert np.allclose(v[[0, -1]], 0.0, atol=0.01 * np.abs(v).max())
+    assert abs(v[200, 0]) > 100.0
+
+def test_blend_peaks_match_sampled_curve():
+    points = np.array([ [ 0.0, 90.0 ], [ 15.0, 90.0 ], [ 40.0, 60.0 ], [ 45.0, 60.0 ] ])
+    knots = np.array([ 0.0, 0.1, 0.15, 0.3 ])
+    v, a = blend_peaks(points, knots)
+    times = np.linspace(0, 0.3, 30001)
+    dt = times[1] - times[0]
+    curve = blend_waypoints(points, knots, times)
+    v_sampled = np.abs(np.diff(curve, axis=0) / dt).max(axis=0)
+    a_sampled = np.abs(np.diff(curve, 2, axis=0) / (dt * dt)).max(axis=0)
+    assert np.allclose(v, v_sampled, rtol=1e-3)
+    assert (a >= a_sampled * 0.999).all() and np.allclose(a, a_sampled, rtol=0.02)
+    # stretching time scales them down
+    v2, a2 = blend_peaks(points, knots * 2)
+    assert np.allclose(v2, v / 2) and np.allclose(a2, a / 4)
@@ -0,0 +1,68 @@
+#coding:utf-8
+
+from __future__ import annotations
+import time
+import numpy as np
+import pytest
+from i2c_sim import SimMPU6050
+from MPU6050 import MPU6050, GRAVITY
+
+#
+# MPU6050 on the simulated bus
+#
+
+def get_sim(bus) -> SimMPU6050:
+    return bus.devices[0x68]
+
+# the simulated chip samples by time.monotonic, which this moves on by hand
+@pytest.fixture
+def clock(monkeypatch):
+    now = [ 1000.0 ]
+    monkeypatch.setattr(time, 'monotonic', lambda: now[0])
+    return now
+
+def test_burst_read_decodes_and_scales(sim_bus):
+    imu = MPU6050(address=0x68, accel_range=4, gyro_range=500)
+    sim = get_sim(sim_bus)
+    sim.set_reading((8192, -8192, -32768), -340, (32767 // 2, -100, 0))
+    sim_bus.reset_counts()
+    accel_x, accel_y, accel_z, temp, gyro_x, gyro_y, gyro_z = imu.read().tolist()
+    assert sim_bus.transactions == 1
+    assert (accel_x, accel_y, accel_z) == pytest.approx((GRAVITY, -GRAVITY, -4 * GRAVITY))
+    assert temp == pytest.approx(35.53)
+    assert (gyro_x, gyro_y, gyro_z) == pytest.approx((250 * 16383 / 16384, -100 * 500 / 32768, 0.0))
+
+def test_unsupported_range(sim_bus):
+    with pytest.raises(ValueError):
+        MPU6050(address=0x68, accel_range=3)
+
+def test_fifo_rate_rounds_to_divider(sim_bus):
+    imu = MPU6050(address=0x68)
+    imu.enable_fifo(300)
+    assert imu.fifo_enabled
+    assert 1000 / imu.sample_rate == round(1000 / 300)
+    assert get_sim(sim_bus).regs[SimMPU6050.SMPLRT_DIV] == round(1000 / 300) - 1
+
+def test_fifo_overflow_keeps_whole_samples(sim_bus, clock):
+    imu = MPU6050(address=0x68)
+    imu.enable_fifo(1000)
+    sim = get_sim(sim_bus)
+    sim.set_reading((100, 200, 300), 0, (-1, -2, -3))
+    clock[0] += 1.0    # a second of samples, far more than fit
+    sim.fill_fifo()
+    assert len(sim.fifo) == SimMPU6050.FIFO_SIZE // 12 * 12
+    assert sim.fifo[:12] == sim.fifo[-12:]
+    assert len(imu.read_fifo()) == 0
+    assert imu.fifo_overflows == 1
+
+def test_fifo_samples_in_order(sim_bus, clock):
+    imu = MPU6050(address=0x68, accel_range=2, gyro_range=250)
+    imu.enable_fifo(1000)
+    sim = get_sim(sim_bus)
+    for n in range(1, 4):
+        sim.set_reading((n, 2 * n, 3 * n), 0, (-n, -2 * n, -3 * n))
+        clock[0] += 0.001 + 1e-9    # clear of rounding
+        sim.fill_fifo()
+    samples = imu.read_fifo() / imu.fifo_scale
+    assert np.allclose(samples, [ [ n, 2 * n, 3 * n, -n, -2 * n, -3 * n ] for n in range(1, 4) ])
+    assert len(imu.read_fifo()) == 0
@@ -0,0 +1,38 @@
+#coding:utf-8
+
+from __future__ import annotations
+from PCA9685 import PCA9685
+
+#
+# PCA9685 on the simulated bus
+#
+
+def test_block_write_sets_every_channel(sim_bus):
+    pwm = PCA9685(0x40)
+    sim_bus.reset_counts()
+    counts = [ 200 + 10 * ch for ch in range(12) ]
+    pwm.setPWMMulti(2, [ (0, c) for c in counts ])
+    assert sim_bus.devices[0x40].get_counts()[2:14] == counts
+    assert sim_bus.transactions == 2    # 8 channels to a block
+
+def test_single_channel(sim_bus):
+    pwm = PCA9685(0x40)
+    pwm.setPWM(15, 0, 4000)
+    assert sim_bus.devices[0x40].get_counts()[15] == 4000
+
+def test_unchanged_channels_are_skipped(sim_bus):
+    pwm = PCA9685(0x40)
+    pwm.setPWMMulti(0, [ (0, 300) ] * 8)
+    sim_bus.reset_counts()
+    pwm.setPWMMulti(0, [ (0, 300) ] * 3 + [ (0, 310) ] + [ (0, 300) ] * 3 + [ (0, 320) ])
+    assert sim_bus.transactions == 2
+    assert (pwm.writesIssued, pwm.writesSuppressed) == (10, 6)
+    assert sim_bus.devices[0x40].get_counts()[:8] == [ 300 ] * 3 + [ 310 ] + [ 300 ] * 3 + [ 320 ]
+
+def test_reset_shadow_writes_again(sim_bus):
+    pwm = PCA9685(0x40)
+    pwm.setPWM(4, 0, 250)
+    pwm.setPWMFreq(50)
+    sim_bus.reset_counts()
+    pwm.setPWM(4, 0, 250)
+    assert sim_bus.transactions == 1
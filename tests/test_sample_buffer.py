@@ -0,0 +1,50 @@
+#coding:utf-8
+
+from __future__ import annotations
+import numpy as np
+from sample_buffer import SampleBuffer
+
+#
+# SampleBuffer, across the wrap
+#
+
+def filled(capacity: int, count: int) -> SampleBuffer:
+    buffer = SampleBuffer(capacity, 2)
+    times = np.arange(count) * 0.1
+    values = np.stack([ times * 2 + 1, -times ], axis=1)
+    for i in range(0, count, 7):    # uneven batches
+        buffer.append(times[i:i+7], values[i:i+7])
+    return buffer
+
+def test_keeps_the_latest_samples():
+    buffer = filled(10, 25)
+    assert len(buffer) == 10
+    times, values = buffer.window()
+    assert np.allclose(times, np.arange(15, 25) * 0.1)
+    assert np.allclose(values[:, 0], times * 2 + 1)
+    t, v = buffer.latest()
+    assert np.isclose(t, 2.4) and np.allclose(v, [ 5.8, -2.4 ])
+
+def test_batch_larger_than_capacity():
+    buffer = SampleBuffer(4, 1)
+    buffer.append(np.arange(10.0), np.arange(10.0)[:, np.newaxis])
+    assert buffer.window()[0].tolist() == [ 6.0, 7.0, 8.0, 9.0 ]
+
+def test_window_queries():
+    buffer = filled(10, 25)
+    times, values = buffer.window(1.75, 2.05)
+    assert np.allclose(times, [ 1.8, 1.9, 2.0 ])
+    assert np.allclose(buffer.mean(1.75, 2.05), values.mean(axis=0))
+    assert np.allclose(buffer.value_at(2.05), [ 5.1, -2.05 ])
+    assert np.allclose(buffer.value_at(0.0), [ 4.0, -1.5 ])    # before the oldest: the oldest
+    assert np.allclose(buffer.rate(), [ 2.0, -1.0 ])
+    assert len(buffer.window(5.0)[0]) == 0
+    assert np.isnan(buffer.mean(5.0)).all()
+
+def test_empty():
+    buffer = SampleBuffer(5, 3)
+    assert np.isnan(buffer.value_at(1.0)).all()
+    assert buffer.rate().tolist() == [ 0.0, 0.0, 0.0 ]
+    buffer.append(np.array([ 1.0 ]), np.ones((1, 3)))
+    buffer.clear()
+    assert len(buffer) == 0
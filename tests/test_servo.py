@@ -0,0 +1,125 @@
+#coding:utf-8
+
+from __future__ import annotations
+import numpy as np
+import pytest
+import servo
+from i2c_bus import simulate_pca9685, get_simulated_buses
+from servo import (Servo, PWMServo, ServoGroup, ServoFrame, COUNT_TABLE, the_table, the_frame,
+                   MIN_ANGLE, MAX_ANGLE, LOW_POS, HIGH_POS)
+from servo_action import ServoActionList
+
+#
+# Angle to count conversion, against the calculation it replaced
+#
+
+def reference_count(angle: float, calibration: float, reverse: bool) -> int:
+    calib_angle = angle + calibration
+    rev_angle = round(180 - calib_angle if reverse else calib_angle, 1)
+    true_angle = round(min(max(rev_angle, MIN_ANGLE), MAX_ANGLE), 1)
+    return int(round((HIGH_POS - LOW_POS) * true_angle / 180 + LOW_POS, 1))
+
+def test_counts_match_reference(sim_bus):
+    rng = np.random.default_rng(5)
+    for reverse in (False, True):
+        s9 = PWMServo('s9', 9, reverse)
+        for calibration in (-7.5, 0.0, 3.2):
+            s9.calibration = calibration
+            for angle in rng.uniform(0, 180, 200):
+                s9.set_angle(float(angle))
+                assert the_table.last_count[9] == reference_count(float(angle), calibration, reverse)
+            assert sim_bus.devices[0x40].get_counts()[9] == the_table.last_count[9]
+
+#
+# ServoTable and ServoGroup
+#
+
+def test_mixed_group_sets_only_pwm_channels(sim_bus):
+    leg = PWMServo('leg', 2, False)
+    head = Servo('head', 3, False)
+    rev = PWMServo('rev', 4, True)
+    rev.calibration = 5.0
+    group = ServoGroup(np.array([ leg.channel, head.channel, rev.channel ]))
+    frame = ServoFrame()
+    group.set_frame(np.array([ 60.0, 100.0, 120.0 ]), frame)
+    assert frame.dirty.tolist() == [ c in (2, 4) for c in range(16) ]
+    assert the_table.last_count[2] == COUNT_TABLE[leg.get_index(60.0)]
+    assert the_table.last_count[4] == COUNT_TABLE[rev.get_index(120.0)]
+    assert frame.words[2*3+1] == 0
+
+def test_group_positions_match_servo_set_angle(sim_bus):
+    servos = [ PWMServo(f's{c}', c, c % 2 == 1) for c in range(5, 9) ]
+    for s, c in zip(servos, (-3.0, 0.0, 2.5, 7.0)):
+        s.calibration = c
+    angles = np.array([ 30.0, 75.5, 110.0, 170.0 ])
+    group = ServoGroup(np.array([ s.channel for s in servos ]))
+    group.set_positions(angles)
+    true_angles = [ s.true_angle for s in servos ]
+    for s, a in zip(servos, angles):
+        s.set_angle(float(a))
+    assert true_angles == [ s.true_angle for s in servos ]
+    assert group.get_positions().tolist() == angles.tolist()
+
+#
+# ServoActionList frames: each iteration goes out as one frame
+#
+
+def test_action_list_sends_frames(sim_bus):
+    servos = [ PWMServo(f's{c}', c, False) for c in range(2, 14) ]
+    for s in servos:
+        s.set_angle(90.0)
+    frames, writes = the_frame.frames, the_frame.block_writes
+    sim_bus.reset_counts()
+    with ServoActionList(speed=0.0) as actions:
+        for s in servos:
+            actions.append(s.channel, 86.0 + s.channel / 2)    # all within one iteration
+    assert the_frame.frames == frames + 1
+    assert the_frame.block_writes == writes + 1
+    assert sim_bus.transactions == 2    # 12 channels, in blocks of 8
+    counts = sim_bus.devices[0x40].get_counts()
+    assert counts[2:14] == [ COUNT_TABLE[s.get_index(86.0 + s.channel / 2)] for s in servos ]
+    assert [ s.position for s in servos ] == [ 86.0 + s.channel / 2 for s in servos ]
+
+def test_action_list_frame_per_iteration(sim_bus):
+    s2 = PWMServo('s2', 2, False)
+    s2.set_angle(90.0)
+    frames = the_frame.frames
+    with ServoActionList(speed=0.0) as actions:
+        actions.append(2, 120.0)    # max_servo_iteration degrees at a time
+    assert the_frame.frames == frames + 6
+    assert s2.position == 120.0
+
+def test_frame_runs_split_at_unchanged_channels():
+    frame = ServoFrame(32)
+    frame.set_counts(np.array([ 1, 2, 3, 7, 15, 16, 17 ]), np.array([ 300 ] * 7))
+    assert list(frame.runs(0)) == [ (1, 4), (7, 8), (15, 16) ]
+    assert list(frame.runs(1)) == [ (0, 2) ]
+
+#
+# Several boards, on more than one bus
+#
+
+@pytest.fixture
+def boards(sim_bus):
+    servo.set_boards('1:0x40, 1:0x41, 3:0x40')
+    for bus, address in servo.get_boards():
+        simulate_pca9685(bus, address)
+    yield get_simulated_buses()
+    servo.set_boards('1:0x40')
+
+def test_frame_flushes_every_board(boards):
+    servos = [ PWMServo(f's{c}', c, False) for c in (3, 17, 18, 40) ]
+    group = ServoGroup(np.array([ s.channel for s in servos ]))
+    group.set_frame(np.array([ 70.0, 80.0, 90.0, 100.0 ]), the_frame)
+    the_frame.flush()
+    counts = lambda bus, address: boards[bus].devices[address].get_counts()
+    assert counts(1, 0x40)[3] == COUNT_TABLE[700]
+    assert counts(1, 0x41)[1:3] == [ COUNT_TABLE[800], COUNT_TABLE[900] ]
+    assert counts(3, 0x40)[8] == COUNT_TABLE[1000]
+    assert not the_frame.dirty.any()
+
+def test_board_errors(boards):
+    with pytest.raises(ValueError):
+        PWMServo('s48', 48, False)
+    with pytest.raises(ValueError):
+        servo.set_boards('1:0x40, 0x41')
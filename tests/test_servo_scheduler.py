@@ -0,0 +1,128 @@
+#coding:utf-8
+
+from __future__ import annotations
+import numpy as np
+import pytest
+import time
+from logger import Logger
+from servo import PWMServo, ServoGroup, COUNT_TABLE, the_table
+from servo_scheduler import ServoScheduler
+from servo_action import ServoActionList
+from motion_profile import MotionProfile
+from params import Params
+
+#
+# ServoScheduler, and writes made around it
+#
+
+@pytest.fixture
+def scheduler(sim_bus):
+    ServoScheduler.init()
+    yield ServoScheduler.get()
+    ServoScheduler.stop()
+
+def get_counts(bus) -> list[int]:
+    return bus.devices[0x40].get_counts()
+
+def test_direct_write_waits_for_scheduler(sim_bus, scheduler):
+    servo = PWMServo('s2', 2, False)
+    group = ServoGroup(np.array([ 2 ]))
+    motion = scheduler.submit(group, np.array([ 120.0 ]), 0.2)
+    servo.set_angle(60.0)
+    assert motion.done.is_set()
+    assert servo.position == 60.0
+    assert get_counts(sim_bus)[2] == COUNT_TABLE[servo.get_index(60.0)]
+
+def test_calibration_waits_for_scheduler(sim_bus, scheduler):
+    servo = PWMServo('s3', 3, False)
+    motion = scheduler.submit(ServoGroup(np.array([ 3 ])), np.array([ 100.0 ]), 0.2)
+    servo.calibration = 4.0
+    assert motion.done.is_set()
+    assert get_counts(sim_bus)[3] == COUNT_TABLE[1000]
+
+def test_sync_exec_starts_from_planned_positions(sim_bus, scheduler):
+    servo = PWMServo('s4', 4, False)
+    servo.set_angle(90.0)
+    scheduler.submit(ServoGroup(np.array([ 4 ])), np.array([ 130.0 ]), 0.2)
+    with ServoActionList(speed=0.0) as actions:
+        actions.append(4, 50.0)
+    assert not scheduler.motions
+    assert servo.position == 50.0
+    assert the_table.true_angle[4] == 50.0
+    assert get_counts(sim_bus)[4] == COUNT_TABLE[500]
+
+def test_scheduler_plays_to_targets(sim_bus, scheduler):
+    servos = [ PWMServo(f's{c}', c, c == 6) for c in (5, 6) ]
+    group = ServoGroup(np.array([ 5, 6 ]))
+    scheduler.submit(group, np.array([ 70.0, 110.0 ]), 0.1, blend=True)
+    scheduler.submit(group, np.array([ 100.0, 80.0 ]), 0.1).wait()
+    assert [ s.position for s in servos ] == [ 100.0, 80.0 ]
+    counts = get_counts(sim_bus)
+    assert counts[5:7] == [ COUNT_TABLE[s.get_index(s.position)] for s in servos ]
+    assert scheduler.frames >= 10
+
+def test_unfinished_chain_times_out(sim_bus, monkeypatch):
+    logged = []
+    monkeypatch.setattr(Logger, 'info', staticmethod(lambda text: logged.append(text)))
+    ServoScheduler.init(blend_timeout=0.05)
+    try:
+        scheduler = ServoScheduler.get()
+        servo = PWMServo('s7', 7, False)
+        start = time.monotonic()
+        scheduler.submit(ServoGroup(np.array([ 7 ])), np.array([ 45.0 ]), 0.04, blend=True).wait()
+        assert time.monotonic() - start >= 0.05
+        assert servo.position == 45.0
+        assert any('no stop' in text for text in logged)
+    finally:
+        ServoScheduler.stop()
+
+def test_bus_error_reaches_caller(sim_bus, scheduler):
+    servo = PWMServo('s8', 8, False)
+    del sim_bus.devices[0x40]
+    motion = scheduler.submit(ServoGroup(np.array([ 8 ])), np.array([ 120.0 ]), 0.1)
+    with pytest.raises(OSError):
+        motion.wait()
+    assert scheduler.my_thread.is_alive()
+    assert not scheduler.motions and not scheduler.queued
+    with pytest.raises(OSError):
+        servo.set_angle(60.0)
+
+def test_blended_chain_within_limits(sim_bus, scheduler, monkeypatch):
+    frames = []
+    set_frame = ServoGroup.set_frame
+    def record(self, pos, frame):
+        frames.append(np.array(pos, dtype=float))
+        set_frame(self, pos, frame)
+    monkeypatch.setattr(ServoGroup, 'set_frame', record)
+    servo = PWMServo('s9', 9, False)
+    servo.set_angle(90.0)
+    group = ServoGroup(np.array([ 9 ]))
+    start = 90.0
+    for target, blend in ((105.0, True), (130.0, True), (135.0, False)):
+        profile = MotionProfile.for_group(group, np.array([ target - start ]),
+                                          Params.get('default_speed'), 'trapezoid')
+        motion = scheduler.submit(group, np.array([ target ]), profile.duration, profile,
+                                  blend, profile.cruise_duration)
+        start = target
+    motion.wait()
+    assert servo.position == 135.0
+    positions = np.concatenate(([ 90.0 ], np.concatenate(frames)))
+    velocity = np.diff(positions) / scheduler.period
+    acceleration = np.diff(velocity) / scheduler.period
+    assert np.max(np.abs(velocity)) <= Params.get('servo_max_velocity') * 1.001
+    assert np.max(np.abs(acceleration)) <= Params.get('servo_max_acceleration') * 1.001
+
+def test_still_stop_ends_chain(sim_bus):
+    ServoScheduler.init(blend_timeout=5.0)
+    try:
+        servo = PWMServo('s10', 10, False)
+        servo.set_angle(90.0)
+        start = time.monotonic()
+        with ServoActionList(speed=10.0, blend=True) as actions:
+            actions.append(10, 100.0)
+        with ServoActionList(speed=10.0) as actions:
+            actions.append(10, 100.0)
+        assert time.monotonic() - start < 2.0
+        assert servo.position == 100.0
+    finally:
+        ServoScheduler.stop()